@@ -0,0 +1,26 @@
+"""Shared building blocks for the agent scripts (06, 07 and 08).
+
+Importing the package only loads the tool handlers and conversation
+helpers. The API client is created lazily by agent.client on first use,
+so tests, workers and benchmarks can import the tool layer without
+importing anthropic or opening an HTTP client.
+"""
+
+from agent.conversation import add_assistant_message, add_user_message
+from agent.tools import (
+    handle_create,
+    handle_insert,
+    handle_str_replace,
+    handle_text_editor_tool,
+    handle_view,
+)
+
+__all__ = [
+    "add_assistant_message",
+    "add_user_message",
+    "handle_create",
+    "handle_insert",
+    "handle_str_replace",
+    "handle_text_editor_tool",
+    "handle_view",
+]
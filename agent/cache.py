@@ -0,0 +1,243 @@
+"""Opt-in, content-addressed cache of Messages API responses.
+
+Set RESPONSE_CACHE to a directory to turn it on. Only deterministic
+requests (temperature 0, see AGENT_TEMPERATURE) are cached, keyed by a
+SHA-256 of the canonical request: model, system, messages, tools and
+sampling settings, with prompt-cache breakpoints ignored. Repeated CI and
+eval runs then get their responses from disk without calling the API.
+
+Entries are JSON files under <dir>/<key[:2]>/<key>.json. A hit refreshes
+the entry's mtime, and once the directory grows past
+RESPONSE_CACHE_MAX_BYTES the least recently used entries are removed.
+Streaming callers get a hit back as synthetic stream events, so the
+streaming loop runs unchanged.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+from agent.conversation import block_to_dict
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE")
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+# Request fields that do not change the response
+IGNORED_PARAMS = {"stream", "timeout", "extra_headers"}
+
+_cache = None
+_lock = threading.Lock()
+
+
+def canonical(value):
+    """Return value as plain JSON data with prompt-cache markers removed."""
+    if isinstance(value, dict):
+        return {k: canonical(v) for k, v in value.items() if k != "cache_control"}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return canonical(block_to_dict(value))
+
+
+def cacheable(params):
+    return params.get("temperature") == 0
+
+
+class ResponseCache:
+    """Directory of cached responses with a size-bounded LRU policy."""
+
+    def __init__(self, root, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> (last use, size), read on first use
+        self._total = 0
+
+    def key(self, params):
+        request = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+        data = json.dumps(
+            canonical(request),
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return self.root / key[:2] / f"{key}.json"
+
+    def _load_index(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        self.root.mkdir(parents=True, exist_ok=True)
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    self._entries[entry.name[:-5]] = (stat.st_mtime, stat.st_size)
+                    self._total += stat.st_size
+
+    def get(self, key):
+        """Return the cached message as a dict, or None on a miss."""
+        with self._lock:
+            self._load_index()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self.path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    message = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self._forget(key)
+                self.misses += 1
+                return None
+            self._entries[key] = (path.stat().st_mtime, self._entries[key][1])
+            self.hits += 1
+            return message
+
+    def put(self, key, message):
+        """Store a response (SDK object or dict) and evict old entries if needed."""
+        if hasattr(message, "model_dump"):
+            message = message.model_dump(mode="json", exclude_none=True)
+        data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+        path = self.path(key)
+        with self._lock:
+            self._load_index()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._forget(key, unlink=False)
+            self._entries[key] = (path.stat().st_mtime, len(data))
+            self._total += len(data)
+            self._evict()
+
+    def _forget(self, key, unlink=True):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._total -= entry[1]
+            if unlink:
+                self.path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        for key, _ in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if self._total <= self.max_bytes:
+                break
+            self._forget(key)
+
+
+def get_response_cache():
+    """Return the process-wide cache, or None when RESPONSE_CACHE is not set."""
+    global _cache
+    if RESPONSE_CACHE and _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResponseCache(RESPONSE_CACHE)
+    return _cache
+
+
+def cached_message(message):
+    """Rebuild an SDK Message from a cached response."""
+    from anthropic.types import Message
+
+    return Message.model_validate(message)
+
+
+def as_object(value):
+    """Wrap JSON data so fields read like SDK attributes (block.type, ...)."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: as_object(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [as_object(item) for item in value]
+    return value
+
+
+def stream_events(message):
+    """Yield the stream events that would have produced message."""
+    event = SimpleNamespace
+    yield event(type="message_start", message=as_object({**message, "content": []}))
+    for index, block in enumerate(message["content"]):
+        if block["type"] in ("tool_use", "server_tool_use"):
+            start = {**block, "input": {}}
+        elif block["type"] == "text":
+            start = {"type": "text", "text": ""}
+        else:
+            start = block
+        yield event(
+            type="content_block_start", index=index, content_block=as_object(start)
+        )
+        if block["type"] == "text":
+            delta = event(type="text_delta", text=block["text"])
+            yield event(type="content_block_delta", index=index, delta=delta)
+        elif block["type"] in ("tool_use", "server_tool_use"):
+            delta = event(type="input_json_delta", partial_json=json.dumps(block["input"]))
+            yield event(type="content_block_delta", index=index, delta=delta)
+        yield event(type="content_block_stop", index=index)
+    delta = event(stop_reason=message.get("stop_reason"), stop_sequence=None)
+    yield event(type="message_delta", delta=delta, usage=as_object(message["usage"]))
+    yield event(type="message_stop")
+
+
+class CachedStream:
+    """Replay a cached message through the same interface as a message stream."""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        return stream_events(self.message)
+
+    def get_final_message(self):
+        return as_object(self.message)
+
+
+class CachingStream:
+    """Wrap a live message stream and store its final message once it completes."""
+
+    def __init__(self, manager, cache, key):
+        self.manager = manager
+        self.cache = cache
+        self.key = key
+        self._stream = None
+
+    def __enter__(self):
+        self._stream = self.manager.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.manager.__exit__(*exc_info)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    @property
+    def response(self):
+        return self._stream.response
+
+    def get_final_message(self):
+        message = self._stream.get_final_message()
+        self.cache.put(self.key, message)
+        return message
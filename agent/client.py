@@ -0,0 +1,162 @@
+"""Lazily created API clients shared by every caller in the process.
+
+anthropic and python-dotenv are only imported the first time a client is
+needed, so importing the tool layer never opens an HTTP client.
+
+Every chat, chat_async and chat_stream call goes through one pooled
+client per process, so concurrent sessions reuse warm keep-alive
+connections instead of paying a TLS handshake each. HTTP/2 is off by
+default because it needs h2, which is not a dependency: install it with
+httpx[http2] and set HTTP2=1. Pool size, keep-alive expiry, HTTP/2 and the connect, read and
+stream-idle timeouts are set through create_client() or these variables:
+
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+    HTTP2, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_STREAM_IDLE_TIMEOUT
+"""
+
+import importlib.util
+import logging
+import os
+import threading
+
+# Connection pool: total connections, idle connections kept warm, and how
+# long an idle connection may sit before it is closed
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 multiplexes concurrent requests over one connection; needs h2
+HTTP2 = os.getenv("HTTP2", "0") != "0"
+# Seconds to open a connection, to wait for a whole non-streaming response,
+# and to wait between two events of a stream before giving up
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "600"))
+HTTP_STREAM_IDLE_TIMEOUT = float(os.getenv("HTTP_STREAM_IDLE_TIMEOUT", "60"))
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def _client_options():
+    from dotenv import load_dotenv
+
+    load_dotenv()  # Load environment variables from a .env file if present
+    # Set ANTHROPIC_BASE_URL to talk to a local stand-in such as mock_server.py
+    return {
+        "api_key": os.getenv("ANTHROPIC_API_KEY"),
+        "base_url": os.getenv("ANTHROPIC_BASE_URL"),
+    }
+
+
+def http2_available():
+    """Return whether the optional h2 package needed for HTTP/2 is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def request_timeout(read=None, connect=None, stream=False, stream_idle=None):
+    """Build the httpx timeout for one request.
+
+    For a stream the read timeout is the longest gap allowed between two
+    events, so a stalled stream fails fast while a long one keeps going.
+    """
+    import httpx
+
+    if stream:
+        read = HTTP_STREAM_IDLE_TIMEOUT if stream_idle is None else stream_idle
+    elif read is None:
+        read = HTTP_READ_TIMEOUT
+    connect = HTTP_CONNECT_TIMEOUT if connect is None else connect
+    return httpx.Timeout(read, connect=connect)
+
+
+def create_client(
+    async_client=False,
+    max_connections=None,
+    max_keepalive_connections=None,
+    keepalive_expiry=None,
+    http2=None,
+    connect_timeout=None,
+    read_timeout=None,
+    **options,
+):
+    """Create an Anthropic client on a tuned, pooled httpx transport.
+
+    Unset arguments fall back to the HTTP_* environment settings. HTTP/2
+    is only enabled when h2 is installed; otherwise the pool stays on
+    HTTP/1.1 keep-alive and a warning says so. Remaining options go to the Anthropic constructor.
+    """
+    import httpx
+    from anthropic import (
+        Anthropic,
+        AsyncAnthropic,
+        DefaultAsyncHttpxClient,
+        DefaultHttpxClient,
+    )
+
+    limits = httpx.Limits(
+        max_connections=(
+            HTTP_MAX_CONNECTIONS if max_connections is None else max_connections
+        ),
+        max_keepalive_connections=(
+            HTTP_MAX_KEEPALIVE
+            if max_keepalive_connections is None
+            else max_keepalive_connections
+        ),
+        keepalive_expiry=(
+            HTTP_KEEPALIVE_EXPIRY if keepalive_expiry is None else keepalive_expiry
+        ),
+    )
+    http2 = HTTP2 if http2 is None else http2
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 needs h2 (pip install 'httpx[http2]'); using HTTP/1.1")
+        http2 = False
+    timeout = request_timeout(read=read_timeout, connect=connect_timeout)
+
+    if async_client:
+        http_client = DefaultAsyncHttpxClient(
+            limits=limits, http2=http2, timeout=timeout
+        )
+        client_class = AsyncAnthropic
+    else:
+        http_client = DefaultHttpxClient(limits=limits, http2=http2, timeout=timeout)
+        client_class = Anthropic
+
+    # The request scheduler owns retries, so the SDK must not add its own
+    options = {"max_retries": 0, **_client_options(), **options}
+    return client_class(http_client=http_client, timeout=timeout, **options)
+
+
+def get_client():
+    """Return the shared Anthropic client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def get_async_client():
+    """Return the shared AsyncAnthropic client, creating it on first use.
+
+    The async pool belongs to the event loop that first uses it, so call
+    reset_clients() before starting a new loop with asyncio.run().
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = create_client(async_client=True)
+    return _async_client
+
+
+def reset_clients():
+    """Close the shared clients so the next call re-reads the environment."""
+    global _client, _async_client
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _async_client = None
@@ -0,0 +1,185 @@
+"""Conversation history helpers: message building, compaction and prompt caching."""
+
+import json
+import logging
+import os
+
+# Mark tools, system prompt and conversation prefix for prompt caching
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1") != "0"
+
+# Estimated history size (tokens) that triggers compaction of old messages
+CONTEXT_TOKEN_LIMIT = int(os.getenv("CONTEXT_TOKEN_LIMIT", "100000"))
+# Most recent messages that are never compacted
+CONTEXT_KEEP_RECENT = 6
+# Lengths used when folding old exchanges into a digest
+DIGEST_LINE_LENGTH = 200
+DIGEST_MAX_LINES = 200
+DIGEST_HEADER = "Summary of earlier conversation:"
+ELIDED_MARKER = "[Earlier tool output elided:"
+
+logger = logging.getLogger(__name__)
+
+
+def add_user_message(messages, text):
+    user_message = {"role": "user", "content": text}
+    messages.append(user_message)
+
+
+def add_assistant_message(messages, content):
+    assistant_message = {"role": "assistant", "content": content}
+    messages.append(assistant_message)
+
+
+def block_field(block, name, default=None):
+    """Read a field from a content block that may be a dict or an SDK object."""
+    if isinstance(block, dict):
+        return block.get(name, default)
+    return getattr(block, name, default)
+
+
+def block_to_dict(block):
+    """Convert an SDK content block to a plain dict."""
+    model_dump = getattr(block, "model_dump", None)
+    return model_dump(exclude_none=True) if model_dump else vars(block)
+
+
+def estimate_tokens(value):
+    """Roughly estimate the token size of messages or blocks (about 4 characters per token)."""
+    text = json.dumps(value, default=block_to_dict, ensure_ascii=False)
+    return len(text) // 4
+
+
+def is_turn_start(message):
+    """Check whether a message starts a new exchange, i.e. is user text and not tool results."""
+    if message["role"] != "user":
+        return False
+    content = message["content"]
+    return isinstance(content, str) or not any(
+        block_field(block, "type") == "tool_result" for block in content
+    )
+
+
+def elide_tool_results(messages, end, excess):
+    """Replace old tool_result payloads, oldest first, until about excess tokens are saved."""
+    saved = 0
+    for message in messages[:end]:
+        if saved >= excess:
+            break
+        if message["role"] != "user" or isinstance(message["content"], str):
+            continue
+        for block in message["content"]:
+            if block_field(block, "type") != "tool_result":
+                continue
+            payload = block.get("content", "")
+            if isinstance(payload, str) and payload.startswith(ELIDED_MARKER):
+                continue
+            size = estimate_tokens(payload)
+            block["content"] = f"{ELIDED_MARKER} ~{size} tokens]"
+            saved += size
+    return saved
+
+
+def summarize_messages(messages):
+    """Build a compact plain-text digest of older messages."""
+    lines = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for block in content:
+            block_type = block_field(block, "type")
+            if block_type == "text":
+                text = block_field(block, "text", "")
+                if text.startswith(DIGEST_HEADER):
+                    # Carry an earlier digest forward as-is
+                    lines.extend(text.splitlines()[1:])
+                elif text.strip():
+                    text = " ".join(text.split())
+                    if len(text) > DIGEST_LINE_LENGTH:
+                        text = text[:DIGEST_LINE_LENGTH] + "..."
+                    lines.append(f"- {message['role']}: {text}")
+            elif block_type == "tool_use":
+                tool_input = block_field(block, "input", {})
+                lines.append(
+                    f"- assistant used {block_field(block, 'name')}: "
+                    f"{tool_input.get('command', '')} {tool_input.get('path', '')}".rstrip()
+                )
+    return DIGEST_HEADER + "\n" + "\n".join(lines[-DIGEST_MAX_LINES:])
+
+
+def compact_messages(
+    messages, token_limit=None, keep_recent=CONTEXT_KEEP_RECENT
+):
+    """Shrink messages in place once their estimated size crosses token_limit.
+
+    token_limit defaults to CONTEXT_TOKEN_LIMIT, read at call time.
+
+    Old tool_result payloads are elided first. If that is not enough, every
+    exchange before the last keep_recent messages is folded into a digest at
+    the start of the first kept user turn. Cuts only happen at user turns
+    without tool results, so tool_use/tool_result pairs always stay together.
+    Compacts down to half the limit so the cached prefix stays stable for a
+    while. Returns True when messages were changed.
+    """
+    before = estimate_tokens(messages)
+    if token_limit is None:
+        token_limit = CONTEXT_TOKEN_LIMIT
+    if before <= token_limit:
+        return False
+
+    target = token_limit // 2
+    old_end = max(len(messages) - keep_recent, 0)
+    estimate = before - elide_tool_results(messages, old_end, before - target)
+
+    if estimate > target:
+        cut = max(
+            (i for i in range(1, old_end + 1) if is_turn_start(messages[i])),
+            default=0,
+        )
+        if cut:
+            digest = {"type": "text", "text": summarize_messages(messages[:cut])}
+            first = messages[cut]
+            content = first["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            messages[: cut + 1] = [{**first, "content": [digest, *content]}]
+
+    logger.info(
+        "Compacted conversation: ~%d -> ~%d tokens", before, estimate_tokens(messages)
+    )
+    return True
+
+
+def with_cache_control(block):
+    """Return a copy of a content block marked as a prompt cache breakpoint."""
+    if isinstance(block, str):
+        block = {"type": "text", "text": block}
+    elif not isinstance(block, dict):
+        block = block.model_dump(exclude_none=True)
+    return {**block, "cache_control": {"type": "ephemeral"}}
+
+
+def apply_prompt_caching(params):
+    """Place cache breakpoints on the tools, the system prompt and the latest message.
+
+    The message breakpoint rolls forward each turn so the next request reads
+    the whole conversation prefix from cache. Only copies are marked, so the
+    stored history never piles up stale breakpoints.
+    """
+    tools = params["tools"]
+    params["tools"] = tools[:-1] + [with_cache_control(tools[-1])]
+
+    if params.get("system"):
+        params["system"] = [with_cache_control(params["system"])]
+
+    messages = params["messages"]
+    if messages:
+        last = messages[-1]
+        content = last["content"]
+        if isinstance(content, str):
+            content = [content]
+        if content:
+            content = list(content[:-1]) + [with_cache_control(content[-1])]
+            params["messages"] = messages[:-1] + [{**last, "content": content}]
+
+    return params
@@ -0,0 +1,380 @@
+"""File access for the editor tool: crash-safe writes and buffer caching.
+
+Every edit is written to a temp file next to its target and swapped in with
+os.replace, so a crash leaves either the old file or the new one, never a
+truncated mix. WRITE_DURABILITY decides when edits reach the disk:
+
+- "none": never fsync; the OS writes the data back when it likes.
+- "edit": fsync every file and its directory before the edit returns.
+- "turn": remember the edited paths and fsync them all at once when the
+  agent loop calls sync_writes() at the end of a tool turn.
+
+Each session (one per sandbox root) also keeps a BufferCache of the files
+it works on: decoded text plus a line index, checked against the file's
+(mtime_ns, size, inode) before every use and refreshed from our own
+edits, so a view, str_replace, view sequence reads the file from disk once.
+"""
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from pathlib import Path
+
+WRITE_DURABILITY = os.getenv("WRITE_DURABILITY", "turn")
+DURABILITY_MODES = ("none", "edit", "turn")
+# Bytes of file buffers each session keeps in memory; 0 turns the cache off
+BUFFER_CACHE_MAX_BYTES = int(
+    os.getenv("BUFFER_CACHE_MAX_BYTES", str(8 * 1024 * 1024))
+)
+
+# The only files the tools read, write or search, by extension ("" for none)
+ALLOWED_EXTENSIONS = {
+    ".py",
+    ".txt",
+    ".md",
+    ".json",
+    ".yaml",
+    ".yml",
+    ".js",
+    ".ts",
+    ".html",
+    ".css",
+    ".sh",
+    "",
+}
+
+# Permissions a plain open(path, "w") would give a new file
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def fsync_path(path):
+    """fsync a file or directory by path (directories only where supported)."""
+    flags = os.O_RDONLY
+    if os.path.isdir(path):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        flags |= os.O_DIRECTORY
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AtomicFile:
+    """A temp file that replaces path on commit() and is discarded otherwise.
+
+    Use as a context manager; leaving the block without commit(), for
+    example after finding an edit is ambiguous, leaves path untouched.
+    """
+
+    def __init__(self, path, durability=None):
+        # Write through symlinks: replace the file they point to, not the link
+        self.path = Path(path).resolve()
+        self.durability = durability or WRITE_DURABILITY
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown write durability {self.durability!r}")
+        self.file = None
+        self.tmp_path = None
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp"
+        )
+        self.file = os.fdopen(fd, "wb")
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def commit(self):
+        """Swap the written data in for path, then make it as durable as asked."""
+        self.file.flush()
+        if self.durability == "edit":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        if self.path.exists():
+            shutil.copymode(self.path, self.tmp_path)
+        else:
+            os.chmod(self.tmp_path, 0o666 & ~_UMASK)
+        os.replace(self.tmp_path, self.path)
+
+        if self.durability == "edit":
+            fsync_path(self.path.parent)
+        elif self.durability == "turn":
+            with _pending_lock:
+                _pending.add(self.path)
+
+
+# Bytes per read/write when the kernel cannot copy between the files itself
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Errors meaning "this copy method does not work for these files", not a failure
+_UNSUPPORTED_COPY = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def _read_write(src_fd, dst_fd, offset, count):
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    data = os.read(src_fd, min(count, COPY_CHUNK_SIZE))
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view) :]
+    return len(data)
+
+
+def copy_methods():
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(_copy_file_range)
+    if hasattr(os, "sendfile") and sys.platform == "linux":
+        methods.append(_sendfile)
+    methods.append(_read_write)
+    return methods
+
+
+def copy_range(src_fd, dst_fd, start, end):
+    """Append bytes start..end of src_fd at dst_fd's position.
+
+    Uses copy_file_range or sendfile so the data never passes through
+    Python, falling back to large read/write chunks where they are not
+    supported.
+    """
+    methods = copy_methods()
+    offset = start
+    while offset < end:
+        try:
+            copied = methods[0](src_fd, dst_fd, offset, end - offset)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_COPY or len(methods) == 1:
+                raise
+            methods.pop(0)
+            continue
+        if copied == 0:
+            raise OSError(f"File ended {end - offset} bytes early while copying")
+        offset += copied
+
+
+def detect_newline(data):
+    """Return the line ending of text or bytes: "\r\n" if its first line ends so."""
+    end = data.find("\n" if isinstance(data, str) else b"\n")
+    if end > 0 and data[end - 1 : end] in ("\r", b"\r"):
+        return "\r\n"
+    return "\n"
+
+
+def file_newline(f, size=64 * 1024):
+    """Return the line ending of a file opened in binary mode, then rewind it."""
+    newline = detect_newline(f.read(size))
+    f.seek(0)
+    return newline
+
+
+def match_newlines(text, newline):
+    """Give text the line ending newline, so edits written with "\n" fit CRLF files."""
+    if newline == "\n":
+        return text
+    return text.replace("\r\n", "\n").replace("\n", newline)
+
+
+def write_file(path, text, durability=None):
+    """Atomically replace path with text, encoded as UTF-8."""
+    with AtomicFile(path, durability) as f:
+        f.write(text.encode("utf-8"))
+        f.commit()
+
+
+def sync_writes():
+    """fsync every file written in "turn" mode since the last call, then their directories.
+
+    Returns the number of files synced.
+    """
+    with _pending_lock:
+        paths = list(_pending)
+        _pending.clear()
+    directories = set()
+    for path in paths:
+        try:
+            fsync_path(path)
+        except FileNotFoundError:
+            continue  # Replaced or removed since; nothing left to sync
+        directories.add(path.parent)
+    for directory in directories:
+        fsync_path(directory)
+    return len(paths)
+
+
+def allowed_file(path):
+    """Return whether the tools may touch a file, judging by its extension."""
+    return Path(path).suffix.lower() in ALLOWED_EXTENSIONS
+
+
+def line_range(total, start_line=1, end_line=-1):
+    """Return the 0-based line numbers of start_line..end_line (1-indexed, inclusive).
+
+    Follows list slicing semantics, so out-of-range bounds yield fewer lines.
+    """
+    if end_line == -1:
+        end_line = total
+    return range(total)[start_line - 1 : end_line]
+
+
+def insert_position(line, total):
+    """Index of the line a new line goes before, like list.insert(line, ...) on total lines."""
+    index = line if line >= 0 else max(total + line, 0)
+    return min(index, total)
+
+
+class Buffer:
+    """A file's decoded text, its line starts and the stat signature they match.
+
+    text keeps the file's own line endings; newline says which they are.
+    """
+
+    __slots__ = ("text", "offsets", "signature", "size", "newline")
+
+    def __init__(self, text, signature):
+        self.text = text
+        self.signature = signature
+        self.newline = detect_newline(text)
+        parts = text.split("\n")
+        # Character offset of every line start, plus the end of the last line
+        self.offsets = array("q", [0])
+        self.offsets.extend(accumulate(len(part) + 1 for part in parts[:-1]))
+        if parts[-1]:
+            self.offsets.append(len(text))
+        self.size = len(text) + self.offsets.itemsize * len(self.offsets)
+
+    @property
+    def line_count(self):
+        return len(self.offsets) - 1
+
+    def line_offset(self, line):
+        """Offset where list.insert(line, ...) on the file's lines would insert."""
+        return self.offsets[insert_position(line, self.line_count)]
+
+    def read_lines(self, start_line=1, end_line=-1):
+        """Same as tools.read_lines, from memory."""
+        line_numbers = line_range(self.line_count, start_line, end_line)
+        if not line_numbers:
+            return []
+        first, last = line_numbers[0], line_numbers[-1]
+        data = self.text[self.offsets[first] : self.offsets[last + 1]]
+        return data.split("\n")[: len(line_numbers)]
+
+
+def file_signature(stat):
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class BufferCache:
+    """LRU cache of file buffers, bounded by max_bytes.
+
+    Files larger than a quarter of the budget are not cached, so one huge
+    file cannot push out everything else.
+    """
+
+    def __init__(self, max_bytes=BUFFER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return an up-to-date Buffer for path, or None if it is too big to cache."""
+        path = Path(path).resolve()
+        stat = path.stat()
+        signature = file_signature(stat)
+        with self._lock:
+            buffer = self._buffers.get(path)
+            if buffer and buffer.signature == signature:
+                self._buffers.move_to_end(path)
+                self.hits += 1
+                return buffer
+        self.misses += 1
+        if stat.st_size > self.max_bytes // 4:
+            self.discard(path)
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) != stat.st_size:
+            return None  # Changed while we read it; let the caller use the disk
+        buffer = Buffer(data.decode("utf-8"), signature)
+        self._store(path, buffer)
+        return buffer
+
+    def update(self, path, text):
+        """Record text as the content of path right after we wrote it ourselves."""
+        path = Path(path).resolve()
+        if len(text) > self.max_bytes // 4:
+            self.discard(path)
+            return
+        self._store(path, Buffer(text, file_signature(path.stat())))
+
+    def discard(self, path):
+        with self._lock:
+            buffer = self._buffers.pop(Path(path).resolve(), None)
+            if buffer:
+                self.size -= buffer.size
+
+    def _store(self, path, buffer):
+        with self._lock:
+            old = self._buffers.pop(path, None)
+            if old:
+                self.size -= old.size
+            self._buffers[path] = buffer
+            self.size += buffer.size
+            while self.size > self.max_bytes and len(self._buffers) > 1:
+                _, evicted = self._buffers.popitem(last=False)
+                self.size -= evicted.size
+
+
+_buffer_caches = {}
+_buffer_caches_lock = threading.Lock()
+
+
+def get_buffer_cache(root=None):
+    """Return the buffer cache of the session rooted at root (None: the process cwd).
+
+    Returns None when BUFFER_CACHE_MAX_BYTES is 0.
+    """
+    if BUFFER_CACHE_MAX_BYTES <= 0:
+        return None
+    key = str(Path(root).resolve()) if root else None
+    with _buffer_caches_lock:
+        cache = _buffer_caches.get(key)
+        if cache is None:
+            cache = _buffer_caches[key] = BufferCache()
+        return cache
+
+
+def drop_buffer_cache(root=None):
+    """Free a session's buffers, e.g. when the session is closed."""
+    key = str(Path(root).resolve()) if root else None
+    with _buffer_caches_lock:
+        _buffer_caches.pop(key, None)
@@ -0,0 +1,228 @@
+"""Directory listings for the editor tool's view command.
+
+A view of a directory lists it DIRECTORY_VIEW_DEPTH levels deep, skipping
+what .gitignore files (and DEFAULT_IGNORES) exclude, and returns at most
+DIRECTORY_VIEW_MAX_ENTRIES entries per call; view_range pages through the
+rest. Directories are read with os.scandir, whose entries already know
+whether they are directories, and each directory's entries are cached
+until its mtime changes, so paging and repeated views do not rescan.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DIRECTORY_VIEW_DEPTH = int(os.getenv("DIRECTORY_VIEW_DEPTH", "2"))
+DIRECTORY_VIEW_MAX_ENTRIES = int(os.getenv("DIRECTORY_VIEW_MAX_ENTRIES", "200"))
+DIRECTORY_CACHE_SIZE = int(os.getenv("DIRECTORY_CACHE_SIZE", "4096"))
+# Skipped even without a .gitignore; they are rarely what the agent is after
+DEFAULT_IGNORES = [".git/", "__pycache__/", ".venv/", "node_modules/"]
+
+_directories = OrderedDict()  # path -> (mtime_ns, [(name, is_dir)])
+_ignore_files = {}  # .gitignore path -> ((mtime_ns, size), IgnoreRules)
+_cache_lock = threading.Lock()
+
+
+def translate_pattern(pattern):
+    """Turn a gitignore glob (without !, leading or trailing /) into a regex."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[i + 1 : end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append(f"[{body}]")
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return "".join(parts)
+
+
+class IgnoreRules:
+    """The patterns of one .gitignore, relative to the directory it is in."""
+
+    def __init__(self, base, lines):
+        self.base = base
+        self.rules = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # A slash anywhere but the end anchors the pattern to base
+            if "/" in line:
+                regex = translate_pattern(line.lstrip("/"))
+            else:
+                regex = "(?:.*/)?" + translate_pattern(line)
+            self.rules.append((re.compile(regex + r"\Z"), negate, dir_only))
+
+    def match(self, relative, is_dir):
+        """Return True (ignored), False (re-included) or None (no rule applies)."""
+        result = None
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relative):
+                result = not negate
+        return result
+
+
+DEFAULT_RULES = IgnoreRules(None, DEFAULT_IGNORES)
+
+
+def read_ignore_file(directory):
+    """Return the cached rules of directory/.gitignore, or None if there is none."""
+    path = os.path.join(directory, ".gitignore")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _ignore_files.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        rules = IgnoreRules(directory, f.readlines())
+    with _cache_lock:
+        _ignore_files[path] = (signature, rules)
+    return rules
+
+
+def ancestor_rules(directory):
+    """Rules from the .gitignore files above directory, up to its git repository root."""
+    rules = []
+    current = Path(directory).resolve()
+    for parent in current.parents:
+        found = read_ignore_file(parent)
+        if found:
+            rules.append(found)
+        if (parent / ".git").exists():
+            break
+    else:
+        return []  # Not in a repository: outer .gitignore files do not apply
+    return rules[::-1]
+
+
+def is_ignored(path, is_dir, rules):
+    """Apply rules from outermost to innermost; the last one that matches wins."""
+    result = DEFAULT_RULES.match(os.path.basename(path), is_dir)
+    for ignore in rules:
+        relative = os.path.relpath(path, ignore.base).replace(os.sep, "/")
+        matched = ignore.match(relative, is_dir)
+        if matched is not None:
+            result = matched
+    return bool(result)
+
+
+def scan_directory(directory):
+    """Return [(name, is_dir)] for directory, sorted, cached until its mtime changes."""
+    mtime = os.stat(directory).st_mtime_ns
+    with _cache_lock:
+        cached = _directories.get(directory)
+        if cached and cached[0] == mtime:
+            _directories.move_to_end(directory)
+            return cached[1]
+    entries = []
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append((entry.name, is_dir))
+    entries.sort()
+    with _cache_lock:
+        _directories[directory] = (mtime, entries)
+        if len(_directories) > DIRECTORY_CACHE_SIZE:
+            _directories.popitem(last=False)
+    return entries
+
+
+def walk_directory(directory, depth=DIRECTORY_VIEW_DEPTH):
+    """Return (entries, ignored): visible paths relative to directory, dirs ending in /.
+
+    Lists depth levels below directory, in tree order. Symlinked directories
+    are listed but not entered.
+    """
+    directory = os.path.abspath(directory)
+    entries = []
+    ignored = 0
+
+    def visit(current, prefix, rules, level):
+        nonlocal ignored
+        own = read_ignore_file(current)
+        if own:
+            rules = [*rules, own]
+        for name, is_dir in scan_directory(current):
+            path = os.path.join(current, name)
+            if is_ignored(path, is_dir, rules):
+                ignored += 1
+                continue
+            entries.append(f"{prefix}{name}/" if is_dir else f"{prefix}{name}")
+            if is_dir and level < depth and not os.path.islink(path):
+                visit(path, f"{prefix}{name}/", rules, level + 1)
+
+    visit(directory, "", ancestor_rules(directory), 1)
+    return entries, ignored
+
+
+def view_directory(
+    path,
+    view_range=None,
+    depth=DIRECTORY_VIEW_DEPTH,
+    limit=DIRECTORY_VIEW_MAX_ENTRIES,
+):
+    """Format one page of a directory listing for the view command.
+
+    view_range [first, last] selects entries (1-indexed, inclusive, -1 for
+    the end); at most limit entries are returned either way.
+    """
+    entries, ignored = walk_directory(path, depth)
+    first, last = view_range if view_range else (1, -1)
+    first = max(first, 1)
+    last = len(entries) if last == -1 else min(last, len(entries))
+    last = min(last, first + limit - 1)
+    page = entries[first - 1 : last]
+
+    lines = [f"Directory contents of {path}:", *page]
+    if ignored:
+        lines.append(f"({ignored} ignored entries not shown)")
+    if first > 1 or last < len(entries):
+        shown = f"entries {first}-{last}" if page else "no entries"
+        lines.append(f"(Showing {shown} of {len(entries)})")
+        if last < len(entries):
+            lines.append(
+                f"(View again with view_range [{last + 1}, {last + limit}] for more)"
+            )
+    return "\n".join(lines)
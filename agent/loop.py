@@ -0,0 +1,384 @@
+"""Agent loop: call Claude, run the tools it asks for, repeat within budgets."""
+
+import asyncio
+import os
+import time
+
+from agent.cache import cacheable, cached_message, get_response_cache
+from agent.client import get_async_client, get_client
+from agent.conversation import (
+    PROMPT_CACHING,
+    add_assistant_message,
+    apply_prompt_caching,
+    compact_messages,
+    estimate_tokens,
+)
+from agent.files import sync_writes
+from agent.scheduler import get_scheduler, print_retry
+from agent.tools import EDITOR_TOOLS, TEXT_EDITOR_TOOL, handle_text_editor_tool
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+# Sampling temperature for agent calls; 0 makes them cacheable (see agent.cache)
+AGENT_TEMPERATURE = float(os.getenv("AGENT_TEMPERATURE", "0.7"))
+
+# Maximum number of tool calls from one assistant turn that run at the same time
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+
+# Maximum number of model calls made for a single user message
+MAX_TURNS = 25
+
+
+def build_chat_params(
+    messages, system=None, temperature=AGENT_TEMPERATURE, tools=None, max_tokens=1024
+):
+    params = {
+        "model": MODEL,
+        "max_tokens": max_tokens,
+        "messages": messages,
+        "temperature": temperature,
+        "tools": tools or [TEXT_EDITOR_TOOL],
+    }
+
+    if system:
+        params["system"] = system
+
+    if PROMPT_CACHING:
+        apply_prompt_caching(params)
+
+    return params
+
+
+def response_cache_key(params):
+    """Return (cache, key) for a cacheable request, or (None, None)."""
+    cache = get_response_cache()
+    if cache is None or not cacheable(params):
+        return None, None
+    return cache, cache.key(params)
+
+
+def chat(
+    messages, system=None, temperature=AGENT_TEMPERATURE, tools=None, priority=0
+):
+    params = build_chat_params(messages, system, temperature, tools)
+    cache, key = response_cache_key(params)
+    if cache and (cached := cache.get(key)) is not None:
+        return cached_message(cached)
+    scheduler = get_scheduler()
+
+    def call():
+        response = get_client().messages.with_raw_response.create(**params)
+        scheduler.observe(response.headers)
+        return response.parse()
+
+    response = scheduler.run(
+        call, estimate_tokens(messages), priority, on_retry=print_retry
+    )
+    if cache:
+        cache.put(key, response)
+    return response
+
+
+async def chat_async(
+    messages, system=None, temperature=AGENT_TEMPERATURE, tools=None, priority=0
+):
+    params = build_chat_params(messages, system, temperature, tools)
+    cache, key = response_cache_key(params)
+    if cache and (cached := cache.get(key)) is not None:
+        return cached_message(cached)
+    scheduler = get_scheduler()
+
+    async def call():
+        response = await get_async_client().messages.with_raw_response.create(**params)
+        scheduler.observe(response.headers)
+        return response.parse()
+
+    response = await scheduler.run_async(
+        call, estimate_tokens(messages), priority, on_retry=print_retry
+    )
+    if cache:
+        cache.put(key, response)
+    return response
+
+
+def record_response(response, messages):
+    """Print Claude's response, add it to messages and return its editor tool calls."""
+    response_content = []
+    tool_calls = []
+    search_sources = []
+
+    for content in response.content:
+        if content.type == "text":
+            response_content.append(content)
+            print(f"🤖 {content.text}")
+
+            # Extract and display citations if present
+            if hasattr(content, "citations") and content.citations:
+                print("\n📚 Sources:")
+                for i, citation in enumerate(content.citations, 1):
+                    if hasattr(citation, "url") and hasattr(citation, "title"):
+                        print(f"  [{i}] {citation.title}")
+                        print(f"      {citation.url}")
+                        if hasattr(citation, "cited_text") and citation.cited_text:
+                            print(
+                                f"      \"{citation.cited_text[:100]}{'...' if len(citation.cited_text) > 100 else ''}\""
+                            )
+                        search_sources.append(
+                            {
+                                "title": citation.title,
+                                "url": citation.url,
+                                "cited_text": getattr(citation, "cited_text", ""),
+                            }
+                        )
+                print()
+
+        elif content.type == "tool_use":
+            response_content.append(content)
+            print(f"🔧 Claude is using tool: {content.name}")
+            if content.name in EDITOR_TOOLS:
+                tool_calls.append(content)
+        elif content.type == "server_tool_use":
+            response_content.append(content)
+            print(
+                f"🌐 Claude is searching: {content.input.get('query', 'Unknown query')}"
+            )
+        elif content.type == "web_search_tool_result":
+            response_content.append(content)
+            print(f"📊 Search completed with {len(content.content)} results")
+
+            # Display search results
+            print("🔍 Search Results Found:")
+            for i, result in enumerate(content.content[:3], 1):  # Show first 3 results
+                if hasattr(result, "title") and hasattr(result, "url"):
+                    print(f"  [{i}] {result.title}")
+                    print(f"      {result.url}")
+                    if hasattr(result, "page_age"):
+                        print(f"      Last updated: {result.page_age}")
+            if len(content.content) > 3:
+                print(f"  ... and {len(content.content) - 3} more results")
+            print()
+
+    # Add Claude's response to messages first (preserve all content including citations)
+    # An empty assistant turn would be rejected on the next request
+    if response_content:
+        add_assistant_message(messages, response_content)
+    return tool_calls
+
+
+def add_tool_results(messages, tool_calls, results):
+    """Add tool results to the conversation, in the same order as the tool calls."""
+    tool_results = []
+    for tool_call, tool_result in zip(tool_calls, results):
+        print(f"📁 Tool result: {tool_result}")
+        tool_results.append(
+            {
+                "type": "tool_result",
+                "tool_use_id": tool_call.id,
+                "content": tool_result,
+            }
+        )
+
+    if tool_results:
+        messages.append({"role": "user", "content": tool_results})
+    return bool(tool_results)
+
+
+def process_claude_response(response, messages):
+    """Process one Claude response and run any tool calls it makes.
+
+    Returns True when tool results were added and Claude must be called again.
+    """
+    # Add Claude's response to messages first
+    tool_calls = record_response(response, messages)
+
+    # Then handle tool use if present
+    results = [handle_text_editor_tool(tool_call) for tool_call in tool_calls]
+    # Make the turn's edits durable together before Claude sees the results
+    sync_writes()
+    return add_tool_results(messages, tool_calls, results)
+
+
+async def run_tool_calls_async(tool_calls, max_concurrency=TOOL_CONCURRENCY):
+    """Run tool calls concurrently in worker threads, returning results in call order.
+
+    Calls on the same path still run one after another, in the order Claude
+    sent them, so a view that follows an edit sees the edited file.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    path_locks = {}
+
+    async def run(tool_call):
+        # Equivalent spellings of a path ("a.py", "./a.py") share one lock
+        path = os.path.normpath(tool_call.input.get("path", "").lstrip("/") or ".")
+        async with path_locks.setdefault(path, asyncio.Lock()):
+            async with semaphore:
+                return await asyncio.to_thread(handle_text_editor_tool, tool_call)
+
+    return await asyncio.gather(*(run(tool_call) for tool_call in tool_calls))
+
+
+async def process_claude_response_async(
+    response, messages, max_concurrency=TOOL_CONCURRENCY
+):
+    """Process one Claude response, running its tool calls concurrently."""
+    tool_calls = record_response(response, messages)
+
+    results = await run_tool_calls_async(tool_calls, max_concurrency)
+    await asyncio.to_thread(sync_writes)
+    return add_tool_results(messages, tool_calls, results)
+
+
+def new_run_result():
+    return {
+        "stop_reason": "max_turns",
+        "error": None,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cache_read_input_tokens": 0,
+        "cache_creation_input_tokens": 0,
+        "turns": [],
+    }
+
+
+def record_turn(result, usage, model_seconds, total_seconds):
+    """Add one turn's token usage and timings to a run result."""
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", 0) or 0
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    result["input_tokens"] += input_tokens
+    result["output_tokens"] += output_tokens
+    result["cache_read_input_tokens"] += cache_read
+    result["cache_creation_input_tokens"] += cache_written
+    result["turns"].append(
+        {
+            "turn": len(result["turns"]) + 1,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_written,
+            "model_seconds": model_seconds,
+            "tool_seconds": total_seconds - model_seconds,
+            "total_seconds": total_seconds,
+        }
+    )
+
+
+def print_cache_usage(usage, log=print):
+    """Report prompt cache reads and writes for one turn."""
+    read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    if read or written:
+        log(f"💾 Prompt cache: {read} tokens read, {written} tokens written")
+
+
+def budget_exhausted(result, max_total_tokens, deadline):
+    """Return the budget that stops the run, or None to keep going."""
+    if (
+        max_total_tokens is not None
+        and result["input_tokens"] + result["output_tokens"] >= max_total_tokens
+    ):
+        return "max_total_tokens"
+    if deadline is not None and time.monotonic() >= deadline:
+        return "deadline"
+    return None
+
+
+def run_agent(
+    messages,
+    system=None,
+    tools=None,
+    max_turns=MAX_TURNS,
+    max_total_tokens=None,
+    deadline=None,
+):
+    """Call Claude and run its tools until it stops asking for them or a budget runs out.
+
+    Loops instead of recursing, so long sessions keep a flat stack. deadline
+    is a time.monotonic() timestamp. Returns a run result dict with the stop
+    reason, token totals and per-turn timings.
+    """
+    result = new_run_result()
+
+    for _ in range(max_turns):
+        stop_reason = budget_exhausted(result, max_total_tokens, deadline)
+        if stop_reason:
+            result["stop_reason"] = stop_reason
+            break
+
+        if compact_messages(messages):
+            print(f"🗜️ Compacted conversation to ~{estimate_tokens(messages)} tokens")
+
+        started = time.perf_counter()
+        try:
+            response = chat(messages, system=system, tools=tools)
+        except Exception as e:
+            print(f"Error in response: {e}")
+            result["stop_reason"] = "error"
+            result["error"] = str(e)
+            break
+        model_seconds = time.perf_counter() - started
+
+        needs_follow_up = process_claude_response(response, messages)
+        print_cache_usage(response.usage)
+        record_turn(
+            result, response.usage, model_seconds, time.perf_counter() - started
+        )
+
+        if not needs_follow_up:
+            result["stop_reason"] = "end_turn"
+            break
+
+    return result
+
+
+async def run_agent_async(
+    messages,
+    system=None,
+    tools=None,
+    max_turns=MAX_TURNS,
+    max_total_tokens=None,
+    deadline=None,
+    max_concurrency=TOOL_CONCURRENCY,
+):
+    """Async version of run_agent that runs each turn's tool calls concurrently."""
+    result = new_run_result()
+
+    for _ in range(max_turns):
+        stop_reason = budget_exhausted(result, max_total_tokens, deadline)
+        if stop_reason:
+            result["stop_reason"] = stop_reason
+            break
+
+        if compact_messages(messages):
+            print(f"🗜️ Compacted conversation to ~{estimate_tokens(messages)} tokens")
+
+        started = time.perf_counter()
+        try:
+            response = await chat_async(messages, system=system, tools=tools)
+        except Exception as e:
+            print(f"Error in response: {e}")
+            result["stop_reason"] = "error"
+            result["error"] = str(e)
+            break
+        model_seconds = time.perf_counter() - started
+
+        needs_follow_up = await process_claude_response_async(
+            response, messages, max_concurrency
+        )
+        print_cache_usage(response.usage)
+        record_turn(
+            result, response.usage, model_seconds, time.perf_counter() - started
+        )
+
+        if not needs_follow_up:
+            result["stop_reason"] = "end_turn"
+            break
+
+    return result
+
+
+def print_run_result(result, log=print):
+    """Tell the user when a run stopped before Claude finished."""
+    if result["stop_reason"] not in ("end_turn", "error"):
+        log(f"⚠️ Agent stopped early: {result['stop_reason']}")
@@ -0,0 +1,228 @@
+"""Size limits for the tool results that go into the conversation.
+
+Every later request resends every earlier tool result, so one view of a
+50k-line file would make the rest of the conversation enormous. A result
+over TOOL_RESULT_MAX_BYTES is cut down to its first and last lines with a
+note in between, and the full text is saved in the session's scratch
+directory under TOOL_RESULT_SCRATCH_ROOT. The note gives a handle the
+model passes to the read_result tool to page through the rest.
+
+Handles are derived from the result's content, so the same oversized
+output always gets the same handle and is only saved once. A session's
+saved results are deleted when it is closed; without a sandbox root the
+session is the process, so they are deleted when it exits.
+
+Lines are counted the way the result numbers them: a view of lines
+1000-5000 of a file is paged through as lines 1000-5000, not 1-4001.
+"""
+
+import atexit
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+
+from agent.files import line_range, write_file
+
+# About 8k tokens at the usual 4 bytes per token
+TOOL_RESULT_MAX_BYTES = int(os.getenv("TOOL_RESULT_MAX_BYTES", str(32 * 1024)))
+TOOL_RESULT_SCRATCH_ROOT = os.getenv("TOOL_RESULT_SCRATCH_ROOT", ".tool_results")
+# Share of a cut result's budget spent on its last lines; the rest shows the first
+TOOL_RESULT_TAIL_FRACTION = 0.25
+# Bytes kept free for the note that says what was left out
+NOTE_BYTES = 400
+# Lines the notes suggest reading at a time
+PAGE_LINES = 200
+
+READ_RESULT_TOOL = {
+    "name": "read_result",
+    "description": (
+        "Page through a tool result that was too long to show in full. Long "
+        "results are cut down to their first and last lines and saved under "
+        "a handle; pass that handle and the lines you want to read."
+    ),
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "handle": {"type": "string", "description": "Handle of the saved result"},
+            "view_range": {
+                "type": "array",
+                "items": {"type": "integer"},
+                "description": (
+                    "[first, last] lines to read, numbered as in the note; "
+                    "-1 for the end"
+                ),
+            },
+        },
+        "required": ["handle"],
+    },
+}
+
+HANDLE = re.compile(r"[0-9a-f]{12}")
+NUMBERED_LINE = re.compile(r"(\d+): ")
+
+# Scratch directories of the sessions that end with the process
+_process_scratch = set()
+
+
+def scratch_dir(root=None):
+    """Directory holding the saved results of the session rooted at root."""
+    key = str(Path(root or ".").resolve())
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return Path(TOOL_RESULT_SCRATCH_ROOT).resolve() / digest
+
+
+def spill(text, root=None):
+    """Save text in the session's scratch directory and return its handle."""
+    handle = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+    path = scratch_dir(root) / f"{handle}.txt"
+    if root is None:
+        _process_scratch.add(path.parent)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_file(path, text, durability="none")
+    return handle
+
+
+def line_offset(text, total):
+    """Number of the line before text's first, if its lines are numbered "N: ".
+
+    Text whose total lines are numbered consecutively (file views) is counted
+    in those numbers; anything else counts from 1 and gets 0.
+    """
+    first = NUMBERED_LINE.match(text)
+    last = NUMBERED_LINE.match(text, text.rfind("\n") + 1)
+    if first and last and int(last[1]) - int(first[1]) == total - 1:
+        return int(first[1]) - 1
+    return 0
+
+
+def line_span(offset, total):
+    """How the notes describe all of a result's lines: "1000", or "1000-5000"."""
+    return str(total) if offset == 0 else f"{offset + 1}-{offset + total}"
+
+
+def limit_result(result, root=None, max_bytes=TOOL_RESULT_MAX_BYTES):
+    """Return result, or its first and last lines if it is over max_bytes.
+
+    The full result is spilled to the scratch directory first, and the note
+    between the two windows says which lines are missing and how to read
+    them with read_result.
+    """
+    if not isinstance(result, str):
+        return result
+    data = result.encode("utf-8")
+    if len(data) <= max_bytes:
+        return result
+
+    handle = spill(result, root)
+    total = data.count(b"\n") + 1
+    offset = line_offset(result, total)
+    budget = max(max_bytes - NOTE_BYTES, 0)
+    tail_budget = int(budget * TOOL_RESULT_TAIL_FRACTION)
+    head_budget = budget - tail_budget
+
+    # Cut at the last line break that fits; a single long line is cut in two
+    head_end = data.rfind(b"\n", 0, head_budget + 1)
+    if head_end == -1:
+        head_end = head_budget
+    next_line = data.count(b"\n", 0, head_end) + 1
+    if data[head_end : head_end + 1] == b"\n":
+        next_line += 1
+    # The tail starts at the first whole line that fits
+    tail_start = data.find(b"\n", len(data) - tail_budget - 1) + 1
+    if tail_start == 0:
+        tail_start = len(data)
+    tail_first = total + 1
+    if tail_start < len(data):
+        tail_first = data.count(b"\n", 0, tail_start) + 1
+
+    page_last = min(next_line + PAGE_LINES - 1, total)
+    note = (
+        f"... [lines {offset + next_line}-{offset + tail_first - 1} of "
+        f"{line_span(offset, total)} not shown. Call read_result with handle "
+        f"{handle!r} and view_range [{offset + next_line}, {offset + page_last}] "
+        "to read them.] ..."
+    )
+    parts = [data[:head_end].decode("utf-8", errors="ignore"), note]
+    if tail_start < len(data):
+        parts.append(data[tail_start:].decode("utf-8", errors="ignore"))
+    return "\n".join(parts)
+
+
+def read_result(handle, view_range=None, root=None, max_bytes=TOOL_RESULT_MAX_BYTES):
+    """Handle a read_result tool call: return lines of a saved result.
+
+    Returns as many of the requested lines as fit in max_bytes, then says
+    which view_range to ask for next.
+    """
+    try:
+        handle = (handle or "").strip("'\"")
+        if not HANDLE.fullmatch(handle):
+            return f"Error: Unknown result handle {handle!r}"
+        path = scratch_dir(root) / f"{handle}.txt"
+        try:
+            text = path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return f"Error: Result {handle} is no longer available"
+
+        lines = text.split("\n")
+        offset = line_offset(text, len(lines))
+        first, last = view_range if view_range else (1, -1)
+        # Start at the first line when asked for one before it, e.g. line 0
+        first = max(first, offset + 1)
+        if last == -1:
+            last = offset + len(lines)
+        line_numbers = line_range(len(lines), first - offset, last - offset)
+        if last < first or not line_numbers:
+            return (
+                f"Error: view_range {list(view_range)} is outside result "
+                f"{handle}, which has lines {offset + 1}-{offset + len(lines)}"
+            )
+
+        budget = max(max_bytes - NOTE_BYTES, 1)
+        page = []
+        for number in line_numbers:
+            line = lines[number]
+            size = len(line.encode("utf-8")) + 1
+            if size > budget:
+                if not page:
+                    page.append(line.encode("utf-8")[:budget].decode("utf-8", "ignore"))
+                break
+            page.append(line)
+            budget -= size
+
+        shown_first = offset + line_numbers[0] + 1
+        shown_last = line_numbers[0] + len(page)
+        span = line_span(offset, len(lines))
+        footer = f"(Lines {shown_first}-{offset + shown_last} of {span}"
+        if shown_last < len(lines):
+            next_last = min(shown_last + PAGE_LINES, len(lines))
+            footer += (
+                f"; view_range [{offset + shown_last + 1}, {offset + next_last}] "
+                "reads on"
+            )
+        return "\n".join([*page, footer + ")"])
+
+    except Exception as e:
+        return f"Error reading result: {str(e)}"
+
+
+def drop_results(root=None):
+    """Delete a session's saved results, e.g. when the session is closed."""
+    remove_scratch(scratch_dir(root))
+
+
+def remove_scratch(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        directory.parent.rmdir()  # Only goes once no other session uses it
+    except OSError:
+        pass
+
+
+@atexit.register
+def _drop_process_results():
+    while _process_scratch:
+        remove_scratch(_process_scratch.pop())
@@ -0,0 +1,306 @@
+"""Admission control and retries for every Messages API call in the process.
+
+The scheduler sits between the agent loops and the shared client:
+
+- Rate limits: the anthropic-ratelimit-* response headers say how many
+  requests and input/output tokens are left until their reset time.
+  Requests whose estimated input tokens do not fit wait for the reset
+  instead of being sent into a 429, and retry-after pauses everyone.
+- Priority: waiting requests are admitted lowest priority number first,
+  in arrival order within a priority.
+- Adaptive concurrency (AIMD): every success raises the concurrency limit
+  by about one per round of requests. A 429/529 or overloaded error halves
+  it, at most once per SCHEDULER_DECREASE_INTERVAL.
+- Retries: throttling, overload, 5xx and connection errors are retried
+  with full-jitter exponential backoff. Failed streams are re-requested
+  from scratch, so a retried turn never mixes two partial responses.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16"))
+SCHEDULER_INITIAL_CONCURRENCY = float(os.getenv("SCHEDULER_INITIAL_CONCURRENCY", "4"))
+SCHEDULER_MAX_RETRIES = int(os.getenv("SCHEDULER_MAX_RETRIES", "6"))
+SCHEDULER_BACKOFF_BASE = float(os.getenv("SCHEDULER_BACKOFF_BASE", "0.5"))
+SCHEDULER_BACKOFF_MAX = float(os.getenv("SCHEDULER_BACKOFF_MAX", "30"))
+SCHEDULER_DECREASE_INTERVAL = float(os.getenv("SCHEDULER_DECREASE_INTERVAL", "1.0"))
+
+# Error types the API reports for throttling and overload
+THROTTLE_ERRORS = {"rate_limit_error", "overloaded_error"}
+TRANSIENT_ERRORS = {"api_error", "timeout_error"}
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+def error_type(error):
+    """Return the API error type ("overloaded_error", ...) carried by an exception."""
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        inner = body.get("error", body)
+        if isinstance(inner, dict):
+            return inner.get("type")
+    return None
+
+
+def classify_error(error):
+    """Return "throttle", "transient" or None (do not retry) for an exception."""
+    import httpx
+    from anthropic import APIConnectionError, APIStatusError
+
+    kind = error_type(error)
+    status = getattr(error, "status_code", None)
+    if kind in THROTTLE_ERRORS or status in (429, 529):
+        return "throttle"
+    if kind in TRANSIENT_ERRORS:
+        return "transient"
+    if isinstance(error, APIStatusError):
+        return "transient" if status >= 500 else None
+    # Connection drops and timeouts, including ones raised mid-stream
+    if isinstance(error, (APIConnectionError, httpx.TransportError)):
+        return "transient"
+    return None
+
+
+def parse_reset(value, now):
+    """Turn an RFC 3339 reset timestamp into a time.monotonic() deadline."""
+    try:
+        reset = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    seconds = (reset - datetime.now(timezone.utc)).total_seconds()
+    return now + max(seconds, 0.0)
+
+
+class Budget:
+    """What is left of one rate limit and when it refills."""
+
+    def __init__(self):
+        self.remaining = None  # Unknown until the first response
+        self.reset_at = 0.0
+
+    def delay(self, needed, now):
+        """Seconds to wait before needed units fit, 0 when they fit now."""
+        if self.remaining is None or needed <= self.remaining or now >= self.reset_at:
+            return 0.0
+        return self.reset_at - now
+
+    def reserve(self, amount, now):
+        if self.remaining is None:
+            return
+        if now >= self.reset_at:
+            self.remaining = None  # Refilled; wait for fresh headers
+        else:
+            self.remaining -= amount
+
+
+class RequestScheduler:
+    """Priority admission, rate-limit budgets, AIMD concurrency and retries."""
+
+    def __init__(
+        self,
+        max_concurrency=SCHEDULER_MAX_CONCURRENCY,
+        initial_concurrency=SCHEDULER_INITIAL_CONCURRENCY,
+        min_concurrency=1,
+        max_retries=SCHEDULER_MAX_RETRIES,
+        backoff_base=SCHEDULER_BACKOFF_BASE,
+        backoff_max=SCHEDULER_BACKOFF_MAX,
+        decrease_interval=SCHEDULER_DECREASE_INTERVAL,
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.decrease_interval = decrease_interval
+        self.active = 0
+        self.paused_until = 0.0
+        self.budgets = {
+            "requests": Budget(),
+            "input-tokens": Budget(),
+            "output-tokens": Budget(),
+        }
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0}
+        self._waiting = []
+        self._order = itertools.count()
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def _admission_delay(self, tokens, now):
+        return max(
+            self.paused_until - now,
+            self.budgets["requests"].delay(1, now),
+            self.budgets["input-tokens"].delay(tokens, now),
+            self.budgets["output-tokens"].delay(1, now),
+            0.0,
+        )
+
+    def acquire(self, tokens=0, priority=0, cancelled=None):
+        """Block until this request may be sent; pair with release().
+
+        Returns False without taking a slot once the cancelled event is set
+        and the waiters are notified.
+        """
+        entry = (priority, next(self._order))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._condition.notify_all()
+                    return False
+                if self._waiting[0] == entry and self.active < int(self.limit):
+                    now = time.monotonic()
+                    delay = self._admission_delay(tokens, now)
+                    if delay <= 0:
+                        heapq.heappop(self._waiting)
+                        self.active += 1
+                        self.stats["requests"] += 1
+                        self.budgets["requests"].reserve(1, now)
+                        self.budgets["input-tokens"].reserve(tokens, now)
+                        self._condition.notify_all()
+                        return True
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+
+    async def acquire_async(self, tokens=0, priority=0):
+        """Async version of acquire(); a cancelled wait never keeps a slot."""
+        cancelled = threading.Event()
+        waiting = asyncio.ensure_future(
+            asyncio.to_thread(self.acquire, tokens, priority, cancelled)
+        )
+        try:
+            await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            cancelled.set()
+            with self._condition:
+                self._condition.notify_all()
+            # The slot may have been taken just before the cancel arrived
+            waiting.add_done_callback(
+                lambda done: done.result() and self.release("error")
+            )
+            raise
+
+    def release(self, outcome="success"):
+        """Free a slot and adapt the concurrency limit to how the request went."""
+        with self._condition:
+            self.active -= 1
+            now = time.monotonic()
+            if outcome == "success":
+                # Additive increase: about +1 once every request in flight succeeded
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif outcome == "throttle":
+                self.stats["throttled"] += 1
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+            self._condition.notify_all()
+
+    def observe(self, headers):
+        """Update the budgets from a response's rate-limit headers."""
+        if headers is None:
+            return
+        with self._condition:
+            now = time.monotonic()
+            for name, budget in self.budgets.items():
+                remaining = headers.get(f"anthropic-ratelimit-{name}-remaining")
+                if remaining is not None:
+                    budget.remaining = int(remaining)
+                    reset_at = parse_reset(
+                        headers.get(f"anthropic-ratelimit-{name}-reset"), now
+                    )
+                    budget.reset_at = reset_at if reset_at is not None else now + 60
+            retry_after = headers.get("retry-after")
+            if retry_after is not None:
+                try:
+                    self.paused_until = max(self.paused_until, now + float(retry_after))
+                except ValueError:
+                    pass
+            self._condition.notify_all()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt."""
+        ceiling = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return random.uniform(0, ceiling)
+
+    def _failed(self, error, attempt):
+        """Record a failed attempt; return the delay before retrying or re-raise."""
+        kind = classify_error(error)
+        response = getattr(error, "response", None)
+        self.observe(getattr(response, "headers", None))
+        self.release("throttle" if kind == "throttle" else "error")
+        if kind is None or attempt >= self.max_retries:
+            raise error
+        with self._condition:
+            self.stats["retries"] += 1
+        return self.backoff(attempt)
+
+    def run(self, call, tokens=0, priority=0, on_retry=None):
+        """Run call() under the scheduler, retrying throttled and transient failures.
+
+        tokens is the estimated input size used against the token budget.
+        on_retry(error, delay, attempt) is called before each retry.
+        """
+        for attempt in itertools.count():
+            self.acquire(tokens, priority)
+            try:
+                result = call()
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if on_retry:
+                    on_retry(e, delay, attempt + 1)
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.release("error")
+                raise
+            self.release()
+            return result
+
+    async def run_async(self, call, tokens=0, priority=0, on_retry=None):
+        """Async version of run(); call returns an awaitable."""
+        for attempt in itertools.count():
+            await self.acquire_async(tokens, priority)
+            try:
+                result = await call()
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if on_retry:
+                    on_retry(e, delay, attempt + 1)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.release("error")
+                raise
+            self.release()
+            return result
+
+
+def get_scheduler():
+    """Return the process-wide scheduler shared by every chat call."""
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
+
+
+def reset_scheduler():
+    global _scheduler
+    with _lock:
+        _scheduler = None
+
+
+def print_retry(error, delay, attempt, log=print):
+    log(f"⏳ {type(error).__name__}: retrying in {delay:.1f}s (attempt {attempt})")
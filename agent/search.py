@@ -0,0 +1,607 @@
+"""Code search for the agent, backed by an incremental trigram index.
+
+Every text file under a sandbox root that the editor tool may view (the
+same extension allow-list, no links out of the root) is indexed by the
+lowercase three-character substrings of its words. Like directory views,
+the walk skips what .gitignore files exclude, and it never enters the
+directories the agent keeps its own state in. A query only opens the files that
+contain every trigram the query requires, then reports matching lines,
+ranked so the files with the most hits come first.
+
+A background thread per sandbox root keeps the index current from file
+mtimes and sizes: every SEARCH_RESCAN_INTERVAL seconds it re-stats the tree
+and re-indexes only what changed. Queries never wait for a rescan; every
+file a query opens is checked first, and one found changed is re-indexed
+on the thread's next pass. The index is saved under SEARCH_INDEX_ROOT right after
+its first build, then at most every SEARCH_SAVE_INTERVAL seconds and when
+the session or the process ends.
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from pathlib import Path
+
+from agent import cache, results, store
+from agent.files import AtomicFile, allowed_file
+from agent.listing import ancestor_rules, is_ignored, read_ignore_file
+
+SEARCH_INDEX_ROOT = os.getenv("SEARCH_INDEX_ROOT", ".search_index")
+SEARCH_RESCAN_INTERVAL = float(os.getenv("SEARCH_RESCAN_INTERVAL", "2.0"))
+SEARCH_SAVE_INTERVAL = float(os.getenv("SEARCH_SAVE_INTERVAL", "60.0"))
+SEARCH_MAX_FILE_BYTES = int(os.getenv("SEARCH_MAX_FILE_BYTES", str(1024 * 1024)))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "50"))
+# Directories that are never worth searching
+SEARCH_SKIP_DIRS = {".git", ".hg", ".venv", "venv", "node_modules", "__pycache__"}
+INDEX_VERSION = 3
+
+SEARCH_TOOL = {
+    "name": "search",
+    "description": (
+        "Search the files in the working directory and get matching lines as "
+        "path:line: text, files with the most matches first. Use this to find "
+        "where a symbol is defined or used instead of viewing files one by one."
+    ),
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Text or regex to find"},
+            "regex": {
+                "type": "boolean",
+                "description": "Treat query as a Python regular expression",
+            },
+            "case_sensitive": {"type": "boolean"},
+            "path": {
+                "type": "string",
+                "description": "Only search under this directory",
+            },
+        },
+        "required": ["query"],
+    },
+}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+# Trigrams are taken from runs of word characters, so repeated identifiers
+# are only split once per file; a query needs only its own runs' trigrams
+WORD = re.compile(rb"\w+")
+
+
+def trigrams(data):
+    """Return the lowercase trigrams of every word in data (bytes) as one set."""
+    joined = b"\n".join(set(WORD.findall(data.lower())))
+    grams = {joined[i : i + 3] for i in range(len(joined) - 2)}
+    # Drop the ones that span two words
+    return {gram for gram in grams if 10 not in gram}
+
+
+# Escapes followed by a fixed number of characters that are not literal
+ESCAPE_OPERANDS = {"x": 2, "u": 4, "U": 8}
+
+
+def escape_end(pattern, i, escaped):
+    """Return where the operand of the escape \\<escaped> ending at i stops."""
+    if escaped in ESCAPE_OPERANDS:
+        return min(i + ESCAPE_OPERANDS[escaped], len(pattern))
+    if escaped == "N" and pattern.startswith("{", i):
+        end = pattern.find("}", i)
+        return len(pattern) if end == -1 else end + 1
+    if escaped.isdigit():
+        # Octal escapes (\0, \012) and group references (\1 to \99)
+        for _ in range(2):
+            if i < len(pattern) and pattern[i].isdigit():
+                i += 1
+    return i
+
+
+def class_end(pattern, i):
+    """Return where the character class whose "[" is just before i stops."""
+    if pattern.startswith("^", i):
+        i += 1
+    if pattern.startswith("]", i):
+        i += 1  # A leading "]" is a literal member
+    while i < len(pattern):
+        if pattern[i] == "\\":
+            i += 2
+        elif pattern[i] == "]":
+            return i + 1
+        else:
+            i += 1
+    return len(pattern)
+
+
+def required_literals(pattern):
+    """Return literal strings that every match of the regex pattern must contain.
+
+    Conservative: only literals outside groups and classes count, and a
+    pattern with alternation requires nothing.
+    """
+    if "|" in pattern:
+        return []
+    runs = []
+    run = []
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if depth == 0 and not escaped.isalnum():
+                run.append(escaped)
+                continue
+            # A class like \d or a code like \x41: neither it nor its operand is literal
+            i = escape_end(pattern, i, escaped)
+            runs.append("".join(run))
+            run = []
+            continue
+        i += 1
+        if char == "[":
+            i = class_end(pattern, i)
+        elif char == "{":
+            # Skip a {m,n} repeat
+            end = pattern.find("}", i)
+            i = len(pattern) if end == -1 else end + 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 and char not in ".^$*+?{}":
+            run.append(char)
+            continue
+        if char in "*?{" and run:
+            run.pop()  # The previous character is optional
+        runs.append("".join(run))
+        run = []
+    runs.append("".join(run))
+    return [run for run in runs if len(run) >= 3]
+
+
+class TrigramIndex:
+    """Trigram index of the text files under one root directory.
+
+    Files get integer ids; postings map each trigram to the set of ids of
+    the files containing it, and each file keeps its trigrams packed in one
+    bytes object so it can be taken out of the postings when it changes.
+
+    With background set, a daemon thread loads the saved index, keeps it
+    current and saves it; queries only take the lock long enough to look up
+    candidates. The first query waits for the saved index to load; if there
+    is none, queries scan the files directly until the first build is done.
+    Without it, search() refreshes the index itself when a rescan is due.
+    Only refresh() changes the index, so saving never races an update.
+    """
+
+    def __init__(
+        self,
+        root,
+        index_root=SEARCH_INDEX_ROOT,
+        rescan_interval=SEARCH_RESCAN_INTERVAL,
+        max_file_bytes=SEARCH_MAX_FILE_BYTES,
+        save_interval=SEARCH_SAVE_INTERVAL,
+        background=False,
+    ):
+        self.root = Path(root).resolve()
+        digest = hashlib.sha1(str(self.root).encode("utf-8")).hexdigest()[:16]
+        self.path = Path(index_root).resolve() / f"{digest}.pickle"
+        self.rescan_interval = rescan_interval
+        self.max_file_bytes = max_file_bytes
+        self.save_interval = save_interval
+        self.background = background
+        self.files = {}  # relative path -> (mtime_ns, size, file id)
+        self.paths = {}  # file id -> relative path
+        self.grams = {}  # file id -> the file's trigrams, concatenated
+        self.postings = {}  # trigram -> set of file ids
+        self.stale = {}  # relative path -> (stat, data) a query found changed
+        self.next_id = 0
+        self.last_scan = None
+        self.last_save = None
+        self.ready = False
+        self.changed = False
+        self._lock = threading.Lock()  # Held while postings change or are read
+        self._refresh_lock = threading.Lock()  # One refresh or save at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._loaded = threading.Event()  # Set once a saved index was looked for
+        self._thread = None
+        if not background:
+            self.load()  # Otherwise the background thread loads it first
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return
+        if saved.get("version") != INDEX_VERSION:
+            return
+        if saved.get("root") != str(self.root):
+            return
+        postings = {
+            gram: set(array("i", ids)) for gram, ids in saved["postings"].items()
+        }
+        with self._lock:
+            self.files = saved["files"]
+            self.paths = {entry[2]: relative for relative, entry in self.files.items()}
+            self.grams = saved["grams"]
+            self.next_id = saved["next_id"]
+            self.postings = postings
+            self.last_save = time.monotonic()
+            self.ready = True
+
+    def save(self):
+        """Write the index out if it changed since it was loaded or last saved."""
+        with self._refresh_lock:
+            if not self.changed:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            saved = {
+                "version": INDEX_VERSION,
+                "root": str(self.root),
+                "files": self.files,
+                "grams": self.grams,
+                "next_id": self.next_id,
+                "postings": {
+                    gram: array("i", ids).tobytes()
+                    for gram, ids in self.postings.items()
+                },
+            }
+            with AtomicFile(self.path, durability="none") as f:
+                pickle.dump(saved, f.file, protocol=pickle.HIGHEST_PROTOCOL)
+                f.commit()
+            self.changed = False
+            self.last_save = time.monotonic()
+
+    def save_if_due(self):
+        """Save at most every save_interval seconds; the first build right away."""
+        if self.last_save is None or (
+            time.monotonic() - self.last_save >= self.save_interval
+        ):
+            self.save()
+
+    def walk(self):
+        """Yield (relative path, stat) for every indexable file under root.
+
+        Links are not followed, and files the editor tool may not view,
+        ignored files and the agent's own state are left out.
+        """
+        skip = state_dirs() | {str(self.path.parent)}
+        pending = [(str(self.root), ancestor_rules(self.root))]
+        while pending:
+            directory, rules = pending.pop()
+            own = read_ignore_file(directory)
+            if own:
+                rules = [*rules, own]
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in SEARCH_SKIP_DIRS or entry.path in skip:
+                        continue
+                    if not is_ignored(entry.path, True, rules):
+                        pending.append((entry.path, rules))
+                elif (
+                    entry.is_file(follow_symlinks=False)
+                    and allowed_file(entry.name)
+                    and not is_ignored(entry.path, False, rules)
+                ):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_size <= self.max_file_bytes:
+                        yield os.path.relpath(entry.path, self.root), stat
+
+    def read(self, relative):
+        """Return a file's bytes, or None if it is binary, too big or unreadable.
+
+        Files the editor tool may not view, and paths that lead out of root
+        through a link, read as None too.
+        """
+        path = self.root / relative
+        if not allowed_file(path) or not path.resolve().is_relative_to(self.root):
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read(self.max_file_bytes + 1)
+        except OSError:
+            return None
+        if len(data) > self.max_file_bytes or b"\0" in data[:8192]:
+            return None
+        return data
+
+    def _remove(self, relative):
+        entry = self.files.pop(relative, None)
+        if entry is None:
+            return
+        file_id = entry[2]
+        del self.paths[file_id]
+        grams = self.grams.pop(file_id)
+        for i in range(0, len(grams), 3):
+            gram = grams[i : i + 3]
+            ids = self.postings[gram]
+            ids.discard(file_id)
+            if not ids:
+                del self.postings[gram]
+        self.changed = True
+
+    def _add(self, relative, stat, data):
+        # The trigrams are worked out before taking the lock
+        grams = trigrams(data) if data is not None else set()
+        with self._lock:
+            self._remove(relative)
+            file_id = self.next_id
+            self.next_id += 1
+            self.files[relative] = (stat.st_mtime_ns, stat.st_size, file_id)
+            self.paths[file_id] = relative
+            self.grams[file_id] = b"".join(grams)
+            for gram in grams:
+                ids = self.postings.get(gram)
+                if ids is None:
+                    self.postings[gram] = {file_id}
+                else:
+                    ids.add(file_id)
+            self.changed = True
+
+    def refresh(self, force=False):
+        """Re-index files added, changed or removed since the last scan.
+
+        The tree is walked without holding the lock queries use; files a
+        query already read after they changed are re-indexed from that data.
+        """
+        with self._refresh_lock:
+            now = time.monotonic()
+            if not force and self.last_scan is not None:
+                if now - self.last_scan < self.rescan_interval:
+                    return
+            with self._lock:
+                stale, self.stale = self.stale, {}
+            for relative, found in stale.items():
+                if found is None:
+                    with self._lock:
+                        self._remove(relative)
+                else:
+                    self._add(relative, *found)
+
+            seen = set()
+            for relative, stat in self.walk():
+                if self._stop.is_set():
+                    return
+                seen.add(relative)
+                entry = self.files.get(relative)
+                if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+                    self._add(relative, stat, self.read(relative))
+            with self._lock:
+                for relative in self.files.keys() - seen:
+                    self._remove(relative)
+            self.last_scan = now
+            self.ready = True
+
+    def start(self):
+        """Start the thread that keeps the index current, if it is not running."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="search-index", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        try:
+            with self._refresh_lock:
+                self.load()
+        except Exception:
+            logger.exception("Loading the search index of %s failed", self.root)
+        finally:
+            self._loaded.set()
+        while not self._stop.is_set():
+            try:
+                self.refresh(force=True)
+                self.save_if_due()
+            except Exception:
+                logger.exception("Refreshing the search index of %s failed", self.root)
+            self._wake.wait(self.rescan_interval)
+            self._wake.clear()
+
+    def close(self):
+        """Stop the background thread and save what it has indexed."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        self.save()
+
+    def candidates(self, required):
+        """Return the files that contain every trigram of every required literal."""
+        grams = set()
+        for literal in required:
+            grams |= trigrams(literal.encode("utf-8"))
+        with self._lock:
+            if not grams:
+                return set(self.files)
+            # Intersect the rarest posting lists first
+            lists = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            found = set(lists[0])
+            for ids in lists[1:]:
+                found &= ids
+                if not found:
+                    break
+            return {self.paths[file_id] for file_id in found}
+
+    def current_text(self, relative):
+        """Read a candidate file, queuing it for re-indexing if it changed."""
+        try:
+            stat = os.stat(self.root / relative)
+        except OSError:
+            with self._lock:
+                self.stale[relative] = None
+            return None
+        data = self.read(relative)
+        entry = self.files.get(relative)
+        if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            with self._lock:
+                self.stale[relative] = (stat, data)
+            self._wake.set()
+        return None if data is None else data.decode("utf-8", errors="replace")
+
+    def scan(self, pattern, scope):
+        """Search every file directly, for queries made before the first build."""
+        files = []
+        for relative, _ in self.walk():
+            if not in_scope(relative, scope):
+                continue
+            data = self.read(relative)
+            if data is not None:
+                lines = matching_lines(pattern, data.decode("utf-8", errors="replace"))
+                if lines:
+                    files.append((relative, lines))
+        return files
+
+    def search(
+        self,
+        query,
+        regex=False,
+        case_sensitive=True,
+        path="",
+        max_results=SEARCH_MAX_RESULTS,
+    ):
+        """Return up to max_results ranked (path, line, text) hits and the total count."""
+        flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+        pattern = re.compile(query if regex else re.escape(query), flags)
+        required = required_literals(query) if regex else [query]
+        # "", "." and "./" all mean the whole root
+        scope = os.path.normpath(path.strip("/") or ".")
+        scope = "" if scope == "." else scope
+
+        if self.background:
+            self.start()
+            # Loading a saved index beats scanning every file; building it does not
+            self._loaded.wait()
+        else:
+            self.refresh()
+            self.save_if_due()
+
+        if not self.ready:
+            files = self.scan(pattern, scope)
+        else:
+            files = []
+            for relative in self.candidates(required):
+                if not in_scope(relative, scope):
+                    continue
+                text = self.current_text(relative)
+                if text is not None:
+                    lines = matching_lines(pattern, text)
+                    if lines:
+                        files.append((relative, lines))
+
+        # Most matches first, then shallower and shorter paths
+        files.sort(key=lambda item: (-len(item[1]), item[0].count(os.sep), item[0]))
+        total = sum(len(lines) for _, lines in files)
+        hits = []
+        for relative, lines in files:
+            for number, line in lines:
+                if len(hits) >= max_results:
+                    return hits, total
+                hits.append((relative, number, line))
+        return hits, total
+
+
+def state_dirs():
+    """Return the directories the agent keeps its own state in, resolved."""
+    # Imported here because agent.server imports this module
+    from agent.server import SESSION_ROOT
+
+    roots = [
+        SEARCH_INDEX_ROOT,
+        results.TOOL_RESULT_SCRATCH_ROOT,
+        store.SESSION_STORE_ROOT,
+        SESSION_ROOT,
+        cache.RESPONSE_CACHE,
+    ]
+    return {str(Path(root).resolve()) for root in roots if root}
+
+
+def in_scope(relative, scope):
+    """Return whether a file is scope or under it; an empty scope is the root."""
+    return not scope or relative == scope or relative.startswith(scope + os.sep)
+
+
+def matching_lines(pattern, text):
+    """Return (line number, line) for each line with a match, scanning text once."""
+    lines = []
+    number = 1
+    position = 0
+    last_start = -1
+    for match in pattern.finditer(text):
+        start = text.rfind("\n", 0, match.start()) + 1
+        if start == last_start:
+            continue  # Another match on the same line
+        number += text.count("\n", position, start)
+        position = start
+        last_start = start
+        end = text.find("\n", start)
+        lines.append((number, text[start : end if end != -1 else len(text)]))
+    return lines
+
+
+def get_search_index(root=None):
+    """Return the process-wide index of root (None: the current directory)."""
+    key = str(Path(root or ".").resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = TrigramIndex(key, background=True)
+        return index
+
+
+def drop_search_index(root=None):
+    """Stop the index's background thread and save it, e.g. when a session closes."""
+    key = str(Path(root or ".").resolve())
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+    if index:
+        index.close()
+
+
+@atexit.register
+def _close_search_indexes():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+        _indexes.clear()
+    for index in indexes:
+        index.close()
+
+
+def handle_search(query, regex=False, case_sensitive=True, path="", root=None):
+    """Handle a search tool call: format ranked hits as path:line: text."""
+    try:
+        if not query:
+            return "Error: Empty search query"
+        hits, total = get_search_index(root).search(
+            query, regex, case_sensitive, path
+        )
+        if not hits:
+            return f"No matches for {query!r}"
+        lines = [
+            f"{relative}:{number}: {text.strip()[:200]}"
+            for relative, number, text in hits
+        ]
+        if total > len(hits):
+            lines.append(
+                f"... {total - len(hits)} more matches; narrow the query or path"
+            )
+        return "\n".join(lines)
+
+    except re.error as e:
+        return f"Error: Invalid regex: {e}"
+    except Exception as e:
+        return f"Error during search: {str(e)}"
@@ -0,0 +1,293 @@
+"""Asyncio server that hosts many independent streaming agent sessions.
+
+Clients connect over TCP or a Unix socket and send one JSON object per
+line. The server answers each request with JSONL records (the same ones
+JSONLRenderer prints) and ends every turn with a "done" record:
+
+    {"type": "message", "content": "Create hello.py"}
+    {"type": "message", "session": "3f9c0d1e2a4b5c6d", "content": "Now add tests"}
+    {"type": "close", "session": "3f9c0d1e2a4b5c6d"}
+
+A message without a session starts a new one. Each session has its own
+conversation history and working directory under SESSION_ROOT, and every
+session shares the process-wide pooled API client. With a SessionStore,
+histories are logged as they grow and sessions not in memory (for
+example after a restart) are resumed on their first message. A session's output goes
+through a bounded queue: when its client reads slowly, only that session's
+agent thread waits (and stops reading its API stream), the others go on.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import secrets
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from agent import streaming
+from agent.conversation import add_user_message
+from agent.files import drop_buffer_cache
+from agent.results import drop_results
+from agent.search import drop_search_index
+from agent.store import SessionStore
+
+AGENT_SERVER_HOST = os.getenv("AGENT_SERVER_HOST", "127.0.0.1")
+AGENT_SERVER_PORT = int(os.getenv("AGENT_SERVER_PORT", "8766"))
+# Listen on this Unix socket path instead of TCP when set
+AGENT_SERVER_SOCKET = os.getenv("AGENT_SERVER_SOCKET")
+SESSION_ROOT = os.getenv("SESSION_ROOT", "sessions")
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "256"))
+# Turns streaming at the same time; each one holds a worker thread
+MAX_ACTIVE_TURNS = int(os.getenv("MAX_ACTIVE_TURNS", "32"))
+# Rendered chunks buffered per session before its agent thread has to wait
+SESSION_OUTPUT_QUEUE = int(os.getenv("SESSION_OUTPUT_QUEUE", "64"))
+
+
+class SessionOutput:
+    """File-like sink that hands one session's rendered output to the event loop.
+
+    write() runs on the session's worker thread and blocks while the queue
+    is full, so a slow client only slows down its own session. Once the
+    client is gone, output is dropped and the turn runs to completion.
+    """
+
+    def __init__(self, loop, maxsize=SESSION_OUTPUT_QUEUE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.abandoned = False
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+    def write(self, data):
+        if data and not self.abandoned:
+            self._put(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Mark the end of the turn's output."""
+        if not self.abandoned:
+            self._put(None)
+
+    def abandon(self):
+        """Stop delivering output and unblock a writer waiting on a full queue."""
+        self.abandoned = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+class Session:
+    """One conversation: its history, sandbox directory and turn lock."""
+
+    def __init__(self, session_id, workdir, messages=None):
+        self.id = session_id
+        self.workdir = workdir
+        self.messages = [] if messages is None else messages
+        self.lock = asyncio.Lock()
+        self.closed = False
+
+
+class AgentServer:
+    """Serve streaming agent sessions over JSON lines.
+
+    system, tools and budgets (max_turns, max_total_tokens) are passed to
+    every run of streaming.run_agent. store is an optional SessionStore
+    that persists histories.
+    """
+
+    def __init__(
+        self,
+        system=None,
+        tools=None,
+        root=SESSION_ROOT,
+        max_sessions=MAX_SESSIONS,
+        max_active_turns=MAX_ACTIVE_TURNS,
+        output_queue=SESSION_OUTPUT_QUEUE,
+        store=None,
+        **budgets,
+    ):
+        self.system = system
+        self.tools = tools
+        self.root = Path(root)
+        self.max_sessions = max_sessions
+        self.output_queue = output_queue
+        self.store = store
+        self.budgets = budgets
+        self.sessions = {}
+        self.executor = ThreadPoolExecutor(
+            max_active_turns, thread_name_prefix="agent-session"
+        )
+
+    def new_session(self):
+        """Create a session with an empty history and a fresh working directory."""
+        if len(self.sessions) >= self.max_sessions:
+            raise RuntimeError(f"Too many sessions (limit {self.max_sessions})")
+        return self._add_session(secrets.token_hex(8))
+
+    def get_session(self, session_id):
+        """Return a session, resuming it from the store if it is not loaded yet."""
+        session = self.sessions.get(session_id)
+        if session is None and self.store and self.store.exists(session_id):
+            if len(self.sessions) >= self.max_sessions:
+                raise RuntimeError(f"Too many sessions (limit {self.max_sessions})")
+            session = self._add_session(session_id)
+        return session
+
+    def _add_session(self, session_id):
+        workdir = self.root / session_id
+        workdir.mkdir(parents=True, exist_ok=True)
+        messages = self.store.open(session_id) if self.store else []
+        session = Session(session_id, workdir.resolve(), messages)
+        self.sessions[session_id] = session
+        return session
+
+    async def close_session(self, session_id, delete=False):
+        """Close a session once the turn it is running, if any, has finished.
+
+        Turns run in worker threads and cannot be interrupted, so this waits
+        for the current one; turns still waiting for the session are refused.
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return False
+        session.closed = True
+        async with session.lock:
+            if self.sessions.get(session_id) is not session:
+                return False  # Another close request got here first
+            del self.sessions[session_id]
+            await asyncio.to_thread(self._release_session, session, delete)
+        return True
+
+    def _release_session(self, session, delete):
+        drop_buffer_cache(session.workdir)
+        drop_search_index(session.workdir)
+        drop_results(session.workdir)
+        if self.store:
+            session.messages.close()
+            if delete:
+                self.store.delete(session.id)
+        if delete:
+            shutil.rmtree(session.workdir, ignore_errors=True)
+
+    async def send(self, writer, record):
+        writer.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        """Answer requests from one client, one at a time, until it disconnects."""
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    await self.send(writer, {"type": "error", "message": str(e)})
+                    continue
+                await self.handle_request(request, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def handle_request(self, request, writer):
+        kind = request.get("type")
+        session_id = request.get("session")
+        if kind == "message":
+            await self.run_turn(session_id, request.get("content", ""), writer)
+        elif kind == "close":
+            closed = await self.close_session(
+                session_id, request.get("delete", False)
+            )
+            await self.send(
+                writer, {"type": "closed", "session": session_id, "ok": closed}
+            )
+        else:
+            await self.send(
+                writer, {"type": "error", "message": f"Unknown request type {kind!r}"}
+            )
+
+    async def run_turn(self, session_id, content, writer):
+        """Run one user message through the agent and stream its output back."""
+        try:
+            session = self.get_session(session_id) if session_id else self.new_session()
+        except (RuntimeError, ValueError) as e:
+            await self.send(writer, {"type": "error", "message": str(e)})
+            return
+        if session is None:
+            await self.send(
+                writer, {"type": "error", "message": f"Unknown session {session_id}"}
+            )
+            return
+        await self.send(writer, {"type": "session", "session": session.id})
+
+        # Turns of one session run in order; other sessions are not blocked
+        async with session.lock:
+            if session.closed:
+                await self.send(
+                    writer, {"type": "error", "message": f"Session {session.id} closed"}
+                )
+                return
+            loop = asyncio.get_running_loop()
+            output = SessionOutput(loop, self.output_queue)
+            turn = loop.run_in_executor(
+                self.executor, self.run_agent, session, content, output
+            )
+            try:
+                while (chunk := await output.queue.get()) is not None:
+                    writer.write(chunk.encode("utf-8"))
+                    await writer.drain()
+            except ConnectionError:
+                output.abandon()
+                await asyncio.wait([turn])
+                raise
+            try:
+                result = await turn
+            except Exception as e:
+                await self.send(writer, {"type": "error", "message": str(e)})
+                return
+
+        await self.send(writer, {"type": "done", "session": session.id, **result})
+
+    def run_agent(self, session, content, output):
+        """Worker thread body: stream one turn into the session's output queue."""
+        renderer = streaming.JSONLRenderer(output)
+        try:
+            add_user_message(session.messages, content)
+            return streaming.run_agent(
+                session.messages,
+                system=self.system,
+                tools=self.tools,
+                renderer=renderer,
+                workdir=session.workdir,
+                **self.budgets,
+            )
+        finally:
+            if self.store:
+                # Make the whole turn durable before reporting it done
+                session.messages.sync()
+            renderer.flush()
+            output.close()
+
+    async def start(self, host=AGENT_SERVER_HOST, port=AGENT_SERVER_PORT, path=None):
+        """Start listening on a Unix socket when path is given, else on TCP."""
+        if path:
+            return await asyncio.start_unix_server(self.handle_connection, path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def serve(system=None, tools=None, **options):
+    """Run an AgentServer until cancelled, configured from AGENT_SERVER_* settings."""
+    options.setdefault("store", SessionStore())
+    agent_server = AgentServer(system=system, tools=tools, **options)
+    server = await agent_server.start(path=AGENT_SERVER_SOCKET)
+    where = AGENT_SERVER_SOCKET or f"{AGENT_SERVER_HOST}:{AGENT_SERVER_PORT}"
+    print(f"🛰️ Agent server listening on {where}, sessions in {agent_server.root}")
+    async with server:
+        await server.serve_forever()
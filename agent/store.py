@@ -0,0 +1,187 @@
+"""Append-only, crash-safe storage for conversation histories.
+
+Every message added to a stored history is appended as one JSON line to
+<root>/<session>.jsonl. Writes are fsynced in batches (every
+STORE_FSYNC_EVERY messages or STORE_FSYNC_INTERVAL seconds, and whenever
+sync() is called, e.g. at the end of a turn) rather than once per message.
+
+Every STORE_SNAPSHOT_EVERY messages the in-memory history, compacted or
+not, is written to <root>/<session>.snapshot.json together with the log
+offset it covers. Resuming reads that snapshot and only the log lines
+written after it, so a long session comes back without parsing its whole
+history. A torn last line left by a crash is dropped on resume.
+"""
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from agent.conversation import block_to_dict
+
+SESSION_STORE_ROOT = os.getenv("SESSION_STORE_ROOT", "session_logs")
+STORE_FSYNC_EVERY = int(os.getenv("STORE_FSYNC_EVERY", "32"))
+STORE_FSYNC_INTERVAL = float(os.getenv("STORE_FSYNC_INTERVAL", "1.0"))
+STORE_SNAPSHOT_EVERY = int(os.getenv("STORE_SNAPSHOT_EVERY", "200"))
+
+
+class SessionLog:
+    """The append-only log and latest snapshot of one session."""
+
+    def __init__(
+        self,
+        path,
+        fsync_every=STORE_FSYNC_EVERY,
+        fsync_interval=STORE_FSYNC_INTERVAL,
+        snapshot_every=STORE_SNAPSHOT_EVERY,
+    ):
+        self.path = Path(path)
+        self.snapshot_path = self.path.with_suffix(".snapshot.json")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.records = 0
+        self.offset = 0
+        self.snapshot_records = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._file = None
+
+    def load(self):
+        """Return the stored history: the latest snapshot plus the log after it."""
+        messages = []
+        offset = 0
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            messages = snapshot["messages"]
+            offset = snapshot["offset"]
+            self.records = self.snapshot_records = snapshot["records"]
+
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write from a crash; never acknowledged
+                    messages.append(json.loads(line))
+                    offset += len(line)
+                    self.records += 1
+
+        self._file = open(self.path, "ab")
+        # Drop a torn tail so new records start on a fresh line
+        self._file.truncate(offset)
+        self.offset = offset
+        return messages
+
+    def append(self, message):
+        line = json.dumps(message, default=block_to_dict, ensure_ascii=False)
+        data = line.encode("utf-8") + b"\n"
+        self._file.write(data)
+        self.offset += len(data)
+        self.records += 1
+        self._pending += 1
+        if (
+            self._pending >= self.fsync_every
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def snapshot_due(self):
+        return self.records - self.snapshot_records >= self.snapshot_every
+
+    def snapshot(self, messages):
+        """Atomically save messages as the state after every record logged so far."""
+        self.sync()
+        snapshot = {
+            "records": self.records,
+            "offset": self.offset,
+            "messages": messages,
+        }
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.stem}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, default=block_to_dict, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.snapshot_records = self.records
+
+    def sync(self):
+        """Flush and fsync every record appended so far."""
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+class StoredMessages(list):
+    """A messages list that appends every new message to its session log.
+
+    The agent loops only ever add messages with append(), so they work on
+    it unchanged. In-place compaction is not logged: the log keeps the full
+    history and the next snapshot records the compacted list.
+    """
+
+    def __init__(self, log):
+        super().__init__(log.load())
+        self.log = log
+
+    def append(self, message):
+        super().append(message)
+        self.log.append(message)
+        if self.log.snapshot_due():
+            self.log.snapshot(self)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def sync(self):
+        self.log.sync()
+
+    def close(self):
+        self.log.close()
+
+
+class SessionStore:
+    """Directory of session logs, opened on demand."""
+
+    def __init__(self, root=SESSION_STORE_ROOT, **log_options):
+        self.root = Path(root)
+        self.log_options = log_options
+
+    def log_path(self, session_id):
+        if not session_id.isalnum():
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return self.root / f"{session_id}.jsonl"
+
+    def exists(self, session_id):
+        return (
+            self.log_path(session_id).exists()
+            or self.log_path(session_id).with_suffix(".snapshot.json").exists()
+        )
+
+    def open(self, session_id):
+        """Return the session's history as StoredMessages, creating it if new."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        return StoredMessages(SessionLog(self.log_path(session_id), **self.log_options))
+
+    def delete(self, session_id):
+        path = self.log_path(session_id)
+        for stale in (path, path.with_suffix(".snapshot.json")):
+            if stale.exists():
+                stale.unlink()
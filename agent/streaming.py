@@ -0,0 +1,641 @@
+"""Streaming agent loop with fine-grained tool streaming.
+
+Streamed output goes through a pluggable renderer, tool input is parsed
+incrementally, and read-only tool calls start while Claude is still
+streaming.
+"""
+
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from agent.cache import CachedStream, CachingStream
+from agent.client import get_client, request_timeout
+from agent.conversation import (
+    PROMPT_CACHING,
+    add_assistant_message,
+    apply_prompt_caching,
+    compact_messages,
+    estimate_tokens,
+)
+from agent.files import get_buffer_cache, sync_writes
+from agent.loop import (
+    AGENT_TEMPERATURE,
+    MAX_TURNS,
+    MODEL,
+    budget_exhausted,
+    new_run_result,
+    print_cache_usage,
+    record_turn,
+    response_cache_key,
+)
+from agent.scheduler import get_scheduler, print_retry
+from agent.tools import (
+    EDITOR_TOOLS,
+    TEXT_EDITOR_TOOL,
+    WEB_SEARCH_TOOL,
+    get_line_index,
+    handle_text_editor_tool,
+    tool_command,
+)
+
+# Run read-only tool calls while the rest of the response is still streaming
+SPECULATIVE_TOOLS = os.getenv("SPECULATIVE_TOOLS", "1") != "0"
+READ_ONLY_COMMANDS = {"view", "search", "read_result"}
+tool_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tool")
+
+
+def chat_stream(messages, system=None, temperature=AGENT_TEMPERATURE, tools=None):
+    """Stream chat with fine-grained tool streaming enabled.
+
+    A response cache hit is replayed as stream events instead of calling
+    the API; a miss is stored once its stream completes.
+    """
+    params = {
+        "model": MODEL,
+        "max_tokens": 4096,  # Increased for streaming
+        "messages": messages,
+        "temperature": temperature,
+        "tools": tools or [TEXT_EDITOR_TOOL, WEB_SEARCH_TOOL],
+        "betas": ["fine-grained-tool-streaming-2025-05-14"],
+        # Fail on a stalled stream instead of waiting out the full read timeout
+        "timeout": request_timeout(stream=True),
+    }
+
+    if system:
+        params["system"] = system
+
+    if PROMPT_CACHING:
+        apply_prompt_caching(params)
+
+    cache, key = response_cache_key(params)
+    if cache and (cached := cache.get(key)) is not None:
+        return CachedStream(cached)
+
+    # Use the beta streaming client with fine-grained tool streaming
+    stream = get_client().beta.messages.stream(**params)
+    return CachingStream(stream, cache, key) if cache else stream
+
+
+# Characters that matter to the incremental parser inside and outside strings
+_JSON_STRING_SPECIAL = re.compile(r'["\\]')
+_JSON_STRUCTURAL = re.compile(r'["{}\[\],]')
+
+
+class IncrementalJSONParser:
+    """Parse a streamed JSON object, exposing top-level fields as soon as they complete.
+
+    Fragments are kept in a list instead of being concatenated, and only the
+    new fragment is scanned on each feed. A field like "command" or "path" is
+    available in fields while a long "file_text" is still streaming.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False
+        self._chunks = []
+        self._member = []
+        self._member_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._failed = False
+
+    def feed(self, fragment):
+        self._chunks.append(fragment)
+        if self._member_start is not None:
+            self._member_start = 0
+
+        i = 0
+        while i < len(fragment):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    i += 1
+                    continue
+                match = _JSON_STRING_SPECIAL.search(fragment, i)
+                if match is None:
+                    break
+                i = match.start()
+                if fragment[i] == "\\":
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                i += 1
+                continue
+
+            match = _JSON_STRUCTURAL.search(fragment, i)
+            if match is None:
+                break
+            i = match.start()
+            char = fragment[i]
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1 and not self.complete:
+                    self._member_start = i + 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0 and self._member_start is not None:
+                    self._finish_member(fragment[self._member_start : i])
+                    self._member_start = None
+                    self.complete = True
+            elif char == "," and self._depth == 1:
+                self._finish_member(fragment[self._member_start : i])
+                self._member_start = i + 1
+            i += 1
+
+        if self._member_start is not None:
+            self._member.append(fragment[self._member_start :])
+
+    def _finish_member(self, tail):
+        self._member.append(tail)
+        text = "".join(self._member).strip()
+        self._member = []
+        if not text:
+            return
+        try:
+            self.fields.update(json.loads("{" + text + "}"))
+        except json.JSONDecodeError:
+            self._failed = True
+
+    def text(self):
+        """Return the raw JSON received so far."""
+        return "".join(self._chunks)
+
+    def result(self):
+        """Return the parsed object, raising json.JSONDecodeError if it is invalid."""
+        if self.complete and not self._failed:
+            return self.fields
+        return json.loads(self.text() or "{}")
+
+
+def prefetch_tool_target(tool_input, workdir=None):
+    """Load a view/insert target into the session's buffers while the call streams."""
+    command = tool_input.get("command")
+    file_path = str(tool_input.get("path", "")).lstrip("/")
+    if command not in ("view", "insert") or not file_path or ".." in file_path:
+        return
+    if workdir:
+        file_path = os.path.join(workdir, file_path)
+    if not Path(file_path).is_file():
+        return
+
+    buffers = get_buffer_cache(workdir)
+
+    def warm():
+        try:
+            if buffers:
+                buffers.get(file_path)
+            else:
+                get_line_index(file_path)
+        except Exception:
+            pass  # The real tool call reports any error
+
+    threading.Thread(target=warm, daemon=True).start()
+
+
+class TerminalRenderer:
+    """Coalesce streamed output and write it at most every flush_interval seconds or flush_bytes characters."""
+
+    def __init__(self, out=None, flush_interval=0.05, flush_bytes=4096):
+        self.out = out or sys.stdout
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._buffer = []
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def text(self, chunk):
+        self._write(chunk)
+
+    def tool_input(self, chunk):
+        self._write(f"⚡ Streaming tool param: {chunk}")
+
+    def status(self, message):
+        self._write(message + "\n")
+
+    def _write(self, data):
+        self._buffer.append(data)
+        self._pending += len(data)
+        if (
+            self._pending >= self.flush_bytes
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.out.write("".join(self._buffer))
+            self._buffer = []
+            self._pending = 0
+        self.out.flush()
+        self._last_flush = time.monotonic()
+
+
+class JSONLRenderer(TerminalRenderer):
+    """Quiet renderer for non-TTY output: one JSON record per text run or status line.
+
+    Tool input fragments are not echoed; the completed call is reported as a status.
+    """
+
+    def __init__(self, out=None, flush_interval=0.5, flush_bytes=16384):
+        super().__init__(out, flush_interval, flush_bytes)
+        self._text = []
+
+    def text(self, chunk):
+        self._text.append(chunk)
+        self._pending += len(chunk)
+        if (
+            self._pending >= self.flush_bytes
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def tool_input(self, chunk):
+        pass
+
+    def status(self, message):
+        self._end_text()
+        record = {"type": "status", "message": message.strip()}
+        self._write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _end_text(self):
+        if self._text:
+            record = {"type": "text", "text": "".join(self._text)}
+            self._buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+            self._text = []
+
+    def flush(self):
+        self._end_text()
+        super().flush()
+
+
+class NullRenderer:
+    """Discard all streamed output, e.g. for benchmarks."""
+
+    def text(self, chunk):
+        pass
+
+    def tool_input(self, chunk):
+        pass
+
+    def status(self, message):
+        pass
+
+    def flush(self):
+        pass
+
+
+class RelayRenderer:
+    """Hand renderer calls to a thread of their own so the caller never waits on them.
+
+    A stream is read while holding a request scheduler slot, and a renderer
+    can block on a slow reader (a server client behind SessionOutput). The
+    relay queues calls without limit, which costs at most one response's
+    output, and replays them in order; drain() waits until all are done.
+    """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self._calls = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._error = None
+
+    def _relay(self, method, *args):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._calls.put((method, args))
+
+    def _run(self):
+        while (call := self._calls.get()) is not None:
+            method, args = call
+            try:
+                method(*args)
+            except Exception as e:
+                self._error = self._error or e
+
+    def text(self, chunk):
+        self._relay(self.renderer.text, chunk)
+
+    def tool_input(self, chunk):
+        self._relay(self.renderer.tool_input, chunk)
+
+    def status(self, message):
+        self._relay(self.renderer.status, message)
+
+    def flush(self):
+        self._relay(self.renderer.flush)
+
+    def drain(self):
+        """Wait for every call so far to reach the renderer; re-raise its error."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._calls.put(None)
+        if thread is not None:
+            thread.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+
+def make_renderer(kind=None):
+    """Create the renderer named by kind or STREAM_RENDERER.
+
+    Defaults to the terminal renderer on a TTY and JSONL otherwise.
+    """
+    kind = kind or os.getenv("STREAM_RENDERER")
+    if not kind:
+        kind = "terminal" if sys.stdout.isatty() else "jsonl"
+    renderers = {
+        "terminal": TerminalRenderer,
+        "jsonl": JSONLRenderer,
+        "null": NullRenderer,
+    }
+    return renderers[kind]()
+
+
+renderer = make_renderer()
+
+
+def default_renderer():
+    """Return the process-wide renderer, looked up at call time so it can be swapped."""
+    return renderer
+
+
+def speculate_tool_call(
+    tool_call, response_content, speculative, renderer=None, workdir=None
+):
+    """Start a read-only tool call in the background as soon as its input is complete.
+
+    Only runs when no earlier call in the same response can change files, so
+    the early result is the same one the call would get after the turn.
+    """
+    if not SPECULATIVE_TOOLS or tool_call["name"] not in EDITOR_TOOLS:
+        return
+    command = tool_command(tool_call["name"], tool_call["input"])
+    if command not in READ_ONLY_COMMANDS:
+        return
+    for content in response_content:
+        if content["type"] == "tool_use" and (
+            tool_command(content["name"], content["input"]) not in READ_ONLY_COMMANDS
+        ):
+            return
+    renderer = renderer or default_renderer()
+    renderer.status(f"\n⏩ Running {command} while Claude keeps streaming")
+    speculative[tool_call["id"]] = tool_executor.submit(
+        handle_text_editor_tool, tool_call, root=workdir
+    )
+
+
+def process_streaming_response(
+    stream, messages, speculative=None, renderer=None, workdir=None
+):
+    """Process Claude's streaming response with fine-grained tool streaming.
+
+    Adds Claude's response to messages and returns (tool_calls, usage) so the
+    caller decides whether to run tools and call Claude again. When a
+    speculative dict is given, read-only tool calls are started as soon as
+    they finish streaming and their futures are stored in it by tool id.
+    Output goes to renderer (the process-wide one by default) and tool
+    paths are resolved inside workdir when it is set.
+    """
+    renderer = renderer or default_renderer()
+    response_content = []
+    current_tool_call = None
+    current_text = None
+    tool_input = None
+    prefetched = False
+
+    renderer.status("🚀 Starting streaming response...")
+
+    with stream as response_stream:
+        response = getattr(response_stream, "response", None)
+        if response is not None:
+            get_scheduler().observe(response.headers)
+        for event in response_stream:
+            if event.type == "message_start":
+                renderer.status("📨 Message started")
+
+            elif event.type == "content_block_start":
+                content_block = event.content_block
+                if content_block.type == "text":
+                    renderer.status("📝 Text block started")
+                    current_text = []
+                elif content_block.type == "tool_use":
+                    renderer.status(f"🔧 Tool use started: {content_block.name}")
+                    current_tool_call = {
+                        "type": "tool_use",
+                        "id": content_block.id,
+                        "name": content_block.name,
+                        "input": {},
+                    }
+                    tool_input = IncrementalJSONParser()
+                    prefetched = False
+                elif content_block.type == "server_tool_use":
+                    renderer.status(f"🌐 Server tool use started: {content_block.name}")
+                elif content_block.type == "web_search_tool_result":
+                    renderer.status("📊 Web search results incoming")
+
+            elif event.type == "content_block_delta":
+                delta = event.delta
+                if delta.type == "text_delta":
+                    current_text.append(delta.text)
+                    renderer.text(delta.text)
+                elif delta.type == "input_json_delta":
+                    # Stream tool parameters as they arrive (fine-grained streaming)
+                    if delta.partial_json:
+                        tool_input.feed(delta.partial_json)
+                        # Start indexing the target file while the rest streams
+                        if (
+                            not prefetched
+                            and "command" in tool_input.fields
+                            and "path" in tool_input.fields
+                        ):
+                            prefetch_tool_target(tool_input.fields, workdir)
+                            prefetched = True
+                        renderer.tool_input(delta.partial_json)
+
+            elif event.type == "content_block_stop":
+                if current_text is not None:
+                    # Keep the text so the conversation history stays complete
+                    text = "".join(current_text)
+                    if text:
+                        response_content.append({"type": "text", "text": text})
+                    current_text = None
+                if current_tool_call:
+                    try:
+                        # Fields were parsed as they streamed in
+                        current_tool_call["input"] = tool_input.result()
+                        if speculative is not None:
+                            speculate_tool_call(
+                                current_tool_call,
+                                response_content,
+                                speculative,
+                                renderer,
+                                workdir,
+                            )
+                        response_content.append(current_tool_call)
+                        renderer.status(
+                            f"\n✅ Tool call completed: {current_tool_call['name']}"
+                        )
+                    except json.JSONDecodeError as e:
+                        # Handle invalid JSON as per documentation
+                        renderer.status(f"\n⚠️ Invalid JSON detected: {e}")
+                        invalid_json_wrapper = {"INVALID_JSON": tool_input.text()}
+                        current_tool_call["input"] = invalid_json_wrapper
+                        response_content.append(current_tool_call)
+
+                    tool_input = None
+                    current_tool_call = None
+                renderer.status("\n🏁 Content block completed")
+
+            elif event.type == "message_delta":
+                if hasattr(event.delta, "stop_reason"):
+                    renderer.status(f"\n🛑 Stop reason: {event.delta.stop_reason}")
+
+            elif event.type == "message_stop":
+                renderer.status("\n✅ Message completed")
+
+        usage = response_stream.get_final_message().usage
+
+    renderer.flush()
+
+    # Add Claude's response to messages (an empty turn would be rejected later)
+    if response_content:
+        add_assistant_message(messages, response_content)
+
+    tool_calls = [
+        content
+        for content in response_content
+        if content["type"] == "tool_use" and content["name"] in EDITOR_TOOLS
+    ]
+    return tool_calls, usage
+
+
+def run_tool_calls(messages, tool_calls, speculative=None, renderer=None, workdir=None):
+    """Run one turn's editor tool calls and add their results to messages.
+
+    Results already computed speculatively are collected instead of re-run.
+    Returns True when tool results were added and Claude must be called again.
+    """
+    renderer = renderer or default_renderer()
+    speculative = speculative or {}
+    tool_results = []
+    for content in tool_calls:
+        if content["id"] in speculative:
+            tool_result = speculative.pop(content["id"]).result()
+        # Check for invalid JSON
+        elif "INVALID_JSON" in content["input"]:
+            tool_result = f"Error: Received invalid JSON for tool call. Raw content: {content['input']['INVALID_JSON']}"
+        else:
+            tool_result = handle_text_editor_tool(content, root=workdir)
+        renderer.status(f"📁 Tool result: {tool_result}")
+
+        tool_results.append(
+            {
+                "type": "tool_result",
+                "tool_use_id": content["id"],
+                "content": tool_result,
+            }
+        )
+
+    # Make the turn's edits durable together before Claude sees the results
+    sync_writes()
+
+    # Add tool results to conversation
+    if tool_results:
+        messages.append({"role": "user", "content": tool_results})
+    renderer.flush()
+    return bool(tool_results)
+
+
+def run_agent(
+    messages,
+    system=None,
+    tools=None,
+    max_turns=MAX_TURNS,
+    max_total_tokens=None,
+    deadline=None,
+    renderer=None,
+    workdir=None,
+    priority=0,
+):
+    """Stream Claude's responses and run its tools until it stops or a budget runs out.
+
+    Loops instead of recursing, so long sessions keep a flat stack. deadline
+    is a time.monotonic() timestamp. renderer and workdir let concurrent
+    sessions keep their output and files apart. Model calls go through the
+    request scheduler at the given priority; a stream that fails partway is
+    requested again from the start. The stream's output is relayed to the
+    renderer, so a slow reader never holds a scheduler slot. Returns a run
+    result dict with the stop reason, token totals and per-turn timings.
+    """
+    renderer = renderer or default_renderer()
+    relay = RelayRenderer(renderer)
+    scheduler = get_scheduler()
+    result = new_run_result()
+
+    for turn in range(max_turns):
+        stop_reason = budget_exhausted(result, max_total_tokens, deadline)
+        if stop_reason:
+            result["stop_reason"] = stop_reason
+            break
+
+        if turn:
+            renderer.status("\n🔄 Processing tool results...")
+
+        if compact_messages(messages):
+            tokens = estimate_tokens(messages)
+            renderer.status(f"🗜️ Compacted conversation to ~{tokens} tokens")
+
+        started = time.perf_counter()
+        speculative = {}
+
+        def attempt():
+            # Nothing from a failed attempt reaches messages; start over clean
+            speculative.clear()
+            stream = chat_stream(messages, system=system, tools=tools)
+            return process_streaming_response(
+                stream, messages, speculative, relay, workdir
+            )
+
+        def retrying(error, delay, attempt):
+            print_retry(error, delay, attempt, relay.status)
+
+        try:
+            tool_calls, usage = scheduler.run(
+                attempt, estimate_tokens(messages), priority, on_retry=retrying
+            )
+        except Exception as e:
+            relay.status(f"Error in response: {e}")
+            result["stop_reason"] = "error"
+            result["error"] = str(e)
+            break
+        finally:
+            # Wait for the reader with the slot released, before the tools run
+            relay.drain()
+        model_seconds = time.perf_counter() - started
+
+        needs_follow_up = run_tool_calls(
+            messages, tool_calls, speculative, renderer, workdir
+        )
+        print_cache_usage(usage, renderer.status)
+        record_turn(result, usage, model_seconds, time.perf_counter() - started)
+
+        if not needs_follow_up:
+            result["stop_reason"] = "end_turn"
+            break
+
+    return result
@@ -0,0 +1,573 @@
+"""Text editor tool handlers shared by the agent scripts.
+
+Importing this module is cheap: it does not import anthropic or open any
+HTTP client, so tests, workers and benchmarks can use the handlers directly.
+"""
+
+import logging
+import mmap
+import os
+from array import array
+from functools import partial
+from pathlib import Path
+
+from agent.files import (
+    AtomicFile,
+    Buffer,
+    allowed_file,
+    copy_range,
+    file_newline,
+    get_buffer_cache,
+    insert_position,
+    line_range,
+    match_newlines,
+    write_file,
+)
+from agent.listing import view_directory
+from agent.results import READ_RESULT_TOOL, limit_result, read_result
+from agent.search import SEARCH_TOOL, handle_search
+
+logger = logging.getLogger(__name__)
+
+TEXT_EDITOR_TOOL = {
+    "type": "text_editor_20250124",
+    "name": "str_replace_editor",
+}
+
+MULTI_EDIT_TOOL = {
+    "name": "multi_edit",
+    "description": (
+        "Apply several edits to one file in a single call. Each edit either "
+        "replaces old_str, which must occur exactly once in the file, with "
+        "new_str, or inserts new_str as a new line after line insert_line "
+        "(0 for the top of the file). Matches and line numbers refer to the "
+        "file before any edit is applied. If any edit does not match exactly "
+        "once or overlaps another, no edit is applied."
+    ),
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "path": {"type": "string", "description": "File to edit"},
+            "edits": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "old_str": {"type": "string"},
+                        "new_str": {"type": "string"},
+                        "insert_line": {"type": "integer"},
+                    },
+                    "required": ["new_str"],
+                },
+            },
+        },
+        "required": ["path", "edits"],
+    },
+}
+
+# Custom tools run by handle_text_editor_tool, with the command each one stands for
+TOOL_COMMANDS = {
+    MULTI_EDIT_TOOL["name"]: "multi_edit",
+    SEARCH_TOOL["name"]: "search",
+    READ_RESULT_TOOL["name"]: "read_result",
+}
+# Tools whose calls are run locally by handle_text_editor_tool
+EDITOR_TOOLS = {TEXT_EDITOR_TOOL["name"], *TOOL_COMMANDS}
+
+WEB_SEARCH_TOOL = {
+    "type": "web_search_20250305",
+    "name": "web_search",
+    "max_uses": 5,
+    "allowed_domains": [
+        "stackoverflow.com",
+        "github.com",
+        "docs.python.org",
+        "developer.mozilla.org",
+        "w3schools.com",
+    ],
+}
+
+
+def tool_command(name, input_params):
+    """Return the editor command a call to tool name runs."""
+    return input_params.get("command", TOOL_COMMANDS.get(name, ""))
+
+
+def handle_text_editor_tool(tool_call, root=None):
+    """Handle text editor tool calls from Claude according to official documentation.
+
+    With root set, paths are resolved inside that directory and calls that
+    would reach outside it (for example through a symlink) are refused.
+    Files are read through the buffer cache of the session at root, and
+    results too long for the conversation are cut down by limit_result.
+    """
+    return limit_result(run_tool_call(tool_call, root), root)
+
+
+def run_tool_call(tool_call, root=None):
+    """Run one tool call and return its full result."""
+    try:
+        # Streamed tool calls are plain dicts, regular responses are SDK objects
+        if isinstance(tool_call, dict):
+            input_params = tool_call["input"]
+            name = tool_call.get("name")
+        else:
+            input_params = tool_call.input
+            name = getattr(tool_call, "name", None)
+        command = tool_command(name, input_params)
+        file_path = input_params.get("path", "")
+
+        # Logged, not printed: stdout may be a JSONL stream or a server log
+        logger.debug("Tool call - Command: %s, Path: %s", command, file_path)
+        logger.debug("All input params: %s", input_params)
+
+        if root:
+            root = Path(root).resolve()
+            # Paths from earlier results in this sandbox come back absolute
+            if file_path.startswith(f"{root}{os.sep}"):
+                file_path = os.path.relpath(file_path, root)
+
+        # Normalize path to current directory
+        if file_path.startswith("/"):
+            # Remove leading slash to make it relative to current directory
+            file_path = file_path.lstrip("/")
+            logger.debug("Normalized path: %s", file_path)
+
+        # Security check: prevent directory traversal but allow relative paths
+        if ".." in file_path:
+            return "Error: Invalid file path for security reasons"
+
+        if command == "search":
+            return handle_search(
+                input_params.get("query", ""),
+                input_params.get("regex", False),
+                input_params.get("case_sensitive", True),
+                file_path,
+                root,
+            )
+        if command == "read_result":
+            return read_result(
+                input_params.get("handle", ""), input_params.get("view_range"), root
+            )
+
+        # Restrict to certain file extensions for safety
+        path = Path(file_path)
+        if not allowed_file(path):
+            return f"Error: File extension '{path.suffix}' not allowed for security reasons"
+
+        if root:
+            path = root / path
+            if not path.resolve().is_relative_to(root):
+                return "Error: Invalid file path for security reasons"
+            # Results name the sandbox-relative path, not where the sandbox lives
+            shown_path = file_path or "."
+            file_path = str(path)
+            result = run_command(command, file_path, input_params, root)
+            if command == "view" and path.is_file() and not result.startswith("Error"):
+                return result  # File contents, not a message about the path
+            return result.replace(file_path, shown_path)
+
+        return run_command(command, file_path, input_params, root)
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def run_command(command, file_path, input_params, root=None):
+    """Run an editor command on file_path, already checked and resolved."""
+    try:
+        buffers = get_buffer_cache(root)
+        if command == "view":
+            view_range = input_params.get("view_range")
+            return handle_view(file_path, view_range, buffers)
+        elif command == "str_replace":
+            old_str = input_params.get("old_str", "")
+            new_str = input_params.get("new_str", "")
+
+            # Workaround: If old_str is empty and file is empty, treat as content insertion
+            if old_str == "" and Path(file_path).exists():
+                try:
+                    with open(Path(file_path), "r", encoding="utf-8") as f:
+                        current_content = f.read()
+                    if current_content.strip() == "":
+                        logger.info(
+                            "Converting empty str_replace to file content insertion"
+                        )
+                        write_file(file_path, new_str)
+                        return f"Successfully added content to {file_path}"
+                except Exception as e:
+                    logger.warning("Empty str_replace workaround failed: %s", e)
+
+            return handle_str_replace(file_path, old_str, new_str, buffers)
+        elif command == "create":
+            file_text = input_params.get("file_text", "")
+            return handle_create(file_path, file_text, buffers)
+        elif command == "insert":
+            insert_line = input_params.get("insert_line", 0)
+            new_str = input_params.get("new_str", "")
+            return handle_insert(file_path, insert_line, new_str, buffers)
+        elif command == "multi_edit":
+            edits = input_params.get("edits", [])
+            return handle_multi_edit(file_path, edits, buffers)
+        else:
+            return f"Error: Unknown command '{command}'"
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+# Line-offset indexes keyed by resolved path, validated by (mtime_ns, size)
+_line_index_cache = {}
+LINE_INDEX_CACHE_SIZE = 64
+
+
+def get_line_index(path):
+    """Return byte offsets of every line start in a file, plus its end offset.
+
+    The index is built lazily with mmap on first use and cached until the
+    file's mtime or size changes, so ranged views never re-scan the file.
+    """
+    path = Path(path)
+    stat = path.stat()
+    key = str(path.resolve())
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _line_index_cache.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    offsets = array("q", [0])
+    if stat.st_size:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = mm.find(b"\n")
+                while pos != -1:
+                    offsets.append(pos + 1)
+                    pos = mm.find(b"\n", pos + 1)
+        if offsets[-1] != stat.st_size:
+            # Last line has no trailing newline
+            offsets.append(stat.st_size)
+
+    if len(_line_index_cache) >= LINE_INDEX_CACHE_SIZE:
+        _line_index_cache.pop(next(iter(_line_index_cache)))
+    _line_index_cache[key] = (signature, offsets)
+    return offsets
+
+
+def shift_line_index(path, offsets, index, inserted):
+    """Cache the line index of path after inserting bytes at the start of line index.
+
+    Lines before the insertion keep their offsets and every later one moves
+    by the inserted length, so the index is updated without re-scanning.
+    """
+    stat = Path(path).stat()
+    shifted = offsets[: index + 1]
+    shifted.extend(offset + inserted for offset in offsets[index:])
+    _line_index_cache[str(Path(path).resolve())] = (
+        (stat.st_mtime_ns, stat.st_size),
+        shifted,
+    )
+
+
+def read_lines(path, start_line=1, end_line=-1):
+    """Read lines start_line..end_line (1-indexed, inclusive) using the line index.
+
+    Follows list slicing semantics, so out-of-range bounds yield fewer lines.
+    Returned lines have their trailing newline removed.
+    """
+    offsets = get_line_index(path)
+    line_numbers = line_range(len(offsets) - 1, start_line, end_line)
+    if not line_numbers:
+        return []
+
+    first, last = line_numbers[0], line_numbers[-1]
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[offsets[first] : offsets[last + 1]].decode("utf-8")
+
+    return data.split("\n")[: len(line_numbers)]
+
+
+def handle_view(file_path, view_range=None, buffers=None):
+    """Handle view command to read file contents or list directory.
+
+    With a BufferCache, file lines come from memory while the file is unchanged.
+    """
+    try:
+        path = Path(file_path)
+
+        if path.is_dir():
+            # view_range pages through the entries of a directory
+            return view_directory(file_path, view_range)
+
+        elif path.is_file():
+            # Seek straight to the requested lines via the cached line index
+            buffer = buffers.get(path) if buffers else None
+            read = buffer.read_lines if buffer else partial(read_lines, path)
+            if view_range:
+                start_line, end_line = view_range
+                lines = read(start_line, end_line)
+            else:
+                lines = read()
+
+            # Add line numbers
+            start_num = view_range[0] if view_range else 1
+            return "\n".join(
+                f"{number}: {line.rstrip()}"
+                for number, line in enumerate(lines, start_num)
+            )
+
+        else:
+            return "Error: File not found"
+
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
+
+
+# Bytes read per step when scanning a file for str_replace
+STR_REPLACE_CHUNK_SIZE = 1024 * 1024
+
+
+def stream_replace(src, dst, old, new, chunk_size=STR_REPLACE_CHUNK_SIZE):
+    """Copy src to dst, replacing the single occurrence of old with new.
+
+    Scans in chunks, keeping an overlap window of len(old) - 1 bytes so
+    matches spanning two chunks are found. Stops as soon as a second match
+    proves the edit ambiguous, in which case the returned count only covers
+    the data scanned so far. Returns the number of matches seen.
+    """
+    overlap = len(old) - 1
+    count = 0
+    buf = b""
+
+    while True:
+        chunk = src.read(chunk_size)
+        buf += chunk
+
+        pos = buf.find(old)
+        while pos != -1:
+            count += 1
+            if count > 1:
+                return count + buf.count(old, pos + len(old))
+            dst.write(buf[:pos])
+            dst.write(new)
+            buf = buf[pos + len(old) :]
+            pos = buf.find(old)
+
+        if not chunk:
+            dst.write(buf)
+            return count
+
+        # Flush everything except the tail that could start a match
+        keep = len(buf) - overlap
+        if keep > 0:
+            dst.write(buf[:keep])
+            buf = buf[keep:]
+
+
+def handle_str_replace(file_path, old_str, new_str, buffers=None):
+    """Handle string replacement in file.
+
+    Files in the BufferCache are edited in memory; others are streamed.
+    """
+    try:
+        path = Path(file_path)
+        if not path.exists():
+            return "Error: File not found"
+
+        buffer = buffers.get(path) if buffers else None
+        if buffer:
+            # Edit the cached text and write it back in one go
+            old_str = match_newlines(old_str, buffer.newline)
+            new_str = match_newlines(new_str, buffer.newline)
+            count = buffer.text.count(old_str)
+            if count == 0:
+                return "Error: No match found for replacement text"
+            elif count > 1:
+                return f"Error: Found {count} matches for replacement text. Please provide more context to make a unique match"
+            text = buffer.text.replace(old_str, new_str, 1)
+            write_file(path, text)
+            buffers.update(path, text)
+            return "Successfully replaced text at exactly one location"
+
+        if old_str == "":
+            # An empty string matches everywhere unless the file is empty
+            size = len(path.read_text(encoding="utf-8"))
+            if size:
+                return f"Error: Found {size + 1} matches for replacement text. Please provide more context to make a unique match"
+            write_file(path, new_str)
+            return "Successfully replaced text at exactly one location"
+
+        # Stream the edit into a temp file next to the target, then swap it in
+        with open(path, "rb") as src, AtomicFile(path) as dst:
+            # Match "\n" in the edit against the file's own line endings
+            newline = file_newline(src)
+            count = stream_replace(
+                src,
+                dst,
+                match_newlines(old_str, newline).encode("utf-8"),
+                match_newlines(new_str, newline).encode("utf-8"),
+                STR_REPLACE_CHUNK_SIZE,
+            )
+            exhausted = not src.read(1)
+
+            if count == 0:
+                return "Error: No match found for replacement text"
+            elif count > 1:
+                found = count if exhausted else f"at least {count}"
+                return f"Error: Found {found} matches for replacement text. Please provide more context to make a unique match"
+
+            dst.commit()
+
+        return "Successfully replaced text at exactly one location"
+
+    except Exception as e:
+        return f"Error during replacement: {str(e)}"
+
+
+def handle_create(file_path, file_text, buffers=None):
+    """Handle file creation."""
+    try:
+        path = Path(file_path)
+
+        if path.exists():
+            return f"Error: File {file_path} already exists"
+
+        # Create parent directories if needed
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        write_file(path, file_text)
+        if buffers:
+            buffers.update(path, file_text)
+
+        return f"Successfully created file {file_path}"
+
+    except Exception as e:
+        return f"Error creating file: {str(e)}"
+
+
+def handle_insert(file_path, insert_line, new_str, buffers=None):
+    """Handle text insertion at specific line.
+
+    Files in the BufferCache are edited in memory. Others are spliced: the
+    line index gives the byte offset, and the bytes around the new line are
+    copied into the temp file by the kernel.
+    """
+    try:
+        path = Path(file_path)
+        if not path.exists():
+            return "Error: File not found"
+
+        buffer = buffers.get(path) if buffers else None
+        if buffer:
+            offset = buffer.line_offset(insert_line)
+            new_line = match_newlines(new_str + "\n", buffer.newline)
+            text = buffer.text[:offset] + new_line + buffer.text[offset:]
+            write_file(path, text)
+            buffers.update(path, text)
+            return f"Successfully inserted text at line {insert_line}"
+
+        offsets = get_line_index(path)
+        index = insert_position(insert_line, len(offsets) - 1)
+        offset = offsets[index]
+
+        with open(path, "rb") as src, AtomicFile(path) as dst:
+            data = match_newlines(new_str + "\n", file_newline(src)).encode("utf-8")
+            size = os.fstat(src.fileno()).st_size
+            # A last line without a newline would absorb the new text
+            joins_last_line = offset == size and size and not _ends_with_newline(src)
+            dst_fd = dst.file.fileno()
+            copy_range(src.fileno(), dst_fd, 0, offset)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(dst_fd, view) :]
+            copy_range(src.fileno(), dst_fd, offset, size)
+            dst.commit()
+
+        if not joins_last_line:
+            shift_line_index(path, offsets, index, len(data))
+        return f"Successfully inserted text at line {insert_line}"
+
+    except Exception as e:
+        return f"Error during insertion: {str(e)}"
+
+
+def _ends_with_newline(f):
+    f.seek(-1, os.SEEK_END)
+    return f.read(1) == b"\n"
+
+
+def plan_edits(buffer, edits):
+    """Turn edits into sorted (start, end, new_text, number) spans of buffer.text.
+
+    Returns (spans, errors); errors lists every edit that is missing, ambiguous
+    or overlaps another, so the caller can reject the whole batch. Edit text
+    is given the file's line ending, so "\n" in an edit matches CRLF files.
+    """
+    text = buffer.text
+    spans = []
+    errors = []
+    for number, edit in enumerate(edits, 1):
+        new_str = match_newlines(edit.get("new_str", ""), buffer.newline)
+        if "old_str" in edit:
+            old_str = match_newlines(edit["old_str"], buffer.newline)
+            count = text.count(old_str) if old_str else 0
+            if count != 1:
+                problem = "no match" if count == 0 else f"{count} matches"
+                errors.append(f"edit {number}: {problem} for old_str")
+                continue
+            start = text.find(old_str)
+            spans.append((start, start + len(old_str), new_str, number))
+        elif "insert_line" in edit:
+            offset = buffer.line_offset(edit["insert_line"])
+            spans.append((offset, offset, new_str + buffer.newline, number))
+        else:
+            errors.append(f"edit {number}: needs old_str or insert_line")
+
+    # Inserts at the same spot keep their order; they may touch a replacement
+    spans.sort(key=lambda span: (span[0], span[1]))
+    for previous, span in zip(spans, spans[1:]):
+        if span[0] < previous[1]:
+            errors.append(f"edit {span[3]} overlaps edit {previous[3]}")
+    return spans, errors
+
+
+def handle_multi_edit(file_path, edits, buffers=None):
+    """Apply a batch of replacements and inserts to one file with one read and one write.
+
+    Every edit is checked against the original text first; if any fails, the
+    file is left untouched.
+    """
+    try:
+        path = Path(file_path)
+        if not path.exists():
+            return "Error: File not found"
+        if not edits:
+            return "Error: No edits given"
+
+        buffer = buffers.get(path) if buffers else None
+        if buffer is None:
+            with open(path, "rb") as f:
+                buffer = Buffer(f.read().decode("utf-8"), None)
+
+        spans, errors = plan_edits(buffer, edits)
+        if errors:
+            return "Error: No edits applied; " + "; ".join(errors)
+
+        text = buffer.text
+        pieces = []
+        position = 0
+        for start, end, new_text, _ in spans:
+            pieces.append(text[position:start])
+            pieces.append(new_text)
+            position = end
+        pieces.append(text[position:])
+        text = "".join(pieces)
+
+        write_file(path, text)
+        if buffers:
+            buffers.update(path, text)
+        return f"Successfully applied {len(spans)} edits to {file_path}"
+
+    except Exception as e:
+        return f"Error during multi-edit: {str(e)}"
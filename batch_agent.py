@@ -0,0 +1,248 @@
+"""Run one system prompt over many independent prompts with Message Batches.
+
+Reads one prompt per line from a file or stdin (plain text, or JSON with
+"prompt" and an optional "custom_id"), submits them in chunks as Message
+Batches, polls with backoff and appends each finished batch's results to
+a JSONL file as soon as it ends:
+
+    uv run batch_agent.py prompts.txt --system "Review this code" --output reviews.jsonl
+    uv run batch_agent.py prompts.txt --output reviews.jsonl --resume
+    uv run batch_agent.py --batch-id msgbatch_01... --output reviews.jsonl
+
+Submitted batch IDs and the chunk size are kept in <output>.state.json, so
+an interrupted run picks up with --resume: it submits only the chunks that
+never were and skips results already in the output. --batch-id collects
+batches started elsewhere.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from agent.client import get_client
+from agent.conversation import PROMPT_CACHING, with_cache_control
+from agent.loop import MODEL
+from agent.scheduler import get_scheduler, print_retry
+
+# Batch calls yield to interactive sessions sharing the scheduler
+BATCH_PRIORITY = 10
+BATCH_CHUNK_SIZE = 1000
+
+
+def read_prompts(lines):
+    """Yield (custom_id, prompt) pairs from text or JSON lines."""
+    for number, line in enumerate(lines):
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        custom_id = f"prompt-{number:06d}"
+        record = None
+        if line.lstrip().startswith("{"):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                pass  # Plain text that happens to start with "{"
+        if isinstance(record, dict) and "prompt" in record:
+            yield record.get("custom_id", custom_id), record["prompt"]
+        else:
+            yield custom_id, line
+
+
+def build_request(custom_id, prompt, system=None, max_tokens=1024, temperature=0.7):
+    params = {
+        "model": MODEL,
+        "max_tokens": max_tokens,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+    }
+    if system:
+        # Every request shares the system prompt, so cache it once for all
+        params["system"] = [with_cache_control(system)] if PROMPT_CACHING else system
+    return {"custom_id": custom_id, "params": params}
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {"batches": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    """Replace the state file atomically so a crash never leaves it half written."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def written_ids(path):
+    """Return the custom_ids already in the output, to skip them on resume.
+
+    A torn or unparsable tail left by an interrupted run is cut off, so new
+    results start on a fresh line.
+    """
+    if not os.path.exists(path):
+        return set()
+    ids = set()
+    offset = end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            offset += len(line)
+            try:
+                ids.add(json.loads(line)["custom_id"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            end = offset
+            complete = line.endswith(b"\n")
+    if end < offset or (end and not complete):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+            if end and not complete:
+                f.seek(end)
+                f.write(b"\n")
+    return ids
+
+
+def call_api(call):
+    return get_scheduler().run(call, priority=BATCH_PRIORITY, on_retry=print_retry)
+
+
+def submit_chunks(requests, state, state_path, chunk_size=BATCH_CHUNK_SIZE):
+    """Create one batch per chunk that has not been submitted yet."""
+    submitted = {batch["first"] for batch in state["batches"]}
+    for first in range(0, len(requests), chunk_size):
+        if first in submitted:
+            continue
+        chunk = requests[first : first + chunk_size]
+        batch = call_api(lambda: get_client().messages.batches.create(requests=chunk))
+        state["batches"].append(
+            {"id": batch.id, "first": first, "count": len(chunk), "done": False}
+        )
+        save_state(state_path, state)
+        print(f"📤 Submitted {batch.id} with {len(chunk)} requests")
+
+
+def result_record(response):
+    """Flatten one batch result into the output JSONL record."""
+    result = response.result
+    record = {"custom_id": response.custom_id, "type": result.type}
+    if result.type == "succeeded":
+        message = result.message
+        record["text"] = "".join(
+            block.text for block in message.content if block.type == "text"
+        )
+        record["stop_reason"] = message.stop_reason
+        record["usage"] = message.usage.model_dump(exclude_none=True)
+    elif result.type == "errored":
+        record["error"] = result.error.model_dump(exclude_none=True)
+    return record
+
+
+def write_results(batch_id, out, seen):
+    """Stream a finished batch's results into out, skipping ones already written."""
+    count = 0
+    for response in call_api(lambda: get_client().messages.batches.results(batch_id)):
+        if response.custom_id in seen:
+            continue
+        out.write(json.dumps(result_record(response), ensure_ascii=False) + "\n")
+        seen.add(response.custom_id)
+        count += 1
+    out.flush()
+    os.fsync(out.fileno())
+    return count
+
+
+def collect(state, state_path, out, seen, poll_interval=1.0, poll_max=60.0):
+    """Poll unfinished batches with backoff and write each one's results as it ends."""
+    delay = poll_interval
+    while pending := [batch for batch in state["batches"] if not batch["done"]]:
+        finished = False
+        for batch in pending:
+            status = call_api(
+                lambda: get_client().messages.batches.retrieve(batch["id"])
+            )
+            if status.processing_status != "ended":
+                continue
+            written = write_results(batch["id"], out, seen)
+            batch["done"] = True
+            save_state(state_path, state)
+            finished = True
+            counts = status.request_counts
+            print(
+                f"✅ {batch['id']} ended: {counts.succeeded} succeeded, "
+                f"{counts.errored} errored, {written} written"
+            )
+        if finished:
+            delay = poll_interval
+        else:
+            # Nothing ended this round: back off, with jitter so runs don't align
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, poll_max)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", help="prompts file (default: stdin)")
+    parser.add_argument("--output", default="batch_results.jsonl")
+    parser.add_argument("--system", help="system prompt for every request")
+    parser.add_argument("--system-file", help="read the system prompt from a file")
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--poll-max", type=float, default=60.0)
+    parser.add_argument(
+        "--resume", action="store_true", help="continue the run in the state file"
+    )
+    parser.add_argument(
+        "--batch-id", nargs="+", default=[], help="collect existing batches by ID"
+    )
+    args = parser.parse_args(argv)
+
+    state_path = f"{args.output}.state.json"
+    if os.path.exists(state_path) and not (args.resume or args.batch_id):
+        parser.error(f"{state_path} exists; pass --resume to continue that run")
+    state = load_state(state_path)
+    # Chunks are keyed by their first index, so a resumed run keeps its chunk size
+    chunk_size = state.setdefault("chunk_size", args.chunk_size)
+    if chunk_size != args.chunk_size:
+        print(f"ℹ️ Using chunk size {chunk_size} from {state_path}")
+    known = {batch["id"] for batch in state["batches"]}
+    for batch_id in args.batch_id:
+        if batch_id not in known:
+            state["batches"].append(
+                {"id": batch_id, "first": None, "count": None, "done": False}
+            )
+
+    system = args.system
+    if args.system_file:
+        with open(args.system_file, "r", encoding="utf-8") as f:
+            system = f.read()
+
+    if args.input or not args.batch_id:
+        if args.input:
+            with open(args.input, "r", encoding="utf-8") as f:
+                prompts = list(read_prompts(f))
+        else:
+            prompts = list(read_prompts(sys.stdin))
+        requests = [
+            build_request(custom_id, prompt, system, args.max_tokens, args.temperature)
+            for custom_id, prompt in prompts
+        ]
+        submit_chunks(requests, state, state_path, chunk_size)
+    save_state(state_path, state)
+
+    resuming = args.resume or args.batch_id
+    seen = written_ids(args.output) if resuming else set()
+    with open(args.output, "a" if resuming else "w", encoding="utf-8") as out:
+        collect(state, state_path, out, seen, args.poll_interval, args.poll_max)
+    print(f"💾 {len(seen)} results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""End-to-end benchmark of the agent loops against the local mock server.
+
+Drives the 06, 07 and 08 agent loops through scripted conversations of
+several lengths that view files of several sizes, and reports per-turn
+latency percentiles, tool handler time, bytes sent per request and peak
+RSS. Results are written as JSON so runs can be diffed between commits:
+
+    uv run bench_agent.py --output bench_results.json
+    uv run bench_agent.py --compare bench_results.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import agent.conversation
+import agent.loop
+import agent.streaming
+from agent.client import reset_clients
+from mock_server import start_server
+
+SCRIPTS = ["06_edit_text_tool.py", "07_web_search_tool.py", "08_data_streaming.py"]
+BENCH_FILE = "bench_file.py"
+
+
+def load_script(path):
+    """Import a numbered tutorial script as a module."""
+    spec = importlib.util.spec_from_file_location(Path(path).stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentiles(values):
+    """Return nearest-rank p50/p95/p99 and the mean of values."""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+    return {
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "mean": sum(ordered) / len(ordered),
+    }
+
+
+def build_recording(tool_turns):
+    """Script a conversation with tool_turns file views followed by an answer."""
+    recording = []
+    for i in range(tool_turns):
+        recording.append(
+            {
+                "content": [
+                    {"type": "text", "text": f"Reviewing part {i + 1}."},
+                    {
+                        "type": "tool_use",
+                        "id": f"toolu_bench_{i:04d}",
+                        "name": "str_replace_editor",
+                        "input": {"command": "view", "path": BENCH_FILE},
+                    },
+                ]
+            }
+        )
+    recording.append({"content": [{"type": "text", "text": "Review finished."}]})
+    return recording
+
+
+def write_bench_file(lines):
+    with open(BENCH_FILE, "w", encoding="utf-8") as f:
+        f.writelines(f"value_{i} = {i}  # generated line\n" for i in range(lines))
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def run_case(module, tool_turns, file_lines, repeat, tokens_per_second):
+    """Run one script/conversation/file-size combination and summarize it."""
+    server = start_server(
+        build_recording(tool_turns), tokens_per_second=tokens_per_second
+    )
+    tool_seconds = []
+    handle_text_editor_tool = agent.loop.handle_text_editor_tool
+
+    def timed_handler(tool_call, **options):
+        started = time.perf_counter()
+        try:
+            return handle_text_editor_tool(tool_call, **options)
+        finally:
+            tool_seconds.append(time.perf_counter() - started)
+
+    os.environ["ANTHROPIC_BASE_URL"] = server.url
+    reset_clients()
+    agent.loop.handle_text_editor_tool = timed_handler
+    agent.streaming.handle_text_editor_tool = timed_handler
+    agent.streaming.renderer = agent.streaming.NullRenderer()
+
+    write_bench_file(file_lines)
+    turn_seconds = []
+    started = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            messages = [{"role": "user", "content": f"Review {BENCH_FILE}"}]
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = module.run(messages, max_turns=tool_turns + 1)
+            if result["stop_reason"] != "end_turn":
+                raise RuntimeError(f"Run stopped with {result['stop_reason']}")
+            turn_seconds.extend(t["total_seconds"] for t in result["turns"])
+    finally:
+        agent.loop.handle_text_editor_tool = handle_text_editor_tool
+        agent.streaming.handle_text_editor_tool = handle_text_editor_tool
+        server.shutdown()
+        server.server_close()
+
+    sizes = server.request_sizes
+    return {
+        "script": module.__name__,
+        "tool_turns": tool_turns,
+        "file_lines": file_lines,
+        "repeat": repeat,
+        "wall_seconds": time.perf_counter() - started,
+        "turn_seconds": percentiles(turn_seconds),
+        "tool_seconds": percentiles(tool_seconds),
+        "request_bytes": {
+            "mean": sum(sizes) / len(sizes),
+            "max": max(sizes),
+            "total": sum(sizes),
+        },
+        "connections": server.connections,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(case):
+    return (case["script"], case["tool_turns"], case["file_lines"])
+
+
+def compare(baseline, results):
+    """Print p50/p95 turn latency and request size changes against a baseline run."""
+    previous = {case_key(case): case for case in baseline["results"]}
+    print(f"\n📊 Compared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for case in results["results"]:
+        old = previous.get(case_key(case))
+        if not old:
+            continue
+        changes = []
+        for metric in ("p50", "p95"):
+            before = old["turn_seconds"][metric]
+            after = case["turn_seconds"][metric]
+            change = (after - before) / before * 100 if before else 0.0
+            changes.append(f"{metric} {change:+.1f}%")
+        before = old["request_bytes"]["mean"]
+        after = case["request_bytes"]["mean"]
+        changes.append(
+            f"bytes {(after - before) / before * 100 if before else 0:+.1f}%"
+        )
+        name, turns, lines = case_key(case)
+        print(f"  {name} turns={turns} lines={lines}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scripts", nargs="+", default=SCRIPTS)
+    parser.add_argument("--turns", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--file-lines", nargs="+", type=int, default=[100, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=0,
+        help="simulated model speed (0 = measure agent overhead only)",
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results JSON to diff against")
+    args = parser.parse_args()
+
+    scripts = [os.path.abspath(script) for script in args.scripts]
+    os.environ.setdefault("ANTHROPIC_API_KEY", "bench")
+    # Keep large histories intact so request sizes reflect the loop itself.
+    # agent.conversation read the environment when it was imported above.
+    if "CONTEXT_TOKEN_LIMIT" not in os.environ:
+        agent.conversation.CONTEXT_TOKEN_LIMIT = 10**9
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "tokens_per_second": args.tokens_per_second,
+        },
+        "results": [],
+    }
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for script in scripts:
+            module = load_script(script)
+            for tool_turns in args.turns:
+                for file_lines in args.file_lines:
+                    case = run_case(
+                        module,
+                        tool_turns,
+                        file_lines,
+                        args.repeat,
+                        args.tokens_per_second,
+                    )
+                    results["results"].append(case)
+                    print(
+                        f"⏱️ {case['script']} turns={tool_turns} lines={file_lines}: "
+                        f"p50 {case['turn_seconds']['p50'] * 1000:.1f} ms, "
+                        f"p95 {case['turn_seconds']['p95'] * 1000:.1f} ms, "
+                        f"p99 {case['turn_seconds']['p99'] * 1000:.1f} ms, "
+                        f"tool p50 {case['tool_seconds']['p50'] * 1000:.2f} ms, "
+                        f"request max {case['request_bytes']['max'] / 1024:.0f} KiB, "
+                        f"connections {case['connections']}, "
+                        f"rss {case['peak_rss_kb'] / 1024:.0f} MiB"
+                    )
+
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import pytest
+
+from agent.client import reset_clients
+from agent.scheduler import reset_scheduler
+from mock_server import start_server
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "mock_api(recording, **options): start_server arguments for mock_api"
+    )
+
+
+@pytest.fixture
+def mock_api(request, monkeypatch):
+    """A mock Messages API server that the shared clients are pointed at.
+
+    start_server's arguments come from a mock_api marker on the test or its
+    module, and options from indirect parametrization are added to them:
+
+        @pytest.mark.mock_api(RECORDING, batch_polls=2)
+        @pytest.mark.parametrize("mock_api", [{"failures": [...]}], indirect=True)
+    """
+    marker = request.node.get_closest_marker("mock_api")
+    args, options = (marker.args, dict(marker.kwargs)) if marker else ((), {})
+    options.update(getattr(request, "param", {}))
+    server = start_server(*args, **options)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "mock")
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", server.url)
+    reset_clients()
+    reset_scheduler()
+    yield server
+    reset_clients()
+    reset_scheduler()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,434 @@
+"""Local stand-in for the Messages API that replays recorded conversations.
+
+Serves POST /v1/messages both as a regular JSON response and as a
+server-sent event stream, so the agent scripts can run without network
+access. Point a script at it through ANTHROPIC_BASE_URL:
+
+    uv run mock_server.py --recording conversation.json --port 8765
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=mock uv run 08_data_streaming.py
+
+A recording is a JSON list of assistant messages (or {"responses": [...]}).
+Each message needs a "content" list and may set "stop_reason" and "usage".
+The response to a request is picked by the number of assistant messages
+already in its history, so concurrent conversations replay independently.
+
+POST /v1/messages/batches and the matching GET endpoints stand in for
+Message Batches: a batch reports "ended" once it has been retrieved
+batch_polls times, and its results are built from the recording.
+
+To exercise retries, failures lists what the next requests get instead of
+a response, in order: {"status": 429, "type": "rate_limit_error",
+"retry_after": 1} for an error response, or {"type": "overloaded_error",
+"mid_stream": true} for a stream that breaks off after its first events.
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Replayed when no recording is given: one file view, then an answer
+DEFAULT_RECORDING = [
+    {
+        "content": [
+            {"type": "text", "text": "Voy a revisar el archivo."},
+            {
+                "type": "tool_use",
+                "id": "toolu_mock_view",
+                "name": "str_replace_editor",
+                "input": {"command": "view", "path": "README.md"},
+            },
+        ]
+    },
+    {
+        "content": [
+            {"type": "text", "text": "El archivo es un tutorial de agentes con Claude."}
+        ]
+    },
+]
+
+# Characters per streamed delta, roughly one token
+CHARS_PER_TOKEN = 4
+
+
+def load_recording(path):
+    """Load the list of recorded assistant messages from a JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        recording = json.load(f)
+    if isinstance(recording, dict):
+        recording = recording["responses"]
+    return recording
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def split_tokens(text):
+    """Split text into token-sized pieces for streaming."""
+    return [text[i : i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+
+def build_message(recorded, request, turn, input_tokens):
+    """Fill in the fields a real Messages API response carries."""
+    content = recorded["content"]
+    stop_reason = recorded.get("stop_reason")
+    if stop_reason is None:
+        uses_tools = any(block["type"] == "tool_use" for block in content)
+        stop_reason = "tool_use" if uses_tools else "end_turn"
+
+    output_tokens = estimate_tokens(json.dumps(content, ensure_ascii=False))
+    usage = {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0,
+    }
+    usage.update(recorded.get("usage", {}))
+
+    return {
+        "id": f"msg_mock_{turn:04d}",
+        "type": "message",
+        "role": "assistant",
+        "model": request.get("model", "mock-model"),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": usage,
+    }
+
+
+def stream_events(message):
+    """Yield (event, data) pairs for a message, as the streaming API sends them."""
+    start = {**message, "content": [], "stop_reason": None}
+    start["usage"] = {**message["usage"], "output_tokens": 1}
+    yield "message_start", {"type": "message_start", "message": start}
+
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            yield "content_block_start", {
+                "type": "content_block_start",
+                "index": index,
+                "content_block": {"type": "text", "text": ""},
+            }
+            for piece in split_tokens(block["text"]):
+                yield "content_block_delta", {
+                    "type": "content_block_delta",
+                    "index": index,
+                    "delta": {"type": "text_delta", "text": piece},
+                }
+        elif block["type"] in ("tool_use", "server_tool_use"):
+            yield "content_block_start", {
+                "type": "content_block_start",
+                "index": index,
+                "content_block": {**block, "input": {}},
+            }
+            for piece in split_tokens(json.dumps(block["input"], ensure_ascii=False)):
+                yield "content_block_delta", {
+                    "type": "content_block_delta",
+                    "index": index,
+                    "delta": {"type": "input_json_delta", "partial_json": piece},
+                }
+        else:
+            # Results such as web_search_tool_result arrive whole
+            yield "content_block_start", {
+                "type": "content_block_start",
+                "index": index,
+                "content_block": block,
+            }
+        yield "content_block_stop", {"type": "content_block_stop", "index": index}
+
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+
+class MockMessagesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.record_connection()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("request-id", "req_mock")
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, error_type, message):
+        self.send_json(
+            status,
+            {"type": "error", "error": {"type": error_type, "message": message}},
+        )
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if path not in ("/v1/messages", "/v1/messages/batches"):
+            self.send_error_json(404, "not_found_error", f"Unknown path {path}")
+            return
+
+        try:
+            request = json.loads(body)
+        except json.JSONDecodeError as e:
+            self.send_error_json(400, "invalid_request_error", str(e))
+            return
+
+        if path == "/v1/messages/batches":
+            batch = self.server.create_batch(request["requests"])
+            self.send_json(200, self.server.batch_status(batch))
+            return
+
+        self.server.record_request(len(body))
+        message = self.server.replay(request, estimate_tokens(body))
+
+        time.sleep(self.server.latency)
+        failure = self.server.next_failure()
+        if failure and not failure.get("mid_stream"):
+            headers = {}
+            if "retry_after" in failure:
+                headers["retry-after"] = failure["retry_after"]
+            error = {"type": failure["type"], "message": "Simulated failure"}
+            self.send_json(
+                failure["status"], {"type": "error", "error": error}, headers
+            )
+        elif request.get("stream"):
+            self.send_stream(message, failure)
+        else:
+            self.server.wait_for_tokens(message["usage"]["output_tokens"])
+            self.send_json(200, message)
+
+    def do_GET(self):
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        batch = None
+        if parts[:3] == ["v1", "messages", "batches"] and len(parts) in (4, 5):
+            batch = self.server.batches.get(parts[3])
+        if batch is None:
+            self.send_error_json(404, "not_found_error", f"Unknown path {self.path}")
+        elif len(parts) == 4:
+            batch["polls"] += 1
+            self.send_json(200, self.server.batch_status(batch))
+        elif parts[4] == "results" and batch["results"] is not None:
+            body = "".join(json.dumps(r) + "\n" for r in batch["results"]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/binary")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error_json(404, "not_found_error", "Batch results not ready")
+
+    def send_stream(self, message, failure=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # Chunked encoding keeps the connection open for the next request
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for count, (event, data) in enumerate(stream_events(message)):
+            if failure and count == 3:
+                error = {"type": failure["type"], "message": "Simulated failure"}
+                event, data = "error", {"type": "error", "error": error}
+            elif event == "content_block_delta":
+                self.server.wait_for_tokens(1)
+            payload = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            self.wfile.flush()
+            if event == "error":
+                break
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class MockMessagesServer(ThreadingHTTPServer):
+    """HTTP server replaying a recording, with simulated latency and token rate."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        recording=None,
+        tokens_per_second=0,
+        latency=0.0,
+        verbose=False,
+        failures=None,
+        batch_polls=1,
+    ):
+        super().__init__(address, MockMessagesHandler)
+        self.recording = recording or DEFAULT_RECORDING
+        self.failures = list(failures or [])
+        self.batch_polls = batch_polls
+        self.batches = {}
+        self._batch_ids = itertools.count(1)
+        self.tokens_per_second = tokens_per_second
+        self.latency = latency
+        self.verbose = verbose
+        self.request_sizes = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_request(self, size):
+        with self._lock:
+            self.request_sizes.append(size)
+
+    def replay(self, request, input_tokens):
+        """Build the recorded response for a request's turn."""
+        messages = request.get("messages", [])
+        turn = sum(1 for m in messages if m["role"] == "assistant")
+        recorded = self.recording[turn % len(self.recording)]
+        return build_message(recorded, request, turn, input_tokens)
+
+    def create_batch(self, requests):
+        with self._lock:
+            batch_id = f"msgbatch_mock_{next(self._batch_ids):04d}"
+            batch = {
+                "id": batch_id,
+                "requests": requests,
+                "polls": 0,
+                "results": None,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.batches[batch_id] = batch
+        return batch
+
+    def batch_status(self, batch):
+        """Return the MessageBatch object, finishing the batch once polled enough."""
+        ended = batch["polls"] >= self.batch_polls
+        if ended and batch["results"] is None:
+            batch["results"] = [
+                {
+                    "custom_id": item["custom_id"],
+                    "result": {
+                        "type": "succeeded",
+                        "message": self.replay(
+                            item["params"],
+                            estimate_tokens(json.dumps(item["params"])),
+                        ),
+                    },
+                }
+                for item in batch["requests"]
+            ]
+            batch["ended_at"] = datetime.now(timezone.utc).isoformat()
+        count = len(batch["requests"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": batch["created_at"],
+            "ended_at": batch.get("ended_at"),
+            "expires_at": batch["created_at"],
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": (
+                f"{self.url}/v1/messages/batches/{batch['id']}/results"
+                if ended
+                else None
+            ),
+        }
+
+    def next_failure(self):
+        with self._lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def wait_for_tokens(self, count):
+        """Sleep as long as generating count tokens takes at the configured rate."""
+        if self.tokens_per_second:
+            time.sleep(count / self.tokens_per_second)
+
+
+def start_server(
+    recording=None,
+    host="127.0.0.1",
+    port=0,
+    tokens_per_second=0,
+    latency=0.0,
+    failures=None,
+    batch_polls=1,
+):
+    """Start a mock server in a background thread; port 0 picks a free port."""
+    server = MockMessagesServer(
+        (host, port),
+        recording=recording,
+        tokens_per_second=tokens_per_second,
+        latency=latency,
+        failures=failures,
+        batch_polls=batch_polls,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recording", help="JSON file with recorded responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=0,
+        help="simulated generation speed (0 = as fast as possible)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds to wait before the first byte of each response",
+    )
+    args = parser.parse_args()
+
+    recording = load_recording(args.recording) if args.recording else None
+    server = MockMessagesServer(
+        (args.host, args.port),
+        recording=recording,
+        tokens_per_second=args.tokens_per_second,
+        latency=args.latency,
+        verbose=True,
+    )
+    print(f"🧪 Mock Messages API listening on {server.url}")
+    print(f"   export ANTHROPIC_BASE_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Adios! 👋")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+from anthropic import Anthropic
+
+import batch_agent
+
+RECORDING = [{"content": [{"type": "text", "text": "Looks good."}]}]
+
+pytestmark = pytest.mark.mock_api(RECORDING, batch_polls=2)
+
+
+@pytest.fixture
+def api(mock_api, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    return mock_api
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def run(*argv):
+    batch_agent.main([*argv, "--poll-interval", "0.01"])
+
+
+def test_read_prompts_accepts_text_and_json():
+    lines = [
+        "first\n",
+        "\n",
+        '{"custom_id": "doc-1", "prompt": "second"}\n',
+        "{braces} are text too\n",
+    ]
+
+    assert list(batch_agent.read_prompts(lines)) == [
+        ("prompt-000000", "first"),
+        ("doc-1", "second"),
+        ("prompt-000003", "{braces} are text too"),
+    ]
+
+
+def test_prompts_are_submitted_in_chunks(api, tmp_path):
+    """Test that every prompt gets one result and each chunk its own batch."""
+    (tmp_path / "prompts.txt").write_text(
+        "".join(f"Review file {i}\n" for i in range(5)), encoding="utf-8"
+    )
+
+    run("prompts.txt", "--system", "Be brief", "--chunk-size", "2")
+
+    records = read_jsonl("batch_results.jsonl")
+    assert sorted(r["custom_id"] for r in records) == [
+        f"prompt-{i:06d}" for i in range(5)
+    ]
+    assert all(r["type"] == "succeeded" for r in records)
+    assert records[0]["text"] == "Looks good."
+    state = json.loads((tmp_path / "batch_results.jsonl.state.json").read_text())
+    assert [b["count"] for b in state["batches"]] == [2, 2, 1]
+    assert all(b["done"] for b in state["batches"])
+    request = next(iter(api.batches.values()))["requests"][0]
+    assert request["params"]["system"][0]["text"] == "Be brief"
+
+
+def test_resume_skips_finished_work(api, tmp_path):
+    """Test that resuming neither resubmits chunks nor duplicates results."""
+    (tmp_path / "prompts.txt").write_text("one\ntwo\nthree\n", encoding="utf-8")
+    run("prompts.txt", "--chunk-size", "2")
+
+    state_path = tmp_path / "batch_results.jsonl.state.json"
+    state = json.loads(state_path.read_text())
+    state["batches"][1]["done"] = False
+    state_path.write_text(json.dumps(state))
+    run("prompts.txt", "--chunk-size", "2", "--resume")
+
+    assert len(read_jsonl("batch_results.jsonl")) == 3
+    assert len(api.batches) == 2
+
+
+def test_resume_after_torn_output_line(api, tmp_path):
+    """Test that a half-written last result is dropped and fetched again."""
+    (tmp_path / "prompts.txt").write_text("one\ntwo\nthree\n", encoding="utf-8")
+    run("prompts.txt", "--chunk-size", "2")
+
+    output = tmp_path / "batch_results.jsonl"
+    lines = output.read_text(encoding="utf-8").splitlines(keepends=True)
+    output.write_text(lines[0] + lines[1][:10], encoding="utf-8")
+    state_path = tmp_path / "batch_results.jsonl.state.json"
+    state = json.loads(state_path.read_text())
+    for batch in state["batches"]:
+        batch["done"] = False
+    state_path.write_text(json.dumps(state))
+    run("prompts.txt", "--resume")
+
+    records = read_jsonl(output)
+    assert sorted(r["custom_id"] for r in records) == [
+        f"prompt-{i:06d}" for i in range(3)
+    ]
+
+
+def test_resume_keeps_the_chunk_size_of_the_run(api, tmp_path):
+    """Test that resuming with another --chunk-size does not resubmit chunks."""
+    (tmp_path / "prompts.txt").write_text("one\ntwo\nthree\n", encoding="utf-8")
+    run("prompts.txt", "--chunk-size", "2")
+
+    run("prompts.txt", "--chunk-size", "1", "--resume")
+
+    assert len(api.batches) == 2
+    assert len(read_jsonl("batch_results.jsonl")) == 3
+
+
+def test_existing_state_needs_resume(api, tmp_path):
+    (tmp_path / "prompts.txt").write_text("one\n", encoding="utf-8")
+    run("prompts.txt")
+
+    with pytest.raises(SystemExit):
+        run("prompts.txt")
+
+
+def test_collect_batch_by_id(api):
+    """Test that a batch started elsewhere can be collected by its ID."""
+    client = Anthropic(api_key="mock", base_url=api.url)
+    batch = client.messages.batches.create(
+        requests=[
+            batch_agent.build_request("elsewhere", "Hi"),
+        ]
+    )
+
+    run("--batch-id", batch.id, "--output", "collected.jsonl")
+
+    assert [r["custom_id"] for r in read_jsonl("collected.jsonl")] == ["elsewhere"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,116 @@
+import functools
+import os
+
+import pytest
+
+from agent import cache as response_cache
+from agent import loop, streaming
+from agent.cache import ResponseCache
+from test_server import RECORDING
+
+pytestmark = pytest.mark.mock_api(RECORDING)
+
+
+def request(text, **extra):
+    return {
+        "model": "claude",
+        "temperature": 0,
+        "messages": [{"role": "user", "content": text}],
+        **extra,
+    }
+
+
+class TestResponseCache:
+    def test_key_is_canonical(self, tmp_path):
+        """Test that key order and prompt-cache markers do not change the key."""
+        cache = ResponseCache(tmp_path)
+        marked = request("Hi", system=[{"type": "text", "text": "Be brief"}])
+        marked["system"][0]["cache_control"] = {"type": "ephemeral"}
+        plain = request("Hi", system=[{"type": "text", "text": "Be brief"}])
+        plain = dict(reversed(plain.items()))
+
+        assert cache.key(marked) == cache.key(plain)
+        assert cache.key(request("Hi")) != cache.key(request("Hello"))
+        assert cache.key(request("Hi")) != cache.key({**request("Hi"), "temperature": 1})
+
+    def test_put_and_get_survive_a_new_instance(self, tmp_path):
+        key = ResponseCache(tmp_path).key(request("Hi"))
+        ResponseCache(tmp_path).put(key, {"content": [], "usage": {}})
+
+        cache = ResponseCache(tmp_path)
+        assert cache.get(key) == {"content": [], "usage": {}}
+        assert cache.get("0" * 64) is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = ResponseCache(tmp_path, max_bytes=250)
+        entry = {"text": "x" * 80}
+        keys = [cache.key(request(str(i))) for i in range(3)]
+        cache.put(keys[0], entry)
+        cache.put(keys[1], entry)
+        # Make the first entry the most recently used one
+        os.utime(cache.path(keys[1]), (0, 0))
+        cache._entries[keys[1]] = (0, cache._entries[keys[1]][1])
+        cache.get(keys[0])
+
+        cache.put(keys[2], entry)
+
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == entry
+        assert cache.get(keys[2]) == entry
+        assert cache._total <= 250
+
+    def test_unreadable_entry_is_a_miss(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+        key = cache.key(request("Hi"))
+        cache.put(key, {"content": []})
+        cache.path(key).write_text("{", encoding="utf-8")
+
+        assert cache.get(key) is None
+        assert not cache.path(key).exists()
+
+
+@pytest.fixture
+def cached_api(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(response_cache, "_cache", ResponseCache(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "notes.txt").write_text("hello\n", encoding="utf-8")
+    return mock_api
+
+
+def test_chat_replays_cached_response(cached_api):
+    messages = [{"role": "user", "content": "Read notes.txt"}]
+    first = loop.chat(messages, temperature=0)
+    second = loop.chat(messages, temperature=0)
+
+    assert len(cached_api.request_sizes) == 1
+    assert second.model_dump() == first.model_dump()
+
+    loop.chat(messages)  # Not deterministic, so never cached
+    assert len(cached_api.request_sizes) == 2
+
+
+def test_streaming_agent_replays_cached_run(cached_api, monkeypatch):
+    """Test that a repeated deterministic run is replayed from the cache."""
+    monkeypatch.setattr(
+        streaming,
+        "chat_stream",
+        functools.partial(streaming.chat_stream, temperature=0),
+    )
+    monkeypatch.setattr(streaming, "renderer", streaming.NullRenderer())
+
+    runs = []
+    for _ in range(2):
+        messages = [{"role": "user", "content": "Read notes.txt"}]
+        result = streaming.run_agent(messages)
+        runs.append((messages, result))
+
+    assert len(cached_api.request_sizes) == 2
+    (first, first_result), (second, second_result) = runs
+    assert second == first
+    assert second_result["stop_reason"] == "end_turn"
+    assert second_result["output_tokens"] == first_result["output_tokens"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
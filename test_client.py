@@ -0,0 +1,74 @@
+import pytest
+
+from agent import client as agent_client
+from agent.client import create_client, get_client, request_timeout, reset_clients
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "mock")
+    reset_clients()
+    yield
+    reset_clients()
+
+
+def test_create_client_applies_pool_settings():
+    """Test that pool limits and timeouts reach the httpx transport."""
+    client = create_client(
+        max_connections=8,
+        max_keepalive_connections=4,
+        keepalive_expiry=15,
+        connect_timeout=2,
+        read_timeout=30,
+    )
+    pool = client._client._transport._pool
+
+    assert pool._max_connections == 8
+    assert pool._max_keepalive_connections == 4
+    assert pool._keepalive_expiry == 15
+    assert client.timeout.connect == 2
+    assert client.timeout.read == 30
+    client.close()
+
+
+def test_http2_needs_h2(monkeypatch, caplog):
+    """Test that HTTP/2 falls back to HTTP/1.1 with a warning when h2 is missing."""
+    monkeypatch.setattr(agent_client, "http2_available", lambda: False)
+    client = create_client(http2=True)
+
+    assert client._client._transport._pool._http2 is False
+    assert "needs h2" in caplog.text
+    client.close()
+
+
+def test_http2_is_off_by_default():
+    """Test that a default install, which has no h2, does not ask for HTTP/2."""
+    client = create_client()
+
+    assert agent_client.HTTP2 is False
+    assert client._client._transport._pool._http2 is False
+    client.close()
+
+
+def test_stream_timeout_uses_idle_limit():
+    """Test that streams get the idle timeout as their read timeout."""
+    timeout = request_timeout(stream=True, stream_idle=7, connect=1)
+
+    assert timeout.read == 7
+    assert timeout.connect == 1
+
+
+def test_shared_client_reuses_connections(mock_api):
+    """Test that repeated calls share one client and one keep-alive connection."""
+    messages = [{"role": "user", "content": "Hi"}]
+
+    for _ in range(3):
+        get_client().messages.create(model="mock", max_tokens=10, messages=messages)
+
+    assert get_client() is get_client()
+    assert len(mock_api.request_sizes) == 3
+    assert mock_api.connections == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
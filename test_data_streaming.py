@@ -0,0 +1,195 @@
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agent import streaming
+from agent.streaming import (
+    IncrementalJSONParser,
+    process_streaming_response,
+    run_tool_calls,
+)
+
+
+def feed_in_pieces(parser, text, size):
+    for i in range(0, len(text), size):
+        parser.feed(text[i : i + size])
+
+
+class TestIncrementalJSONParser:
+    def test_fields_available_before_object_completes(self):
+        """Test that early fields are exposed while a long value still streams."""
+        parser = IncrementalJSONParser()
+        parser.feed('{"command": "create", "pa')
+        assert parser.fields == {"command": "create"}
+
+        parser.feed('th": "big.py", "file_text": "line 1\\nline')
+        assert parser.fields == {"command": "create", "path": "big.py"}
+        assert not parser.complete
+
+        parser.feed(' 2"}')
+        assert parser.complete
+        assert parser.result() == {
+            "command": "create",
+            "path": "big.py",
+            "file_text": "line 1\nline 2",
+        }
+
+    @pytest.mark.parametrize("size", [1, 2, 5, 64])
+    def test_matches_json_loads(self, size):
+        """Test tricky strings and nesting split at every chunk size."""
+        value = {
+            "command": "str_replace",
+            "path": "a.py",
+            "old_str": 'x = "{[,]}" \\ "',
+            "new_str": "¡Hola! 🌍",
+            "view_range": [1, -1],
+            "nested": {"a": [None, True, 1.5]},
+        }
+        parser = IncrementalJSONParser()
+        feed_in_pieces(parser, json.dumps(value, ensure_ascii=False), size)
+
+        assert parser.result() == value
+
+    def test_invalid_json_raises(self):
+        """Test that truncated input is reported as invalid JSON."""
+        parser = IncrementalJSONParser()
+        parser.feed('{"command": "view", "path": "a.py')
+
+        with pytest.raises(json.JSONDecodeError):
+            parser.result()
+        assert parser.text() == '{"command": "view", "path": "a.py'
+
+
+class TestRenderers:
+    def test_terminal_renderer_coalesces_writes(self):
+        """Test that many small deltas become one write."""
+        out = io.StringIO()
+        renderer = streaming.TerminalRenderer(out, flush_interval=60, flush_bytes=1000)
+
+        for word in ["Hola", " ", "mundo"]:
+            renderer.text(word)
+        assert out.getvalue() == ""
+
+        renderer.flush()
+        assert out.getvalue() == "Hola mundo"
+
+    def test_terminal_renderer_flushes_at_byte_limit(self):
+        """Test that the buffer is written once it reaches flush_bytes."""
+        out = io.StringIO()
+        renderer = streaming.TerminalRenderer(out, flush_interval=60, flush_bytes=8)
+
+        renderer.text("1234")
+        renderer.text("5678")
+        assert out.getvalue() == "12345678"
+
+    def test_jsonl_renderer_records(self):
+        """Test that JSONL output groups text runs and skips tool fragments."""
+        out = io.StringIO()
+        renderer = streaming.JSONLRenderer(out, flush_interval=60)
+
+        renderer.text("Hola ")
+        renderer.text("mundo")
+        renderer.tool_input('{"command": ')
+        renderer.status("\n✅ Message completed")
+        renderer.flush()
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert records == [
+            {"type": "text", "text": "Hola mundo"},
+            {"type": "status", "message": "✅ Message completed"},
+        ]
+        # Emoji are written as-is, like in text records
+        assert "✅" in out.getvalue()
+
+    def test_make_renderer_by_name(self):
+        """Test selecting the renderer explicitly."""
+        assert isinstance(streaming.make_renderer("null"), streaming.NullRenderer)
+
+
+class FakeStream:
+    """Minimal stand-in for the SDK message stream."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def get_final_message(self):
+        return SimpleNamespace(usage=SimpleNamespace(input_tokens=1, output_tokens=1))
+
+
+def tool_use_events(tool_id, tool_input):
+    block = SimpleNamespace(type="tool_use", id=tool_id, name="str_replace_editor")
+    text = json.dumps(tool_input)
+    return [
+        SimpleNamespace(type="content_block_start", content_block=block),
+        SimpleNamespace(
+            type="content_block_delta",
+            delta=SimpleNamespace(type="input_json_delta", partial_json=text[:10]),
+        ),
+        SimpleNamespace(
+            type="content_block_delta",
+            delta=SimpleNamespace(type="input_json_delta", partial_json=text[10:]),
+        ),
+        SimpleNamespace(type="content_block_stop"),
+    ]
+
+
+class TestSpeculativeToolCalls:
+    def test_view_starts_before_message_stop(self, tmp_path, monkeypatch):
+        """Test that a view runs during streaming and its result is reused."""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "a.py").write_text("print('a')\n", encoding="utf-8")
+        started = []
+
+        def events():
+            yield from tool_use_events("t1", {"command": "view", "path": "a.py"})
+            started.extend(speculative)
+            yield SimpleNamespace(type="message_stop")
+
+        speculative = {}
+        messages = []
+        tool_calls, _ = process_streaming_response(
+            FakeStream(events()), messages, speculative
+        )
+
+        assert started == ["t1"]
+        assert run_tool_calls(messages, tool_calls, speculative)
+        assert messages[-1]["content"][0]["content"] == "1: print('a')"
+        assert speculative == {}
+
+    def test_no_speculation_after_mutating_call(self, tmp_path, monkeypatch):
+        """Test that a view following an edit in the same turn waits for the edit."""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "a.py").write_text("x = 1\n", encoding="utf-8")
+        events = (
+            tool_use_events(
+                "t1",
+                {"command": "str_replace", "path": "a.py", "old_str": "1", "new_str": "2"},
+            )
+            + tool_use_events("t2", {"command": "view", "path": "a.py"})
+            + [SimpleNamespace(type="message_stop")]
+        )
+
+        speculative = {}
+        messages = []
+        tool_calls, _ = process_streaming_response(
+            FakeStream(events), messages, speculative
+        )
+
+        assert speculative == {}
+        run_tool_calls(messages, tool_calls, speculative)
+        assert messages[-1]["content"][1]["content"] == "1: x = 2"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
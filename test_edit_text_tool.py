@@ -1,21 +1,23 @@
+import errno
 import pytest
 import tempfile
 import shutil
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import Mock
-import importlib.util
-from pathlib import Path
-
-# Import the module with numeric prefix
-spec = importlib.util.spec_from_file_location("edit_tool", "06_edit_text_tool.py")
-edit_tool = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(edit_tool)
 
-handle_text_editor_tool = edit_tool.handle_text_editor_tool
-handle_view = edit_tool.handle_view
-handle_str_replace = edit_tool.handle_str_replace
-handle_create = edit_tool.handle_create
-handle_insert = edit_tool.handle_insert
+from agent import conversation, files, loop, tools
+from agent.loop import run_tool_calls_async
+from agent.tools import (
+    get_line_index,
+    handle_create,
+    handle_insert,
+    handle_multi_edit,
+    handle_str_replace,
+    handle_text_editor_tool,
+    handle_view,
+    stream_replace,
+)
 
 
 @pytest.fixture
@@ -108,6 +110,49 @@ print("test")"""
         result = handle_str_replace(str(temp_dir / "missing.py"), "old", "new")
         assert "Error: File not found" in result
 
+    def test_str_replace_match_across_chunks(self, sample_file, monkeypatch):
+        """Test that matches spanning chunk boundaries are found."""
+        monkeypatch.setattr(tools, "STR_REPLACE_CHUNK_SIZE", 4)
+
+        result = handle_str_replace(str(sample_file), 'print("Goodbye!")', "pass")
+
+        assert "Successfully replaced text at exactly one location" in result
+        assert sample_file.read_text(encoding='utf-8').endswith("def goodbye():\n    pass\n")
+        assert not [p for p in sample_file.parent.iterdir() if p.suffix == ".tmp"]
+
+    def test_stream_replace_stops_at_second_match(self):
+        """Test that scanning stops once the edit is proven ambiguous."""
+        import io
+
+        src = io.BytesIO(b"x" * 10 + b"ab" + b"x" * 10 + b"ab" + b"x" * 100 + b"ab")
+        dst = io.BytesIO()
+
+        count = stream_replace(src, dst, b"ab", b"", chunk_size=16)
+
+        assert count == 2
+        assert src.tell() < len(src.getvalue())
+
+    def test_str_replace_ambiguous_leaves_file_untouched(self, temp_dir):
+        """Test that a rejected edit does not modify the file."""
+        file_path = temp_dir / "dup.py"
+        file_path.write_text("a = 1\na = 1\n", encoding='utf-8')
+
+        result = handle_str_replace(str(file_path), "a = 1", "a = 2")
+
+        assert "Error: Found 2 matches" in result
+        assert file_path.read_text(encoding='utf-8') == "a = 1\na = 1\n"
+        assert [p.name for p in temp_dir.iterdir()] == ["dup.py"]
+
+    def test_str_replace_multiline_in_crlf_file(self, temp_dir):
+        """Test that "\n" in an edit matches the CRLF line endings of the file."""
+        file_path = temp_dir / "crlf.py"
+        file_path.write_bytes(b"a = 1\r\nb = 2\r\nc = 3\r\n")
+
+        result = handle_str_replace(str(file_path), "a = 1\nb = 2", "a = 10\nb = 20")
+
+        assert result == "Successfully replaced text at exactly one location"
+        assert file_path.read_bytes() == b"a = 10\r\nb = 20\r\nc = 3\r\n"
+
 
 class TestHandleCreate:
     def test_create_new_file(self, temp_dir):
@@ -168,6 +213,279 @@ class TestHandleInsert:
         assert "Error: File not found" in result
 
 
+class TestSpliceInsert:
+    """Tests for inserts spliced into files that are not buffered."""
+
+    @pytest.fixture
+    def big_file(self, temp_dir):
+        path = temp_dir / "big.txt"
+        path.write_text("".join(f"line {i}\n" for i in range(1, 5001)), encoding='utf-8')
+        return path
+
+    def test_insert_near_end_keeps_line_index_current(self, big_file):
+        """Test that a splice shifts the cached line index instead of dropping it."""
+        get_line_index(big_file)
+        handle_insert(str(big_file), 4998, "inserted")
+
+        cached = get_line_index(big_file)
+        tools._line_index_cache.clear()
+        assert cached == get_line_index(big_file)
+        assert handle_view(str(big_file), [4998, 5000]) == (
+            "4998: line 4998\n4999: inserted\n5000: line 4999"
+        )
+
+    @pytest.mark.parametrize("unsupported", ["copy_file_range", "sendfile"])
+    def test_falls_back_when_kernel_copy_is_unsupported(
+        self, big_file, monkeypatch, unsupported
+    ):
+        """Test that a splice falls back to read/write when kernel copies fail."""
+
+        def refuse(*args):
+            raise OSError(errno.EXDEV, "cross-device")
+
+        monkeypatch.setattr(files, f"_{unsupported}", refuse)
+        if unsupported == "sendfile":
+            monkeypatch.setattr(files, "_copy_file_range", refuse)
+        expected = big_file.read_text(encoding='utf-8').splitlines(keepends=True)
+        expected.insert(2500, "middle\n")
+
+        handle_insert(str(big_file), 2500, "middle")
+
+        assert big_file.read_text(encoding='utf-8') == "".join(expected)
+
+
+class TestHandleMultiEdit:
+    """Tests for applying a batch of edits with multi_edit."""
+
+    def test_applies_replacements_and_inserts_against_original(self, sample_file):
+        """Test that every edit refers to the file as it was before the batch."""
+        edits = [
+            {"old_str": "Goodbye!", "new_str": "Bye!"},
+            {"insert_line": 0, "new_str": "import sys"},
+            {"old_str": "return True", "new_str": "return False"},
+            {"insert_line": 4, "new_str": "# farewell"},
+        ]
+
+        result = handle_multi_edit(str(sample_file), edits)
+
+        assert result == f"Successfully applied 4 edits to {sample_file}"
+        assert sample_file.read_text(encoding='utf-8') == (
+            "import sys\n"
+            "def hello():\n"
+            '    print("Hello, World!")\n'
+            "    return False\n"
+            "\n"
+            "# farewell\n"
+            "def goodbye():\n"
+            '    print("Bye!")\n'
+        )
+
+    @pytest.mark.parametrize(
+        "bad_edit, message",
+        [
+            ({"old_str": "missing", "new_str": "x"}, "edit 2: no match"),
+            ({"old_str": "print", "new_str": "x"}, "edit 2: 2 matches"),
+            ({"old_str": "Hello, World", "new_str": "x"}, "edit 2 overlaps edit 1"),
+        ],
+    )
+    def test_rejects_whole_batch(self, sample_file, bad_edit, message):
+        """Test that one bad edit leaves the file untouched."""
+        original = sample_file.read_text(encoding='utf-8')
+        edits = [{"old_str": 'print("Hello, World!")', "new_str": "pass"}, bad_edit]
+
+        result = handle_multi_edit(str(sample_file), edits)
+
+        assert result.startswith("Error: No edits applied")
+        assert message in result
+        assert sample_file.read_text(encoding='utf-8') == original
+
+    def test_dispatched_by_tool_name_with_one_write(self, temp_dir, monkeypatch):
+        """Test that the multi_edit tool writes the file once."""
+        (temp_dir / "calls.py").write_text("f(1)\ng(2)\nh(3)\n", encoding='utf-8')
+        monkeypatch.chdir(temp_dir)
+        writes = []
+        monkeypatch.setattr(tools, "write_file", lambda path, text: writes.append(text))
+        tool_call = {
+            "name": "multi_edit",
+            "input": {
+                "path": "calls.py",
+                "edits": [
+                    {"old_str": f"{name}(", "new_str": f"{name}_new("}
+                    for name in "fgh"
+                ],
+            },
+        }
+
+        assert "Successfully applied 3 edits" in handle_text_editor_tool(tool_call)
+        assert writes == ["f_new(1)\ng_new(2)\nh_new(3)\n"]
+
+    def test_matches_crlf_line_endings(self, temp_dir):
+        """Test that multi-line edits written with "\n" apply to CRLF files."""
+        path = temp_dir / "crlf.py"
+        path.write_bytes(b"a = 1\r\nb = 2\r\nc = 3\r\n")
+        edits = [
+            {"old_str": "a = 1\nb = 2", "new_str": "a = 10\nb = 20"},
+            {"insert_line": 3, "new_str": "d = 4"},
+        ]
+
+        result = handle_multi_edit(str(path), edits)
+
+        assert result == f"Successfully applied 2 edits to {path}"
+        assert path.read_bytes() == b"a = 10\r\nb = 20\r\nc = 3\r\nd = 4\r\n"
+
+
+class TestAtomicWrites:
+    """Tests for crash-safe writes and their durability modes."""
+
+    @pytest.fixture
+    def fsyncs(self, monkeypatch):
+        """Record the fsync calls made by the write layer."""
+        calls = []
+        monkeypatch.setattr(files.os, "fsync", calls.append)
+        files.sync_writes()
+        return calls
+
+    def test_edit_mode_syncs_every_edit(self, sample_file, fsyncs, monkeypatch):
+        """Test that "edit" durability fsyncs each file and its directory."""
+        monkeypatch.setattr(files, "WRITE_DURABILITY", "edit")
+        handle_str_replace(str(sample_file), "Goodbye!", "Bye!")
+        handle_insert(str(sample_file), 0, "# header")
+
+        # The file data and its directory, for each edit
+        assert len(fsyncs) == 4
+
+    def test_turn_mode_syncs_once_per_file(self, sample_file, fsyncs, monkeypatch):
+        """Test that "turn" durability defers fsyncs to sync_writes."""
+        monkeypatch.setattr(files, "WRITE_DURABILITY", "turn")
+        handle_str_replace(str(sample_file), "Goodbye!", "Bye!")
+        handle_insert(str(sample_file), 0, "# header")
+        assert fsyncs == []
+
+        assert files.sync_writes() == 1
+        assert len(fsyncs) == 2
+        assert files.sync_writes() == 0
+
+    def test_none_mode_never_syncs(self, sample_file, fsyncs, monkeypatch):
+        """Test that "none" durability never fsyncs."""
+        monkeypatch.setattr(files, "WRITE_DURABILITY", "none")
+        handle_str_replace(str(sample_file), "Goodbye!", "Bye!")
+
+        assert files.sync_writes() == 0
+        assert fsyncs == []
+
+    def test_replace_keeps_mode_and_create_uses_umask(self, temp_dir, sample_file):
+        """Test file permissions after edits and creates."""
+        sample_file.chmod(0o640)
+        handle_str_replace(str(sample_file), "Goodbye!", "Bye!")
+        handle_create(str(temp_dir / "new.py"), "x = 1\n")
+
+        assert sample_file.stat().st_mode & 0o777 == 0o640
+        assert (temp_dir / "new.py").stat().st_mode & 0o777 == 0o666 & ~files._UMASK
+
+    def test_uncommitted_write_leaves_target_untouched(self, sample_file):
+        """Test that a write that fails midway changes nothing."""
+        original = sample_file.read_text(encoding='utf-8')
+        with pytest.raises(RuntimeError):
+            with files.AtomicFile(sample_file) as f:
+                f.write(b"partial")
+                raise RuntimeError("crash mid-write")
+
+        assert sample_file.read_text(encoding='utf-8') == original
+        assert [p.name for p in sample_file.parent.iterdir()] == ["test.py"]
+
+    @pytest.mark.parametrize("cached", [False, True])
+    def test_edits_write_through_symlinks(self, temp_dir, sample_file, cached):
+        """Test that edits change a symlink's target, not the link."""
+        link = temp_dir / "link.py"
+        link.symlink_to(sample_file)
+        buffers = files.BufferCache() if cached else None
+
+        result = handle_str_replace(str(link), "Goodbye!", "Bye!", buffers)
+        assert result == "Successfully replaced text at exactly one location"
+        assert handle_insert(str(link), 0, "# header", buffers).startswith("Success")
+
+        assert link.is_symlink()
+        content = sample_file.read_text(encoding='utf-8')
+        assert content.startswith("# header\n")
+        assert 'print("Bye!")' in content
+        assert sorted(p.name for p in temp_dir.iterdir()) == ["link.py", "test.py"]
+
+
+class TestBufferCache:
+    """Tests for the per-session cache of file buffers."""
+
+    def test_view_edit_view_reads_disk_once(self, sample_file):
+        """Test that views and edits of a cached file share one read."""
+        buffers = files.BufferCache()
+        handle_view(str(sample_file), None, buffers)
+        handle_str_replace(str(sample_file), "Goodbye!", "Bye!", buffers)
+        result = handle_view(str(sample_file), [5, 6], buffers)
+
+        assert result == '5: def goodbye():\n6:     print("Bye!")'
+        assert (buffers.hits, buffers.misses) == (2, 1)
+        assert 'print("Bye!")' in sample_file.read_text(encoding='utf-8')
+
+    def test_outside_change_invalidates_buffer(self, sample_file):
+        """Test that a change made outside the tool is picked up."""
+        buffers = files.BufferCache()
+        handle_view(str(sample_file), None, buffers)
+        sample_file.write_text("changed\n", encoding='utf-8')
+
+        assert handle_view(str(sample_file), None, buffers) == "1: changed"
+        assert buffers.misses == 2
+
+    @pytest.mark.parametrize("insert_line", [0, 2, 6, 10, -1])
+    def test_insert_matches_uncached_insert(self, temp_dir, insert_line):
+        """Test that cached and uncached inserts give the same file."""
+        content = "a\nb\nc\nd\ne\nf"
+        cached, plain = temp_dir / "cached.txt", temp_dir / "plain.txt"
+        cached.write_text(content, encoding='utf-8')
+        plain.write_text(content, encoding='utf-8')
+
+        handle_insert(str(cached), insert_line, "new", files.BufferCache())
+        handle_insert(str(plain), insert_line, "new")
+
+        assert cached.read_text(encoding='utf-8') == plain.read_text(encoding='utf-8')
+
+    def test_evicts_least_recently_used(self, temp_dir):
+        """Test that the least recently used buffers are evicted first."""
+        buffers = files.BufferCache(max_bytes=300)
+        paths = []
+        for name in "abcd":
+            path = temp_dir / f"{name}.txt"
+            path.write_text(name * 70, encoding='utf-8')
+            paths.append(path)
+        for index in (0, 1, 0, 2, 3):
+            buffers.get(paths[index])
+
+        cached = set(buffers._buffers)
+        assert cached == {paths[i].resolve() for i in (0, 2, 3)}
+        assert buffers.size <= 300
+
+    def test_large_files_are_not_cached(self, temp_dir):
+        """Test that files over a quarter of the budget are read from disk."""
+        path = temp_dir / "big.txt"
+        path.write_text("x" * 200, encoding='utf-8')
+        buffers = files.BufferCache(max_bytes=400)
+
+        assert buffers.get(path) is None
+        assert handle_view(str(path), None, buffers) == "1: " + "x" * 200
+
+    @pytest.mark.parametrize("cached", [False, True])
+    def test_edits_keep_crlf_line_endings(self, temp_dir, cached):
+        """Test that edits written with "\n" keep a file's CRLF endings."""
+        path = temp_dir / "crlf.py"
+        path.write_bytes(b"a = 1\r\nb = 2\r\n")
+        buffers = files.BufferCache() if cached else None
+
+        result = handle_str_replace(str(path), "a = 1\nb = 2", "a = 3\nb = 4", buffers)
+        assert result == "Successfully replaced text at exactly one location"
+        handle_insert(str(path), 1, "x = 0\ny = 0", buffers)
+
+        assert path.read_bytes() == b"a = 3\r\nx = 0\r\ny = 0\r\nb = 4\r\n"
+        assert handle_view(str(path), None, buffers).split("\n")[1] == "2: x = 0"
+
+
 class TestHandleTextEditorTool:
     def test_security_directory_traversal(self):
         """Test security check for directory traversal."""
@@ -230,6 +548,14 @@ class TestHandleTextEditorTool:
             result = handle_text_editor_tool(tool_call)
             assert "Error:" not in result or "File not found" in result  # File not found is OK
     
+    def test_tool_calls_do_not_print(self, sample_file, capsys):
+        """Test that tool calls leave stdout to the renderer."""
+        tool_call = Mock()
+        tool_call.input = {"command": "view", "path": str(sample_file)}
+        handle_text_editor_tool(tool_call)
+
+        assert capsys.readouterr().out == ""
+
     def test_unknown_command(self):
         """Test handling of unknown commands."""
         tool_call = Mock()
@@ -242,6 +568,221 @@ class TestHandleTextEditorTool:
         assert "Error: Unknown command 'unknown_command'" in result
 
 
+class TestRunToolCallsAsync:
+    def test_results_keep_call_order(self, temp_dir, monkeypatch):
+        """Test that concurrent tool results come back in call order."""
+        import asyncio
+
+        monkeypatch.chdir(temp_dir)
+        for name in ["a.py", "b.py", "c.py"]:
+            (temp_dir / name).write_text(f"# {name}\n", encoding='utf-8')
+
+        tool_calls = []
+        for name in ["c.py", "a.py", "b.py"]:
+            tool_call = Mock()
+            tool_call.input = {'command': 'view', 'path': name}
+            tool_calls.append(tool_call)
+
+        results = asyncio.run(run_tool_calls_async(tool_calls, max_concurrency=2))
+
+        assert results == ["1: # c.py", "1: # a.py", "1: # b.py"]
+
+    def test_same_path_calls_run_in_order(self, temp_dir, monkeypatch):
+        """Test that an edit and a later view of the same file stay ordered."""
+        import asyncio
+
+        monkeypatch.chdir(temp_dir)
+        (temp_dir / "a.py").write_text("x = 1\n", encoding='utf-8')
+
+        edit = Mock()
+        edit.input = {'command': 'str_replace', 'path': 'a.py', 'old_str': 'x = 1', 'new_str': 'x = 2'}
+        view = Mock()
+        view.input = {'command': 'view', 'path': 'a.py'}
+
+        results = asyncio.run(run_tool_calls_async([edit, view]))
+
+        assert results[1] == "1: x = 2"
+
+    def test_equivalent_paths_share_a_lock(self, monkeypatch):
+        """Test that differently spelled paths to one file never run at once."""
+        import asyncio
+        import threading
+        import time
+
+        active = []
+        overlaps = []
+        lock = threading.Lock()
+
+        def handle(tool_call):
+            with lock:
+                active.append(tool_call)
+                overlaps.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(tool_call)
+            return "ok"
+
+        monkeypatch.setattr("agent.loop.handle_text_editor_tool", handle)
+        tool_calls = []
+        for path in ["a.py", "./a.py", "/a.py", "sub/../a.py"]:
+            tool_call = Mock()
+            tool_call.input = {'command': 'view', 'path': path}
+            tool_calls.append(tool_call)
+
+        asyncio.run(run_tool_calls_async(tool_calls, max_concurrency=4))
+
+        assert overlaps == [1, 1, 1, 1]
+
+
+class TestPromptCaching:
+    def test_breakpoints_on_tools_system_and_last_message(self):
+        """Test cache breakpoint placement without touching the stored history."""
+        messages = [
+            {"role": "user", "content": "Hola"},
+            {"role": "assistant", "content": [{"type": "text", "text": "Hi"}]},
+            {"role": "user", "content": "Show test.py"},
+        ]
+
+        params = loop.build_chat_params(messages, system="Be brief")
+
+        assert params["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert params["system"] == [
+            {"type": "text", "text": "Be brief", "cache_control": {"type": "ephemeral"}}
+        ]
+        assert params["messages"][-1]["content"] == [
+            {"type": "text", "text": "Show test.py", "cache_control": {"type": "ephemeral"}}
+        ]
+        assert params["messages"][:2] == messages[:2]
+        assert messages[-1]["content"] == "Show test.py"
+
+
+class TestCompactMessages:
+    @staticmethod
+    def exchange(i, payload_size):
+        return [
+            {"role": "user", "content": f"Question {i}"},
+            {"role": "assistant", "content": [
+                {"type": "tool_use", "id": f"t{i}", "name": "str_replace_editor",
+                 "input": {"command": "view", "path": f"file{i}.py"}},
+            ]},
+            {"role": "user", "content": [
+                {"type": "tool_result", "tool_use_id": f"t{i}", "content": "x" * payload_size},
+            ]},
+            {"role": "assistant", "content": [{"type": "text", "text": f"Answer {i}"}]},
+        ]
+
+    def test_small_history_is_untouched(self):
+        """Test that nothing happens below the limit."""
+        messages = self.exchange(0, 100)
+        assert conversation.compact_messages(messages, token_limit=1000) is False
+        assert messages == self.exchange(0, 100)
+
+    def test_limit_is_read_at_call_time(self, monkeypatch):
+        """Test that changing CONTEXT_TOKEN_LIMIT after import takes effect."""
+        messages = self.exchange(0, 2000)
+        monkeypatch.setattr(conversation, "CONTEXT_TOKEN_LIMIT", 10**9)
+        assert conversation.compact_messages(messages) is False
+        monkeypatch.setattr(conversation, "CONTEXT_TOKEN_LIMIT", 100)
+        assert conversation.compact_messages(messages) is True
+
+    def test_old_tool_results_are_elided_first(self):
+        """Test that old tool output is dropped before any turn is summarized."""
+        messages = self.exchange(0, 8000) + self.exchange(1, 100)
+
+        assert conversation.compact_messages(messages, token_limit=1500, keep_recent=4)
+
+        assert len(messages) == 8
+        assert messages[2]["content"][0]["content"].startswith("[Earlier tool output elided:")
+        assert messages[6]["content"][0]["content"] == "x" * 100
+
+    def test_old_turns_are_folded_into_digest(self):
+        """Test that older exchanges become a digest and tool pairs stay intact."""
+        messages = []
+        for i in range(10):
+            messages += self.exchange(i, 400)
+
+        assert conversation.compact_messages(messages, token_limit=600, keep_recent=4)
+
+        assert messages[0]["role"] == "user"
+        digest, question = messages[0]["content"]
+        assert digest["text"].startswith("Summary of earlier conversation:")
+        assert "- user: Question 0" in digest["text"]
+        assert "assistant used str_replace_editor: view file8.py" in digest["text"]
+        assert question == {"type": "text", "text": "Question 9"}
+        tool_use_ids = {m["content"][0]["id"] for m in messages if m["role"] == "assistant" and m["content"][0]["type"] == "tool_use"}
+        tool_result_ids = {m["content"][0]["tool_use_id"] for m in messages if m["role"] == "user" and m["content"][0]["type"] == "tool_result"}
+        assert tool_use_ids == tool_result_ids == {"t9"}
+
+
+class TestRunAgent:
+    @staticmethod
+    def make_response(*content):
+        response = Mock()
+        response.content = list(content)
+        response.usage = Mock(
+            input_tokens=10,
+            output_tokens=5,
+            cache_read_input_tokens=0,
+            cache_creation_input_tokens=0,
+        )
+        return response
+
+    @staticmethod
+    def view_call(tool_id, path):
+        return SimpleNamespace(
+            type="tool_use",
+            id=tool_id,
+            name="str_replace_editor",
+            input={'command': 'view', 'path': path},
+        )
+
+    def test_runs_tools_until_end_turn(self, sample_file, monkeypatch):
+        """Test that the loop keeps calling Claude until no tools are requested."""
+        monkeypatch.chdir(sample_file.parent)
+        responses = iter([
+            self.make_response(self.view_call("t1", "test.py")),
+            self.make_response(SimpleNamespace(type="text", text="Done")),
+        ])
+        monkeypatch.setattr(loop, "chat", lambda messages, system=None, tools=None: next(responses))
+        messages = [{"role": "user", "content": "Show test.py"}]
+
+        result = loop.run_agent(messages)
+
+        assert result["stop_reason"] == "end_turn"
+        assert len(result["turns"]) == 2
+        assert result["input_tokens"] == 20
+        assert messages[2]["content"][0]["tool_use_id"] == "t1"
+        assert "1: def hello():" in messages[2]["content"][0]["content"]
+
+    def test_stops_at_max_turns(self, sample_file, monkeypatch):
+        """Test that a model that never stops using tools is cut off."""
+        monkeypatch.chdir(sample_file.parent)
+        monkeypatch.setattr(
+            loop,
+            "chat",
+            lambda messages, system=None, tools=None: self.make_response(self.view_call("t", "test.py")),
+        )
+
+        result = loop.run_agent([{"role": "user", "content": "Loop"}], max_turns=3)
+
+        assert result["stop_reason"] == "max_turns"
+        assert len(result["turns"]) == 3
+
+    def test_stops_at_token_budget(self, sample_file, monkeypatch):
+        """Test that the token budget ends the run."""
+        monkeypatch.chdir(sample_file.parent)
+        monkeypatch.setattr(
+            loop,
+            "chat",
+            lambda messages, system=None, tools=None: self.make_response(self.view_call("t", "test.py")),
+        )
+
+        result = loop.run_agent([{"role": "user", "content": "Loop"}], max_total_tokens=30)
+
+        assert result["stop_reason"] == "max_total_tokens"
+        assert len(result["turns"]) == 2
+
+
 class TestEdgeCases:
     def test_unicode_content(self, temp_dir):
         """Test handling of Unicode content."""
@@ -290,6 +831,26 @@ def greet():
         assert "500: # Line 499" in result  # 0-indexed in array, 1-indexed in display
         assert "505: # Line 504" in result
 
+    def test_line_index_is_cached_until_file_changes(self, temp_dir):
+        """Test that the line index is reused and rebuilt after modification."""
+        file_path = temp_dir / "indexed.py"
+        file_path.write_text("a\nb\nc", encoding='utf-8')
+
+        first = get_line_index(file_path)
+        assert list(first) == [0, 2, 4, 5]
+        assert get_line_index(file_path) is first
+
+        file_path.write_text("a\nb\nc\nlonger line\n", encoding='utf-8')
+        rebuilt = get_line_index(file_path)
+        assert rebuilt is not first
+        assert list(rebuilt) == [0, 2, 4, 6, 18]
+        assert handle_view(str(file_path), (4, -1)) == "4: longer line"
+
+    def test_view_range_out_of_bounds(self, sample_file):
+        """Test view ranges past the end of the file."""
+        assert handle_view(str(sample_file), (6, 100)) == '6:     print("Goodbye!")'
+        assert handle_view(str(sample_file), (50, 60)) == ""
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
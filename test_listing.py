@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from agent.listing import IgnoreRules, scan_directory, view_directory, walk_directory
+from agent.tools import handle_view
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text(
+        "# build output\n*.log\n/dist/\nbuild/\n!keep.log\n", encoding="utf-8"
+    )
+    for path in [
+        "app.py",
+        "debug.log",
+        "keep.log",
+        "dist/bundle.js",
+        "src/build/out.txt",
+        "src/main.py",
+        "src/dist/notes.md",
+        "src/deep/er/file.py",
+        "node_modules/lib/index.js",
+    ]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("x\n", encoding="utf-8")
+    (tmp_path / "src" / ".gitignore").write_text("*.md\n", encoding="utf-8")
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "path, is_dir, expected",
+    [
+        ("a.log", False, True),
+        ("src/a.log", False, True),
+        ("keep.log", False, False),
+        ("dist", True, True),
+        ("src/dist", True, None),
+        ("src/build", True, True),
+        ("build", False, None),
+        ("app.py", False, None),
+    ],
+)
+def test_ignore_rules(path, is_dir, expected):
+    rules = IgnoreRules("/repo", ["*.log", "/dist/", "build/", "!keep.log"])
+    assert rules.match(path, is_dir) is expected
+
+
+def test_walk_honours_gitignore_files(tree):
+    entries, ignored = walk_directory(tree, depth=3)
+
+    assert entries == [
+        ".gitignore",
+        "app.py",
+        "keep.log",
+        "src/",
+        "src/.gitignore",
+        "src/deep/",
+        "src/deep/er/",
+        "src/dist/",
+        "src/main.py",
+    ]
+    # .git, debug.log, dist, node_modules, src/build and src/dist/notes.md
+    assert ignored == 6
+
+
+def test_depth_limits_the_listing(tree):
+    entries, _ = walk_directory(tree, depth=1)
+    assert entries == [".gitignore", "app.py", "keep.log", "src/"]
+
+
+def test_view_pages_through_entries(tree):
+    first = view_directory(str(tree), depth=3, limit=3)
+    second = view_directory(str(tree), [4, 6], depth=3, limit=3)
+
+    assert first.splitlines()[1:4] == [".gitignore", "app.py", "keep.log"]
+    assert "(Showing entries 1-3 of 9)" in first
+    assert "view_range [4, 6]" in first
+    assert second.splitlines()[1:4] == ["src/", "src/.gitignore", "src/deep/"]
+
+
+def test_scan_is_cached_until_directory_changes(tree):
+    listing = scan_directory(str(tree))
+    assert scan_directory(str(tree)) is listing
+
+    (tree / "new.py").write_text("", encoding="utf-8")
+    os.utime(tree, ns=(0, os.stat(tree).st_mtime_ns + 1))
+
+    assert ("new.py", False) in scan_directory(str(tree))
+
+
+def test_handle_view_lists_directories(tree):
+    result = handle_view(str(tree / "src"), [1, 2])
+    assert result.splitlines()[:3] == [
+        f"Directory contents of {tree / 'src'}:",
+        ".gitignore",
+        "deep/",
+    ]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,83 @@
+import pytest
+from anthropic import Anthropic
+
+from agent import streaming
+
+RECORDING = [
+    {
+        "content": [
+            {"type": "text", "text": "Reading the file."},
+            {
+                "type": "tool_use",
+                "id": "toolu_1",
+                "name": "str_replace_editor",
+                "input": {"command": "view", "path": "notes.txt"},
+            },
+        ]
+    },
+    {"content": [{"type": "text", "text": "It says hello."}]},
+]
+
+
+pytestmark = pytest.mark.mock_api(RECORDING)
+
+
+@pytest.fixture
+def client(mock_api):
+    return Anthropic(api_key="mock", base_url=mock_api.url, max_retries=0)
+
+
+def test_create_replays_by_turn(client):
+    """Test that non-streaming responses follow the recording."""
+    messages = [{"role": "user", "content": "What is in notes.txt?"}]
+
+    first = client.messages.create(model="mock", max_tokens=100, messages=messages)
+    assert first.stop_reason == "tool_use"
+    assert first.content[1].input == {"command": "view", "path": "notes.txt"}
+
+    messages += [
+        {"role": "assistant", "content": first.content},
+        {
+            "role": "user",
+            "content": [
+                {"type": "tool_result", "tool_use_id": "toolu_1", "content": "hello"}
+            ],
+        },
+    ]
+    second = client.messages.create(model="mock", max_tokens=100, messages=messages)
+    assert second.stop_reason == "end_turn"
+    assert second.content[0].text == "It says hello."
+
+
+def test_stream_rebuilds_the_message(client):
+    """Test that streamed events add up to the recorded message."""
+    with client.beta.messages.stream(
+        model="mock",
+        max_tokens=100,
+        messages=[{"role": "user", "content": "Hi"}],
+    ) as stream:
+        deltas = [e.delta.type for e in stream if e.type == "content_block_delta"]
+        message = stream.get_final_message()
+
+    assert "text_delta" in deltas and "input_json_delta" in deltas
+    assert message.content[0].text == "Reading the file."
+    assert message.content[1].input == {"command": "view", "path": "notes.txt"}
+
+
+def test_streaming_agent_runs_against_mock(mock_api, tmp_path, monkeypatch):
+    """Test the 08 agent loop end to end without network access."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "notes.txt").write_text("hello\n", encoding="utf-8")
+    monkeypatch.setattr(streaming, "renderer", streaming.NullRenderer())
+    messages = [{"role": "user", "content": "What is in notes.txt?"}]
+
+    result = streaming.run_agent(messages)
+
+    assert result["stop_reason"] == "end_turn"
+    assert len(result["turns"]) == 2
+    assert messages[2]["content"][0]["content"] == "1: hello"
+    assert len(mock_api.request_sizes) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
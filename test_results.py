@@ -0,0 +1,187 @@
+import pytest
+
+from agent import results
+from agent.results import drop_results, limit_result, read_result, scratch_dir
+from agent.tools import handle_text_editor_tool
+
+
+@pytest.fixture(autouse=True)
+def scratch(monkeypatch, tmp_path):
+    monkeypatch.setattr(results, "TOOL_RESULT_SCRATCH_ROOT", str(tmp_path / "scratch"))
+
+
+def numbered(count):
+    return "\n".join(f"{number}: line {number}" for number in range(1, count + 1))
+
+
+def handle_of(result):
+    return result.split("handle '")[1].split("'")[0]
+
+
+class TestLimitResult:
+    def test_small_results_pass_through(self, tmp_path):
+        assert limit_result("1: ok", tmp_path, max_bytes=1000) == "1: ok"
+        assert not scratch_dir(tmp_path).exists()
+
+    def test_cuts_to_head_and_tail_on_line_breaks(self, tmp_path):
+        text = numbered(1000)
+
+        result = limit_result(text, tmp_path, max_bytes=2000)
+
+        assert len(result.encode("utf-8")) <= 2000
+        lines = result.split("\n")
+        assert lines[0] == "1: line 1"
+        assert lines[-1] == "1000: line 1000"
+        note = next(line for line in lines if line.startswith("... [lines"))
+        head = lines[: lines.index(note)]
+        tail = lines[lines.index(note) + 1 :]
+        assert head == text.split("\n")[: len(head)]
+        assert tail == text.split("\n")[-len(tail) :]
+        assert f"lines {len(head) + 1}-{1000 - len(tail)} of 1000" in note
+
+    def test_a_single_long_line_is_cut_in_two(self, tmp_path):
+        result = limit_result("x" * 5000, tmp_path, max_bytes=1000)
+
+        assert len(result) <= 1000
+        assert result.startswith("xxx")
+        assert "[lines 1-1 of 1 not shown" in result
+
+    def test_same_result_is_saved_once(self, tmp_path):
+        text = numbered(1000)
+
+        first = limit_result(text, tmp_path, max_bytes=2000)
+        second = limit_result(text, tmp_path, max_bytes=2000)
+
+        assert handle_of(first) == handle_of(second)
+        assert len(list(scratch_dir(tmp_path).iterdir())) == 1
+
+
+class TestReadResult:
+    def test_pages_through_saved_result(self, tmp_path):
+        handle = handle_of(limit_result(numbered(1000), tmp_path, max_bytes=2000))
+
+        page = read_result(handle, [500, 502], tmp_path)
+
+        assert page.split("\n") == [
+            "500: line 500",
+            "501: line 501",
+            "502: line 502",
+            "(Lines 500-502 of 1000; view_range [503, 702] reads on)",
+        ]
+        last_page = read_result(handle, [999, -1], tmp_path)
+        assert last_page.endswith("(Lines 999-1000 of 1000)")
+
+    def test_pages_stay_within_budget(self, tmp_path):
+        handle = handle_of(limit_result(numbered(1000), tmp_path, max_bytes=2000))
+
+        page = read_result(handle, None, tmp_path, max_bytes=2000)
+
+        assert len(page.encode("utf-8")) <= 2000
+        lines = page.split("\n")
+        assert lines[0] == "1: line 1"
+        shown = len(lines) - 1
+        footer = f"(Lines 1-{shown} of 1000; view_range [{shown + 1},"
+        assert lines[-1].startswith(footer)
+
+    def test_view_range_before_the_first_line_starts_at_it(self, tmp_path):
+        """Test that view_range [0, n] is read as [1, n] rather than an error."""
+        handle = handle_of(limit_result(numbered(1000), tmp_path, max_bytes=2000))
+
+        page = read_result(handle, [0, 2], tmp_path)
+
+        assert page.split("\n") == [
+            "1: line 1",
+            "2: line 2",
+            "(Lines 1-2 of 1000; view_range [3, 202] reads on)",
+        ]
+        error = read_result(handle, [1001, 1005], tmp_path)
+        assert error.startswith("Error: view_range [1001, 1005] is outside")
+        assert "which has lines 1-1000" in error
+
+    def test_unknown_and_dropped_handles(self, tmp_path):
+        handle = handle_of(limit_result(numbered(1000), tmp_path, max_bytes=2000))
+
+        assert read_result("../../etc/passwd", None, tmp_path).startswith("Error")
+        assert read_result(handle, None, tmp_path / "other").startswith("Error")
+        drop_results(tmp_path)
+        assert "no longer available" in read_result(handle, None, tmp_path)
+
+
+def test_results_without_a_sandbox_are_deleted_at_exit(tmp_path, monkeypatch):
+    """Test that the CLI's saved results go with the process, sessions' stay."""
+    monkeypatch.chdir(tmp_path)
+    limit_result(numbered(1000), max_bytes=2000)
+    limit_result(numbered(1000), tmp_path / "session", max_bytes=2000)
+    assert scratch_dir().exists()
+
+    results._drop_process_results()
+
+    assert not scratch_dir().exists()
+    assert scratch_dir(tmp_path / "session").exists()
+    drop_results(tmp_path / "session")
+    assert not (tmp_path / "scratch").exists()
+
+
+def test_large_view_is_cut_and_readable_through_the_tool(tmp_path):
+    (tmp_path / "big.txt").write_text(
+        "".join(f"row {number}\n" for number in range(1, 20001)), encoding="utf-8"
+    )
+
+    view = {
+        "name": "str_replace_editor",
+        "input": {"command": "view", "path": "big.txt"},
+    }
+    result = handle_text_editor_tool(view, root=tmp_path)
+
+    assert len(result.encode("utf-8")) <= results.TOOL_RESULT_MAX_BYTES
+    assert result.startswith("1: row 1\n")
+    assert result.endswith("20000: row 20000")
+
+    read = {
+        "name": "read_result",
+        "input": {"handle": handle_of(result), "view_range": [12345, 12346]},
+    }
+    page = handle_text_editor_tool(read, root=tmp_path)
+    assert page.split("\n")[:2] == ["12345: row 12345", "12346: row 12346"]
+
+
+def test_ranged_view_is_paged_in_file_lines(tmp_path):
+    """Test that notes and pages of a ranged view use the file's line numbers."""
+    (tmp_path / "big.txt").write_text(
+        "".join(f"row {number}\n" for number in range(1, 20001)), encoding="utf-8"
+    )
+
+    view = {
+        "name": "str_replace_editor",
+        "input": {"command": "view", "path": "big.txt", "view_range": [5001, 15000]},
+    }
+    result = handle_text_editor_tool(view, root=tmp_path)
+
+    lines = result.split("\n")
+    note = next(line for line in lines if line.startswith("... [lines"))
+    head = lines[: lines.index(note)]
+    first_missing = 5001 + len(head)
+    assert note.startswith(f"... [lines {first_missing}-")
+    assert "of 5001-15000 not shown" in note
+    assert f"view_range [{first_missing}, {first_missing + 199}]" in note
+
+    read = {
+        "name": "read_result",
+        "input": {"handle": handle_of(result), "view_range": [first_missing, 12346]},
+    }
+    page = handle_text_editor_tool(read, root=tmp_path).split("\n")
+    assert page[0] == f"{first_missing}: row {first_missing}"
+    assert page[-1].startswith(f"(Lines {first_missing}-")
+    assert "of 5001-15000; view_range [" in page[-1]
+    # Reading from before the view's first line starts at that line
+    read["input"]["view_range"] = [1, 5002]
+    page = handle_text_editor_tool(read, root=tmp_path).split("\n")
+    assert page == [
+        "5001: row 5001",
+        "5002: row 5002",
+        "(Lines 5001-5002 of 5001-15000; view_range [5003, 5202] reads on)",
+    ]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
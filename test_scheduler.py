@@ -0,0 +1,245 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from agent import loop, streaming
+from agent.scheduler import RequestScheduler, classify_error
+from test_server import RECORDING
+
+
+class FakeError(Exception):
+    def __init__(self, status_code=None, body=None):
+        super().__init__("fake")
+        self.status_code = status_code
+        self.body = body
+
+
+def make_scheduler(**options):
+    options = {"backoff_base": 0.001, "backoff_max": 0.01, **options}
+    return RequestScheduler(**options)
+
+
+class TestAdmission:
+    def test_success_raises_limit_and_throttle_halves_it(self):
+        scheduler = make_scheduler(initial_concurrency=4, max_concurrency=8)
+        for _ in range(4):
+            scheduler.acquire()
+            scheduler.release()
+        assert scheduler.limit == pytest.approx(5, abs=0.1)
+
+        scheduler.acquire()
+        scheduler.release("throttle")
+        assert scheduler.limit == pytest.approx(2.5, abs=0.1)
+
+    def test_decrease_once_per_interval(self):
+        """Test that a burst of throttled requests only halves the limit once."""
+        scheduler = make_scheduler(initial_concurrency=8, decrease_interval=60)
+        for _ in range(3):
+            scheduler.acquire()
+        for _ in range(3):
+            scheduler.release("throttle")
+
+        assert scheduler.limit == 4
+
+    def test_lower_priority_number_goes_first(self):
+        """Test that queued requests are admitted in priority order."""
+        scheduler = make_scheduler(initial_concurrency=1, max_concurrency=1)
+        scheduler.acquire()
+        order = []
+
+        def request(priority):
+            scheduler.acquire(priority=priority)
+            order.append(priority)
+            scheduler.release()
+
+        threads = []
+        for priority in (5, 1, 3):
+            thread = threading.Thread(target=request, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            while len(scheduler._waiting) < len(threads):
+                time.sleep(0.001)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+
+        assert order == [1, 3, 5]
+
+    def test_waits_for_token_budget_reset(self):
+        """Test that a request larger than the remaining budget waits for the reset."""
+        scheduler = make_scheduler()
+        reset = datetime.now(timezone.utc) + timedelta(seconds=0.2)
+        scheduler.observe(
+            {
+                "anthropic-ratelimit-input-tokens-remaining": "100",
+                "anthropic-ratelimit-input-tokens-reset": reset.isoformat(),
+            }
+        )
+
+        started = time.monotonic()
+        scheduler.acquire(tokens=50)
+        scheduler.release()
+        assert time.monotonic() - started < 0.1
+
+        scheduler.acquire(tokens=80)
+        scheduler.release()
+        assert time.monotonic() - started >= 0.15
+
+    def test_retry_after_pauses_admission(self):
+        scheduler = make_scheduler()
+        scheduler.observe({"retry-after": "0.2"})
+
+        started = time.monotonic()
+        scheduler.acquire()
+        scheduler.release()
+
+        assert time.monotonic() - started >= 0.15
+
+    def test_cancelled_async_wait_keeps_no_slot(self):
+        """Test that cancelling run_async while it waits gives its turn back."""
+        import asyncio
+
+        scheduler = make_scheduler(initial_concurrency=1, max_concurrency=1)
+        scheduler.acquire()
+
+        async def scenario():
+            async def call():
+                return "sent"
+
+            waiting = asyncio.create_task(scheduler.run_async(call))
+            await asyncio.sleep(0.05)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            scheduler.release()
+            await asyncio.sleep(0.05)
+
+        asyncio.run(scenario())
+
+        assert scheduler.active == 0
+        assert not scheduler._waiting
+
+
+class TestRetries:
+    def test_classify_error(self):
+        overloaded = {"type": "error", "error": {"type": "overloaded_error"}}
+        assert classify_error(FakeError(429)) == "throttle"
+        assert classify_error(FakeError(200, overloaded)) == "throttle"
+        assert classify_error(FakeError(400)) is None
+        assert classify_error(ValueError()) is None
+
+    def test_run_retries_throttled_calls(self):
+        scheduler = make_scheduler()
+        attempts = []
+
+        def call():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise FakeError(529)
+            return "ok"
+
+        assert scheduler.run(call) == "ok"
+        assert scheduler.stats["retries"] == 2
+        assert scheduler.active == 0
+
+    def test_run_gives_up_on_permanent_errors(self):
+        scheduler = make_scheduler()
+
+        def call():
+            raise FakeError(400)
+
+        with pytest.raises(FakeError):
+            scheduler.run(call)
+        assert scheduler.stats["retries"] == 0
+        assert scheduler.active == 0
+
+    def test_backoff_is_bounded(self):
+        scheduler = make_scheduler(backoff_base=1, backoff_max=4)
+        assert all(0 <= scheduler.backoff(attempt) <= 4 for attempt in range(10))
+
+
+@pytest.mark.mock_api(RECORDING)
+@pytest.mark.parametrize(
+    "mock_api",
+    [
+        {"failures": [{"status": 429, "type": "rate_limit_error", "retry_after": 0}]},
+        {"failures": [{"type": "overloaded_error", "mid_stream": True}]},
+    ],
+    indirect=True,
+)
+def test_streaming_agent_recovers(mock_api, tmp_path, monkeypatch):
+    """Test that a throttled or broken stream is retried without leftovers."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "notes.txt").write_text("hello\n", encoding="utf-8")
+    monkeypatch.setattr(
+        "agent.scheduler.RequestScheduler.backoff", lambda self, attempt: 0.0
+    )
+    monkeypatch.setattr(streaming, "renderer", streaming.NullRenderer())
+    messages = [{"role": "user", "content": "Read notes.txt"}]
+
+    result = streaming.run_agent(messages)
+
+    assert result["stop_reason"] == "end_turn"
+    assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant"]
+    assert len(mock_api.request_sizes) == 3
+
+
+@pytest.mark.mock_api(RECORDING, failures=[{"status": 529, "type": "overloaded_error"}])
+def test_chat_retries_overloaded_response(mock_api, monkeypatch):
+    """Test that the non-streaming chat call retries a 529 through the scheduler."""
+    monkeypatch.setattr(
+        "agent.scheduler.RequestScheduler.backoff", lambda self, attempt: 0.0
+    )
+
+    response = loop.chat([{"role": "user", "content": "Hi"}])
+
+    assert response.stop_reason == "tool_use"
+    assert len(mock_api.request_sizes) == 2
+
+
+
+@pytest.mark.mock_api(RECORDING)
+def test_slow_renderer_does_not_hold_a_slot(mock_api, tmp_path, monkeypatch):
+    """Test that a stream's slot is free while its output waits on a slow reader."""
+    (tmp_path / "notes.txt").write_text("hello\n", encoding="utf-8")
+    scheduler = make_scheduler(initial_concurrency=1, max_concurrency=1)
+    monkeypatch.setattr(streaming, "get_scheduler", lambda: scheduler)
+    reader = threading.Event()
+
+    class SlowReader(streaming.NullRenderer):
+        def status(self, message):
+            reader.wait()
+
+    results = []
+    run = threading.Thread(
+        target=lambda: results.append(
+            streaming.run_agent(
+                [{"role": "user", "content": "Read notes.txt"}],
+                renderer=SlowReader(),
+                workdir=tmp_path,
+            )
+        )
+    )
+    run.start()
+    deadline = time.monotonic() + 2
+    while not mock_api.request_sizes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Another session gets the only slot although the reader has not caught up
+    other = threading.Thread(target=scheduler.acquire, daemon=True)
+    other.start()
+    other.join(2)
+    admitted = not other.is_alive()
+    reader.set()
+    other.join(5)
+    scheduler.release()
+    run.join(5)
+
+    assert admitted
+    assert results[0]["stop_reason"] == "end_turn"
+    assert len(mock_api.request_sizes) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
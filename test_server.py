@@ -0,0 +1,164 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from agent import streaming
+from agent.server import AgentServer, SessionOutput
+from agent.tools import handle_text_editor_tool
+
+RECORDING = [
+    {
+        "content": [
+            {
+                "type": "tool_use",
+                "id": "toolu_1",
+                "name": "str_replace_editor",
+                "input": {"command": "view", "path": "notes.txt"},
+            },
+        ]
+    },
+    {"content": [{"type": "text", "text": "Done."}]},
+]
+
+pytestmark = pytest.mark.mock_api(RECORDING)
+
+
+async def send_message(port, session_id, content):
+    """Send one message and collect the records of its turn."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = {"type": "message", "session": session_id, "content": content}
+    writer.write((json.dumps(request) + "\n").encode())
+    await writer.drain()
+    records = []
+    while line := await reader.readline():
+        records.append(json.loads(line))
+        if records[-1]["type"] in ("done", "error"):
+            break
+    writer.close()
+    await writer.wait_closed()
+    return records
+
+
+def test_sessions_run_concurrently_in_their_own_sandbox(mock_api, tmp_path):
+    """Test that two sessions keep separate histories and working directories."""
+
+    async def scenario():
+        agent_server = AgentServer(root=tmp_path)
+        server = await agent_server.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        sessions = [agent_server.new_session() for _ in range(2)]
+        for session, text in zip(sessions, ("alpha", "beta")):
+            (session.workdir / "notes.txt").write_text(text + "\n", encoding="utf-8")
+
+        async with server:
+            results = await asyncio.gather(
+                *(send_message(port, s.id, "Read notes.txt") for s in sessions)
+            )
+        return sessions, results
+
+    sessions, results = asyncio.run(scenario())
+
+    for session, records, text in zip(sessions, results, ("alpha", "beta")):
+        assert records[0] == {"type": "session", "session": session.id}
+        assert records[-1]["type"] == "done"
+        assert records[-1]["stop_reason"] == "end_turn"
+        assert session.messages[2]["content"][0]["content"] == f"1: {text}"
+    assert len(mock_api.request_sizes) == 4
+
+
+def test_unknown_session_is_an_error(tmp_path):
+    """Test that messages for a session that does not exist are refused."""
+
+    async def scenario():
+        server = await AgentServer(root=tmp_path).start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await send_message(port, "missing", "Hi")
+
+    records = asyncio.run(scenario())
+
+    assert records == [{"type": "error", "message": "Unknown session missing"}]
+
+
+def test_session_output_blocks_writer_when_full():
+    """Test that a full output queue holds back the writing thread."""
+
+    async def scenario():
+        output = SessionOutput(asyncio.get_running_loop(), maxsize=1)
+        written = []
+
+        def produce():
+            for chunk in ("a", "b", "c"):
+                output.write(chunk)
+                written.append(chunk)
+            output.close()
+
+        thread = threading.Thread(target=produce)
+        thread.start()
+        await asyncio.sleep(0.1)
+        blocked_at = list(written)
+
+        received = []
+        while (chunk := await output.queue.get()) is not None:
+            received.append(chunk)
+        await asyncio.to_thread(thread.join)
+        return blocked_at, received
+
+    blocked_at, received = asyncio.run(scenario())
+
+    assert blocked_at == ["a"]
+    assert received == ["a", "b", "c"]
+
+
+def test_workdir_keeps_tool_calls_inside(tmp_path):
+    """Test that sandboxed paths resolve inside the workdir and cannot escape it."""
+    (tmp_path / "inside.txt").write_text("safe\n", encoding="utf-8")
+    (tmp_path / "escape.txt").symlink_to("/etc/hostname")
+
+    def view(path):
+        call = {"input": {"command": "view", "path": path}}
+        return handle_text_editor_tool(call, root=tmp_path)
+
+    assert view("inside.txt") == "1: safe"
+    assert view(str(tmp_path / "inside.txt")) == "1: safe"
+    assert "security" in view("escape.txt")
+
+
+def test_directory_views_show_sandbox_relative_paths(tmp_path):
+    """Test that listings in a sandbox do not reveal where the sandbox lives."""
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.txt").write_text("a\n", encoding="utf-8")
+
+    def view(path):
+        call = {"input": {"command": "view", "path": path}}
+        return handle_text_editor_tool(call, root=tmp_path)
+
+    assert str(tmp_path) not in view("sub")
+    assert view("sub").startswith("Directory contents of sub:")
+    assert view("").startswith("Directory contents of .:")
+    assert str(tmp_path) not in view("missing.txt")
+
+
+def test_run_agent_uses_given_renderer(mock_api, tmp_path):
+    """Test that run_agent sends output to the renderer it is given."""
+    (tmp_path / "notes.txt").write_text("hello\n", encoding="utf-8")
+    records = []
+
+    class Recorder(streaming.NullRenderer):
+        def status(self, message):
+            records.append(message)
+
+    result = streaming.run_agent(
+        [{"role": "user", "content": "Read notes.txt"}],
+        renderer=Recorder(),
+        workdir=tmp_path,
+    )
+
+    assert result["stop_reason"] == "end_turn"
+    assert "📁 Tool result: 1: hello" in records
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+import pytest
+
+from agent.server import AgentServer
+from agent.store import SessionStore
+from test_server import RECORDING, send_message
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def test_history_survives_reopen(tmp_path):
+    """Test that appended messages are read back in order."""
+    store = SessionStore(tmp_path)
+    messages = store.open("abc")
+    for i in range(5):
+        messages.append(user(f"message {i}"))
+    messages.close()
+
+    assert store.open("abc") == [user(f"message {i}") for i in range(5)]
+
+
+def test_resume_reads_snapshot_and_tail_only(tmp_path):
+    """Test that records covered by a snapshot are not parsed again."""
+    store = SessionStore(tmp_path, snapshot_every=4)
+    messages = store.open("abc")
+    for i in range(6):
+        messages.append(user(f"message {i}"))
+    messages.close()
+
+    # Corrupt the records the snapshot already covers; resume must not read them
+    log = tmp_path / "abc.jsonl"
+    lines = log.read_bytes().splitlines(keepends=True)
+    log.write_bytes(b"x" * sum(len(line) for line in lines[:4]) + b"".join(lines[4:]))
+
+    assert store.open("abc") == [user(f"message {i}") for i in range(6)]
+
+
+def test_snapshot_keeps_compacted_history(tmp_path):
+    """Test that the snapshot stores the in-memory list, not the raw log."""
+    store = SessionStore(tmp_path, snapshot_every=3)
+    messages = store.open("abc")
+    messages.append(user("old"))
+    messages.append(user("older"))
+    messages[:2] = [user("digest")]
+    messages.append(user("new"))
+    messages.close()
+
+    assert store.open("abc") == [user("digest"), user("new")]
+    assert len((tmp_path / "abc.jsonl").read_text().splitlines()) == 3
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    """Test that a partial record from a crash is ignored and overwritten."""
+    store = SessionStore(tmp_path)
+    messages = store.open("abc")
+    messages.append(user("kept"))
+    messages.close()
+    with open(tmp_path / "abc.jsonl", "ab") as f:
+        f.write(b'{"role": "user", "con')
+
+    messages = store.open("abc")
+    assert messages == [user("kept")]
+    messages.append(user("next"))
+    messages.close()
+
+    lines = (tmp_path / "abc.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [user("kept"), user("next")]
+
+
+def test_invalid_session_id_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        SessionStore(tmp_path).open("../escape")
+
+
+@pytest.mark.mock_api(RECORDING)
+def test_server_resumes_session_after_restart(mock_api, tmp_path):
+    """Test that a new server picks up a stored session on its next message."""
+
+    async def turn(session_id, prepare=None):
+        agent_server = AgentServer(
+            root=tmp_path / "sessions", store=SessionStore(tmp_path / "logs")
+        )
+        if prepare:
+            session_id = prepare(agent_server)
+        server = await agent_server.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            records = await send_message(port, session_id, "Read notes.txt")
+        return session_id, records, agent_server
+
+    def prepare(agent_server):
+        session = agent_server.new_session()
+        (session.workdir / "notes.txt").write_text("hello\n", encoding="utf-8")
+        return session.id
+
+    session_id, first, _ = asyncio.run(turn(None, prepare))
+    _, second, restarted = asyncio.run(turn(session_id))
+
+    assert first[-1]["type"] == second[-1]["type"] == "done"
+    messages = restarted.sessions[session_id].messages
+    # Both turns are complete tool exchanges, the first one loaded from disk
+    assert len(messages) == 8
+    assert messages[2]["content"][0]["content"] == "1: hello"
+    assert messages[4] == user("Read notes.txt")
+
+
+@pytest.mark.mock_api(RECORDING, latency=0.2)
+def test_close_waits_for_the_running_turn(mock_api, tmp_path):
+    """Test that closing a session mid-turn lets the turn finish and log it first."""
+    store = SessionStore(tmp_path / "logs")
+
+    async def scenario():
+        agent_server = AgentServer(root=tmp_path / "sessions", store=store)
+        session = agent_server.new_session()
+        (session.workdir / "notes.txt").write_text("hello\n", encoding="utf-8")
+        server = await agent_server.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            turn = asyncio.create_task(send_message(port, session.id, "Read notes.txt"))
+            await asyncio.sleep(0.1)
+            closed = await agent_server.close_session(session.id)
+            records = await turn
+            logged = len(store.open(session.id))
+            late = await send_message(port, session.id, "Read notes.txt")
+        return closed, records, logged, late
+
+    closed, records, logged, late = asyncio.run(scenario())
+
+    assert closed
+    assert records[-1]["type"] == "done"
+    assert logged == 4
+    # The session is gone from memory but can be resumed from the store
+    assert late[-1]["type"] == "done"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])